@@ -1,687 +1,3598 @@
 import requests
+from requests.adapters import HTTPAdapter
 from requests.auth import HTTPBasicAuth
+from urllib3.exceptions import NewConnectionError
 import json
-import pdb
+import os
+import sys
 import logging
+import random
 import re
-from pprint import pprint
+import math
+import atexit
+import threading
+import time
+import unicodedata
+from datetime import datetime, timezone
+from collections import defaultdict, deque
+from functools import lru_cache
+from itertools import chain
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from urllib.parse import quote, urljoin, urlsplit
 
 
 
-def name_processor(name):
+# characters removed from normalized names
+NAME_PATTERN = re.compile("[^a-z0-9]")
+
+# letters that unicode decomposition leaves as they are
+FOLDED_LETTERS = str.maketrans({'ø':'o', 'æ':'ae', 'œ':'oe', 'ß':'ss', 'đ':'d', 'ł':'l', 'þ':'th'})
+
+
+
+@lru_cache(maxsize=65536)
+def name_processor(name, fold=False):
     """
-    Helper function to normalize names to lowercase, no spaces or special characters
+    Helper function to normalize names to lowercase, no spaces or special characters.
+    If {fold} is True, letters with diacritics are folded to their plain versions (Å -> a, ø -> o, æ -> ae) instead of being removed.
     """
-    return re.sub("[^a-z0-9]", '', name.lower())
+    name = name.lower()
+    if fold:
+        name = unicodedata.normalize('NFKD', name.translate(FOLDED_LETTERS))
+    return NAME_PATTERN.sub('', name)
 
 
 
 
-class Confluence_server_api:
+def normalize_many(names, fold=False):
     """
-    Class to interact with the Confluence Server API.
+    Helper function to normalize all names in {names} with name_processor. Returns a list.
     """
+    return [ name_processor(name, fold) for name in names ]
 
-    # create a object from a config file
-    def __init__(self, config):
 
-        self.user       = config['user']
-        self.password   = config['password']
-        self.baseurl    = config['url']
-        self.auth       = HTTPBasicAuth(self.user, self.password)
-        self.headers    = {
-                            "Accept": "application/json",
-                            "Content-Type": "application/json",
-                          }
 
 
+def page_results(response):
+    """
+    Helper function to get the list of results from a paginated response. Returns None if the response is not a listing.
+    """
+    if isinstance(response, list):
+        return response
+    return response.get('results')
 
 
 
 
-    def get(self, url, params=None, data=None, paginate=True):
-        """
-        Wrapper function to make API calls that will keep sending subsequent requests if the answer is paginated.
-        """
+def page_total(response):
+    """
+    Helper function to get the total number of results of a paginated listing from its first page, or None if the API doesn't say.
+    """
+    if not isinstance(response, dict):
+        return None
+    total = response.get('totalSize', response.get('total'))
+    return total if isinstance(total, int) else None
 
 
-#        pdb.set_trace()
-        logging.debug(f"Fetching URL: {url}")
 
-        # fetch results
-        response = requests.request("GET", url, headers=self.headers, params=params, data=data, auth=self.auth,).json()
 
-        # keep asking for more until there is no more or the limit is reached
-        #pdb.set_trace()
-        if 'size' in response.keys() and response['size'] <= params.get('limit', 10000) and paginate:
+def next_link(response, url):
+    """
+    Helper function to get the full url of the next page from a response's _links.next, if there is one.
+    """
+    if not isinstance(response, dict):
+        return None
+
+    # the next link is relative to the base url of the api
+    links = response.get('_links', {})
+    if not links.get('next'):
+        return None
+    if links['next'].startswith('http'):
+        return links['next']
+    if links.get('base'):
+        return f"{links['base']}{links['next']}"
+    return urljoin(url, links['next'])
+
 
-            logging.debug(f"Possible API pagination detected, continuing sending more requests.")
 
-            # save inital response
-            results = response['results']
 
-            # loop until all hits are collected
-            i = 0
-            while response['results'] and len(results) < params.get('limit', 10000):
+def retry_after(headers):
+    """
+    Helper function to get the number of seconds to wait from a Retry-After header, given either as seconds or as a date. Returns None if missing.
+    """
+    value = headers.get('Retry-After')
+    if not value:
+        return None
+
+    # seconds
+    try:
+        return max(float(value), 0)
+    except ValueError:
+        pass
+
+    # a http or iso date
+    from email.utils import parsedate_to_datetime
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        try:
+            when = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        except ValueError:
+            return None
+    return max((when - datetime.now(timezone.utc)).total_seconds(), 0)
 
 
-                logging.debug(f"Fetching URL: {url} starting from {len(results) + 1}")
 
-                # set new start point for query
-                params['start'] = len(results) + 1
 
-                # ask for a new batch of results
-                response = requests.request("GET",
-                                            url,
-                                            headers=self.headers,
-                                            params=params,
-                                            data=data,
-                                            auth=self.auth,
-                                            ).json()
+def format_duration(seconds):
+    """
+    Helper function to format {seconds} as h:mm:ss.
+    """
+    seconds = int(seconds)
+    return f"{seconds // 3600}:{seconds % 3600 // 60:02}:{seconds % 60:02}"
 
-                # save the new batch together with the previous ones
-                results += response['results']
 
-                # increase counter
-                i+=1
-            
-            logging.debug(f"API pagination finished, {i} pages fetched.")
 
-        elif 'results' in response.keys():
-            # got them all in the first request
-            results = response['results']
 
-        # other type of response, return it all
-        else:
-            return response
+class Progress:
+    """
+    Progress of a bulk operation on {total} items, safe to update from concurrent workers. Logs the items done, items per second, ETA,
+    requests in flight and errors at most every {interval} seconds, and on close appends a JSON run summary line to {summary_file} if given.
+    """
 
-        # return at most the limit the user asked for, if any
-        return results[:params.get('limit', 10000)]
+    def __init__(self, total, description='items', interval=5, summary_file=None):
 
+        self.total        = total
+        self.description  = description
+        self.interval     = interval
+        self.summary_file = summary_file
 
+        # init counters
+        self.done          = 0
+        self.errors        = 0
+        self.skipped       = 0
+        self.in_flight     = 0
+        self.max_in_flight = 0
+        self.started       = time.monotonic()
+        self.started_at    = datetime.now(timezone.utc)
+        self.last_log      = self.started
+        self.lock          = threading.Lock()
 
 
 
-    def get_spaces(self, limit=1000, expand=None):
+
+
+    def start(self):
         """
-        Returns a list of spaces, limited in number by {limit}. Expands properties listed comma-separated in {expand}.
+        Marks an item as in flight.
         """
+        with self.lock:
+            self.in_flight    += 1
+            self.max_in_flight = max(self.max_in_flight, self.in_flight)
 
-        # if there is anything to expand
-        if expand:
-            expand = f"&expand={expand}"
-        else:
-            expand = ''
 
-        # define url and send request
-        url = f"{self.baseurl}/rest/api/space?limit={limit}{expand}"
-        logging.debug(f"Fetching URL: {url}")
 
-        return requests.request("GET", url, headers=self.headers, auth=self.auth).json()['results']
+    def finish(self, done=1, errors=0):
+        """
+        Marks an item in flight as finished, having completed {done} items of which {errors} failed.
+        """
+        with self.lock:
+            self.in_flight -= 1
+            self.done      += done
+            self.errors    += errors
+
 
 
-    def update_space_name(self, space_key, name):
+    def skip(self, skipped=1):
         """
-        Updates a space's name. Takes a space key string and a new name as a string as inputs.
+        Counts {skipped} items as not needing to be done, taking them out of the total.
         """
-        
-        # define url and payload, then send the request
-        url = f"{self.baseurl}/rest/api/space/{space_key}"
-        payload = f'{{"name": "{name}"}}'
+        with self.lock:
+            self.skipped += skipped
+            self.total   -= skipped
 
-        logging.debug(f"Putting URL: {url}\tPayload: {payload}")
-        #pdb.set_trace()
-        return requests.put(url, data=payload, headers=self.headers, auth=self.auth).json()
 
 
-#    def get_groups(self, limit=1000, expand=None):
-#        """
-#        Returns a list of groups, limited in number by {limit}. Expands properties listed comma-separated in {expand}.
-#        """
-#
-#        if expand:
-#            expand = f"&expand={expand}"
-#        else:
-#            expand = ''
-#
-#        # define url and send request
-#        url = f"{self.baseurl}/rest/api/group?limit={limit}{expand}"
-#        return requests.request("GET", url, headers=self.headers, auth=self.auth).json()['results']
 
 
-#    def get_space_property(self, space_key, expand=None):
-#        """
-#        Returns properties of a space. Expands properties listed comma-separated in {expand}.
-#        """
-#
-#        if expand:
-#            expand = f"?expand={expand}"
-#        else:
-#            expand = ''
-#
-#        pdb.set_trace()
-#        # define url and send request
-#        url = f"{self.baseurl}/rest/api/space/{space_key}/property{expand}"
-#        return requests.request("GET", url, headers=self.headers, auth=self.auth).json()['results']
+    def per_second(self):
+        return self.done / max(time.monotonic() - self.started, 1e-9)
 
 
 
+    def eta(self):
+        """
+        Returns the estimated seconds left at the current rate, None before anything is done.
+        """
+        if not self.done:
+            return None
+        return max(self.total - self.done, 0) / self.per_second()
 
 
 
-    def get_groups(self):
+
+
+    def log(self, force=False):
         """
-        Returns a list of all groups.
+        Logs the progress, unless it was logged less than {interval} seconds ago.
         """
+        now = time.monotonic()
+        if not force and now - self.last_log < self.interval:
+            return
+        self.last_log = now
 
-        # get all groups
-        url = f"{self.baseurl}/rest/api/group"
-        params = {
-                    'limit':1000,
-                 }
-        return self.get(url, params=params)
+        eta = self.eta()
+        logging.info(f"{self.description.capitalize()} {self.done}/{self.total} ({self.per_second():.1f}/s, ETA {format_duration(eta) if eta is not None else '?'}, {self.in_flight} in flight, {self.errors} errors)")
 
 
 
 
 
-    def get_group_members(self, group_name):
+    def summary(self):
         """
-        Returns a list of all users who are members of a group.
+        Returns a dict summarizing the run so far.
         """
-
-        # get all group members
-        url = f"{self.baseurl}/rest/api/group/{group_name}/member"
-        params = {
-                    'limit':1000,
-                 }
-        return self.get(url, params=params)
+        seconds = time.monotonic() - self.started
+        return {
+                    'script'       : os.path.basename(sys.argv[0]),
+                    'description'  : self.description,
+                    'started_at'   : self.started_at.isoformat(),
+                    'seconds'      : round(seconds, 3),
+                    'total'        : self.total,
+                    'done'         : self.done,
+                    'errors'       : self.errors,
+                    'skipped'      : self.skipped,
+                    'per_second'   : round(self.done / max(seconds, 1e-9), 3),
+                    'max_in_flight': self.max_in_flight,
+               }
 
 
 
 
 
-    def get_users(self):
+    def close(self):
         """
-        Returns a list of all users.
+        Logs the final progress and appends the run summary to {summary_file}. Returns the summary.
         """
+        self.log(force=True)
+        summary = self.summary()
+        if self.summary_file:
+            with open(self.summary_file, 'a') as summary_file:
+                summary_file.write(json.dumps(summary) + "\n")
+        return summary
 
 
-        ### group based method
 
-        # get all groups
-        groups = self.get_groups()
 
-        # get members of each group
-        group_users = []
-        for group in groups:
-            group_users += self.get_group_members(group['name'])
+def fetch_concurrently(fetch, items, workers=8, description='items', progress=None, tally=None, summary_file=None):
+    """
+    Helper function that calls {fetch} on each of {items} using at most {workers} threads. Yields (item, result) tuples in the order
+    they complete, so the results can be merged as they arrive, and reports the progress as it goes.
+    Pass a Progress as {progress} to count into it instead of a new one, which the caller then closes. {tally} takes a result and returns
+    the number of items it completed and how many of them failed, (1, 0) by default. The run summary is written to {summary_file}, if given.
+    If a fetch raises, the exception is raised here and the fetches that have not started yet are cancelled.
+    """
 
+    # init
+    items = list(items)
+    total = len(items)
+    if not total:
+        return
+    own_progress = progress is None
+    if own_progress:
+        progress = Progress(total, description, summary_file=summary_file)
+
+    def run(item):
+        progress.start()
+        try:
+            result = fetch(item)
+        except Exception:
+            progress.finish(errors=1)
+            raise
+        progress.finish(*(tally(result) if tally else (1, 0)))
+        return result
+
+    executor = ThreadPoolExecutor(max_workers=max(1, min(workers, total)))
+    try:
+        futures = { executor.submit(run, item):item for item in items }
+        for future in as_completed(futures):
+            progress.log()
+            yield futures[future], future.result()
+    except BaseException:
+        # a failed fetch, or the caller stopping early, cancels the queued fetches instead of waiting for them
+        executor.shutdown(wait=False, cancel_futures=True)
+        raise
+    else:
+        executor.shutdown()
+    finally:
+        if own_progress:
+            progress.close()
+
+
+
+
+class Rate_limiter:
+    """
+    Adaptive token bucket shared by all requests of an API object. The rate is raised additively while requests go through and cut
+    multiplicatively when the API answers 429 or 503, pausing all requests for as long as the Retry-After or X-RateLimit-Reset headers ask.
+    """
 
-        ### CQL method, won't return disabled accounts
-        search_users = [ user['user'] for user in self.search(cql_query='type=user')]
+    def __init__(self, rate=20, min_rate=0.5, max_rate=200, increase=1, decrease=0.5):
 
-        # merge lists and remove duplicates based on username
-        merged_users = { user['username']:user for user in group_users}
-        merged_users.update({ user['username']:user for user in search_users})
+        self.rate       = rate
+        self.min_rate   = min_rate
+        self.max_rate   = max_rate
+        self.increase   = increase
+        self.decrease   = decrease
 
-        # return as a list of users
-        return [ user for user in merged_users.values() ]
+        # init
+        self.tokens       = 1
+        self.last_refill  = time.monotonic()
+        self.paused_until = 0
+        self.n_throttled  = 0
+        self.lock         = threading.Lock()
 
 
 
 
-    def get_user_info(self, username):
+
+    def reserve(self):
         """
-        Returns more info about a username.
+        Takes a token from the bucket and returns the number of seconds to wait before the request may be sent.
         """
+        with self.lock:
 
-        # get user info
-        url = f"{self.baseurl}/rest/api/user?username={username}"
-        url = f"{self.baseurl}/rest/mobile/1.0/profile/{username}"
-        params = {
-                    'limit':1000,
-                 }
-        return self.get(url, params=params)
+            # refill the bucket according to the current rate, allowing a burst of at most one second's worth of requests
+            now = time.monotonic()
+            self.tokens      = min(max(self.rate, 1), self.tokens + (now - self.last_refill) * self.rate)
+            self.last_refill = now
 
+            # going into debt means waiting until the token has been refilled
+            self.tokens -= 1
+            return max(-self.tokens / self.rate, self.paused_until - now, 0)
 
 
 
-    def search(self, cql_query):
+
+
+    def acquire(self):
         """
-        Returns the result of a CQL query (https://developer.atlassian.com/server/confluence/advanced-searching-using-cql/).
+        Blocks until a request may be sent.
         """
-
-        url = f"{self.baseurl}/rest/api/search"
-        params = {
-                    'cql':cql_query,
-                    'limit':1000,
-                 }
-        return self.get(url, params=params)
+        time.sleep(self.reserve())
 
 
 
 
 
-    def find_possible_guest_users(self, n_spaces=1, ignore_personal_spaces=False, ignore_unlicenced=True, ignore_deleted=True):
+    def update(self, status_code, headers):
         """
-        Find all users that are members of maximum {n_spaces} spaces.
-        If {ignore_personal_spaces} is True it will not count the personal space (a space with same name as username) to wards this number.
-        Will only check if a user is mentioned in a space's permissions, not what permissions they actually have.
-
-        A huge function since there is no way to ask Confluence about what permissions a user has. You have to reconstruct the permissions
-        by asking all spaces which users and groups have permission to it, and which group members each group has.
+        Adjusts the rate after a response. Returns the number of seconds the API asked us to back off, or None if the request was not throttled.
         """
+        with self.lock:
 
-        from thefuzz import fuzz
-    #pdb.set_trace()
+            now = time.monotonic()
 
-        # get a list of all spaces
-        spaces = self.get_spaces(expand="permissions")
-        
-        # init
-        user_permissions = {}
-        group_permissions = {}
-        
-        ## Get all user-space and group-space  memberships
-        # go through all spaces
-        logging.info("Parsing permissions.")
-        for space in spaces:
+            # throttled, slow down and pause for as long as the api asks
+            if status_code in (429, 503):
+                self.n_throttled += 1
+                self.rate         = max(self.min_rate, self.rate * self.decrease)
+                backoff           = retry_after(headers) or 1 / self.rate
+                self.paused_until = max(self.paused_until, now + backoff)
+                logging.debug(f"Throttled with status {status_code}, backing off {backoff:.1f}s and lowering rate to {self.rate:.1f} requests/s.")
+                return backoff
 
-            #pdb.set_trace()
-            
-            logging.debug(f"Space: {space['name']}")
-        
-            # go through all permissions
-            for permission in space['permissions']:
-        
-                # skip empty permissions
-                if 'subjects' not in permission.keys():
-                    continue
-        
-                # if it is a user permission
-                if permission['subjects'].get('user'):
-        
-                    # for all users with permission
-                    for user in permission['subjects']['user']['results']:
-        
-                        # save the user and space info
-                        try:
-                            logging.debug(f"User: {user['accountId']}")
-                            user_permissions[user['accountId']]['spaces'][space['key']] = space
-
-                        except KeyError:
-                            # if it is the first time seeing this user
-                            user_permissions[user['accountId']] = {}
-                            user_permissions[user['accountId']]['spaces'] = {space['key']:space}
-                            user_permissions[user['accountId']]['user'] = user
-        
-                # if it is a group permission
-                elif permission['subjects'].get('group'):
-        
-                    # for all groups with permission
-                    for group in permission['subjects']['group']['results']:
-        
-                        # save the group and space info
-                        try:
-                            logging.debug(f"Group: {group['id']}")
-                            group_permissions[group['id']]['spaces'][space['key']] = space
-                        except KeyError:
-                            # if it is the first time seeing this group
-                            group_permissions[group['id']] = {}
-                            group_permissions[group['id']]['spaces'] = {space['key']:space}
-                            group_permissions[group['id']]['group'] = group
-        
-        logging.debug("Parsing permissions finished.")
-        
-        ## get a complete list of all users
-        logging.info("Fetching all users from API.")
-        users = self.get_users() 
+            # out of quota, pause until it resets without changing the rate
+            if headers.get('X-RateLimit-Remaining') == '0':
+                reset = retry_after({'Retry-After':headers.get('X-RateLimit-Reset')})
+                if reset:
+                    self.paused_until = max(self.paused_until, now + reset)
 
-        # add all users to user_permissions dict to make sure all users are present, even those who don't have any stated permissions in spaces
-        for user in users:
+            # close to the limit, hold the current rate
+            elif headers.get('X-RateLimit-NearLimit', '').lower() == 'true':
+                pass
 
-            # find missing users
-            if user['user']['accountId'] not in user_permissions:
+            # all good, speed up by {increase} requests/s per second of requests
+            else:
+                self.rate = min(self.max_rate, self.rate + self.increase / self.rate)
 
-                # initiate entry
-                logging.debug(f"Missing user: {user}")
-                user_permissions[user['user']['accountId']] = {'spaces':{}, 'user':user['user']}
+            return None
 
 
-        # get all groups
-        logging.info(f"Fetching groups.")
-        groups = self.get_groups()
 
-        # for each groups, get members
-        for group in groups:
 
-            # fetch group members
-            logging.info(f"Fetching group memebers from {group['name']}")
-            members = self.get_group_members(group_id=group['id'])
+class Retry_policy:
+    """
+    Decides which failed requests to send again and how long to wait in between, using exponential backoff with full jitter.
+    Idempotent methods (GET, HEAD, PUT, DELETE) are retried on connection errors and 5xx responses. Other methods, like POST, are only
+    retried if the connection failed before the request reached the API, unless the caller says the request is safe to repeat.
+    Each method has its own budget of attempts in {max_attempts}.
+    """
 
-            # initiate entry if group is missing in group_permissions
-            if group['id'] not in group_permissions:
-                group_permissions[group['id']] = {'spaces':{}, 'group':group}
+    idempotent_methods = {'GET', 'HEAD', 'PUT', 'DELETE', 'OPTIONS'}
+    retry_statuses     = {500, 502, 503, 504}
 
-            # skip groups with no permissions
+    def __init__(self, max_attempts=None, base_delay=0.5, max_delay=30):
 
-            # for each member, add the groups spaces to the users spaces list
-            for member in members:
+        self.max_attempts = {'GET':6, 'HEAD':6, 'PUT':4, 'DELETE':4, 'POST':3}
+        self.max_attempts.update(max_attempts or {})
+        self.base_delay   = base_delay
+        self.max_delay    = max_delay
+        self.n_retries    = 0
 
-                # initiate entry if member is missing in member_permissions
-                if member['accountId'] not in user_permissions:
 
-                    # initiate entry
-                    user_permissions[member['accountId']] = {'spaces':{}, 'user':member}
 
-                # add group spaces to user spaces
-                user_permissions[member['accountId']]['spaces'].update(group_permissions[group['id']]['spaces'])
 
 
+    def is_idempotent(self, method, idempotent=False):
+        """
+        Returns True if a {method} request can be sent twice without harm, either by its method or because the caller says so in {idempotent}.
+        """
+        return idempotent or method in self.idempotent_methods
 
-        # make a lookup table for space keys to space names for easy access
-        key_to_name = { space['key']:space['name'] for space in spaces}
 
-        # init
-        logging.debug(f"Findinig users with {n_spaces} or less spaces.")
-        total_users = 0
-        found_users = 0
 
-        # find users with access to only n_spaces spaces
-        possible_guests = {}
-        for user_id,user_perm in user_permissions.items():
 
-            # filter out unlicensed users
-            if ignore_unlicenced and 'Unlicensed' in user_perm['user']['displayName']:
-                continue
 
-            # filter out deleted users
-            if ignore_deleted and 'Deleted' in user_perm['user']['displayName']:
-                continue
+    def should_retry(self, method, attempt, status_code=None, connect_failed=False, idempotent=False):
+        """
+        Returns True if a request that failed on attempt number {attempt}, counting from 0, should be sent again.
+        {status_code} is the status of the failed response, or None if the request raised a connection error.
+        {connect_failed} tells if that error happened before the request reached the API.
+        """
 
+        # out of attempts for this method
+        if attempt + 1 >= self.max_attempts.get(method, 1):
+            return False
 
-            # count user towards total
-            total_users += 1
+        idempotent = self.is_idempotent(method, idempotent)
 
-            # get the name of the space a user has access to
-            user_space_names = None
-            if len(user_permissions[user_id]['spaces']) > 0:
-                user_spaces = user_permissions[user_id]['spaces'].copy()
+        # connection errors, only safe to resend if the api could not have acted on the request
+        if status_code is None:
+            return idempotent or connect_failed
 
+        return idempotent and status_code in self.retry_statuses
 
 
-            # filter out perosnal spaces if asked to
-            if ignore_personal_spaces:
 
-                # go through the names of all spaces the user is a member of
-                for user_space_key, user_space in user_permissions[user_id]['spaces'].items():
 
-                    # if the space name is too similar, delete it
-                    if fuzz.ratio(name_processor(user_perm['user']['displayName']), name_processor(user_space['name'])) >= 75:
-                        del user_spaces[user_space_key]
 
+    def delay(self, attempt):
+        """
+        Returns a random number of seconds to wait before attempt number {attempt} + 1, between 0 and an exponentially growing cap.
+        """
+        self.n_retries += 1
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** attempt))
 
 
-            # check if the user is a member in few enough spaces to be eligible to be selected
-            if len(user_spaces) <= n_spaces:
 
-                # count number of found users
-                found_users += 1
 
-                # print user entry
-                logging.debug(f"{user_perm['user'].get('displayName', None)}\t{user_perm['user'].get('email', None)}\t{','.join(user_spaces.keys())}")
+# id-like parts of api paths, replaced to group requests per endpoint, numbers shorter than 3 digits are api versions
+ENDPOINT_PATTERNS = [
+                        (re.compile(r'/space/[^/]+'),                       '/space/{key}'),
+                        (re.compile(r'/group/(?!userByGroupId$)[^/]+(?=/)'), '/group/{id}'),
+                        (re.compile(r'/user/(?!memberof$)[^/]+(?=/)'),       '/user/{id}'),
+                        (re.compile(r'/profile/[^/]+'),                     '/profile/{username}'),
+                        (re.compile(r'/\d{3,}(?=/|$)'),                     '/{id}'),
+                    ]
 
-                # save the user in the keep list
-                possible_guests[user_id] = {'user':user_perm['user'], 'spaces':user_perm['spaces']}
 
 
-        logging.debug(f"Found {found_users} users out of {total_users} total users that are members of {n_spaces} or less spaces.")
-        return possible_guests
+def endpoint_template(url):
+    """
+    Helper function to get the endpoint of {url}, its path without the ids, space keys and names in it, e.g. /wiki/rest/api/space/{key}/permission.
+    """
+    path = urlsplit(url).path.rstrip('/')
+    for pattern, replacement in ENDPOINT_PATTERNS:
+        path = pattern.sub(replacement, path)
+    return path
 
 
 
 
+def percentile(values, fraction):
+    """
+    Helper function to get the nearest-rank percentile {fraction} (0-1) of the sorted list {values}.
+    """
+    return values[max(0, math.ceil(fraction * len(values)) - 1)]
 
 
 
 
+def record_request(hooks, method, url, response, started, retries, page):
+    """
+    Helper function to pass a record of a finished request to each of {hooks}. {response} is None if no response was received.
+    """
+    record = {
+                'method'  : method,
+                'endpoint': endpoint_template(url),
+                'status'  : response.status_code if response is not None else None,
+                'latency' : time.monotonic() - started,
+                'bytes'   : len(response.content) if response is not None else 0,
+                'retries' : retries,
+                'page'    : page,
+             }
+    for hook in hooks:
+        hook(record)
 
 
 
 
-class Confluence_cloud_api:
+class Request_stats:
     """
-    Class to interact with the Confluence Cloud API.
+    Request instrumentation hook. Api_session calls it with a dict for each request, holding the method, the endpoint template, the status
+    code (None if no response), the latency in seconds including retries, the size of the response body, the number of retries and the page
+    number of paginated listings. The records are summarized per endpoint, as a logged table or exported as JSON or Prometheus text.
     """
 
-    # create a object from a config file
-    def __init__(self, config):
+    def __init__(self):
 
-        self.user       = config['user']
-        self.api_token  = config['api_token']
-        self.baseurl    = config['url']
-        self.auth       = HTTPBasicAuth(self.user, self.api_token)
-        self.headers    = {
-                            "Accept": "application/json",
-                            "Content-Type": "application/json",
-                          }
+        self.records = defaultdict(list)
+        self.lock    = threading.Lock()
+
+
+
+
+
+    def __call__(self, record):
+        with self.lock:
+            self.records[(record['method'], record['endpoint'])].append(record)
+
+
+
+
+
+    def summary(self):
+        """
+        Returns a list with a dict of counts, latency percentiles and totals per endpoint, the endpoints taking the most time first.
+        """
+
+        # init
+        summary = []
+
+        with self.lock:
+            records = { key:list(endpoint_records) for key, endpoint_records in self.records.items() }
+
+        for (method, endpoint), endpoint_records in records.items():
+            latencies = sorted(record['latency'] for record in endpoint_records)
+            summary.append({
+                                'method'    : method,
+                                'endpoint'  : endpoint,
+                                'count'     : len(endpoint_records),
+                                'errors'    : sum(1 for record in endpoint_records if record['status'] is None or record['status'] >= 400),
+                                'retries'   : sum(record['retries'] for record in endpoint_records),
+                                'bytes'     : sum(record['bytes'] for record in endpoint_records),
+                                'max_page'  : max((record['page'] or 1) for record in endpoint_records),
+                                'p50'       : percentile(latencies, 0.50),
+                                'p95'       : percentile(latencies, 0.95),
+                                'p99'       : percentile(latencies, 0.99),
+                                'total_time': sum(latencies),
+                           })
+
+        return sorted(summary, key=lambda endpoint: endpoint['total_time'], reverse=True)
+
+
+
+
+
+    def log_summary(self):
+        """
+        Logs the summary as a table, if any requests were recorded.
+        """
+        summary = self.summary()
+        if not summary:
+            return
+
+        lines = [f"{'method':<7}{'endpoint':<55}{'count':>7}{'errors':>7}{'retries':>8}{'MB':>9}{'p50 ms':>9}{'p95 ms':>9}{'p99 ms':>9}{'total s':>9}"]
+        for endpoint in summary:
+            lines.append(f"{endpoint['method']:<7}{endpoint['endpoint']:<55}{endpoint['count']:>7}{endpoint['errors']:>7}{endpoint['retries']:>8}"
+                         f"{endpoint['bytes'] / 1e6:>9.2f}{endpoint['p50'] * 1000:>9.0f}{endpoint['p95'] * 1000:>9.0f}{endpoint['p99'] * 1000:>9.0f}{endpoint['total_time']:>9.1f}")
+        logging.info("Requests per endpoint:\n" + "\n".join(lines))
+
+
+
+
+
+    def to_json(self):
+        """
+        Returns the summary as a JSON string.
+        """
+        return json.dumps(self.summary(), indent=4)
 
 
 
 
 
-    def get(self, url, params=None, data=None, expand=None, paginate=True):
+    def to_prometheus(self):
+        """
+        Returns the summary in the Prometheus text exposition format.
+        """
+
+        # init
+        metrics = [
+                    ('confluence_api_requests_total',          'counter', "Requests sent",                          lambda endpoint: endpoint['count']),
+                    ('confluence_api_request_errors_total',    'counter', "Requests that failed or got an error status", lambda endpoint: endpoint['errors']),
+                    ('confluence_api_request_retries_total',   'counter', "Requests resent",                        lambda endpoint: endpoint['retries']),
+                    ('confluence_api_response_bytes_total',    'counter', "Bytes received",                         lambda endpoint: endpoint['bytes']),
+                    ('confluence_api_request_seconds_total',   'counter', "Time spent on requests",                 lambda endpoint: endpoint['total_time']),
+                  ]
+        lines   = []
+        summary = self.summary()
+
+        for name, metric_type, description, value in metrics:
+            lines += [f"# HELP {name} {description}.", f"# TYPE {name} {metric_type}"]
+            for endpoint in summary:
+                lines.append(f'{name}{{method="{endpoint["method"]}",endpoint="{endpoint["endpoint"]}"}} {value(endpoint)}')
+
+        # latency percentiles
+        lines += ["# HELP confluence_api_request_seconds Request latency percentiles.", "# TYPE confluence_api_request_seconds summary"]
+        for endpoint in summary:
+            for quantile in ['p50', 'p95', 'p99']:
+                lines.append(f'confluence_api_request_seconds{{method="{endpoint["method"]}",endpoint="{endpoint["endpoint"]}",quantile="0.{quantile[1:]}"}} {endpoint[quantile]}')
+
+        return "\n".join(lines) + "\n"
+
+
+
+
+
+    def export(self, path):
+        """
+        Writes the summary to {path}, in the Prometheus text format if it ends in .prom, as JSON otherwise.
+        """
+        with open(path, 'w') as export:
+            export.write(self.to_prometheus() if path.endswith('.prom') else self.to_json())
+        logging.info(f"Wrote request stats to {path}")
+
+
+
+
+class Api_session:
+    """
+    Pooled keep-alive HTTP session shared by all API classes. Auth and headers are set once, and connections are kept open and reused between requests.
+    Every request is recorded by {stats}, a Request_stats, and passed to each of {hooks}, callables taking the same record dict.
+    The per endpoint summary is logged at exit, and exported to {stats_file} if given.
+    """
+
+    def __init__(self, auth, headers, pool_size=10, rate_limiter=None, retry_policy=None, max_throttle_retries=5, hooks=None, stats_file=None):
+
+        self.pool_size  = pool_size
+        self.rate_limiter = rate_limiter or Rate_limiter()
+        self.retry_policy = retry_policy or Retry_policy()
+        self.max_throttle_retries = max_throttle_retries
+        self.session    = requests.Session()
+        self.session.auth = auth
+        self.session.headers.update(headers)
+
+        # use a pool large enough to let concurrent requests reuse connections instead of opening new ones
+        self.adapter    = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount('https://', self.adapter)
+        self.session.mount('http://', self.adapter)
+
+        # init counters and instrumentation
+        self.n_requests = 0
+        self.lock       = threading.Lock()
+        self.stats      = Request_stats()
+        self.hooks      = [self.stats] + list(hooks or [])
+        self.stats_file = stats_file
+
+        # report how well connections were reused when the script finishes
+        atexit.register(self.log_connection_stats)
+
+
+
+
+
+    def request(self, method, url, idempotent=False, page=None, **kwargs):
+        """
+        Sends a request through the pooled session. Takes the same arguments as requests.Session.request.
+        Throttled requests are resent when the rate limiter allows, and failed requests are resent as the retry policy allows. A 503 might have
+        been acted on, so it is only resent for idempotent requests, while a 429 never was and is always resent.
+        Set {idempotent} if a non-idempotent method, like POST, is safe to send twice. {page} is the page number of a paginated listing,
+        only used for instrumentation.
+        """
+
+        # init
+        attempt   = 0
+        throttled = 0
+        started   = time.monotonic()
+
+        while True:
+
+            # wait for the rate limiter
+            self.rate_limiter.acquire()
+
+            # count the request
+            with self.lock:
+                self.n_requests += 1
+
+            try:
+                response = self.session.request(method, url, **kwargs)
+
+            except (requests.ConnectionError, requests.Timeout) as exception:
+
+                # a failed connect never reached the api, anything else might have
+                reason         = getattr(exception.args[0], 'reason', None) if exception.args else None
+                connect_failed = isinstance(exception, requests.ConnectTimeout) or isinstance(reason, NewConnectionError)
+                if not self.retry_policy.should_retry(method, attempt, connect_failed=connect_failed, idempotent=idempotent):
+                    record_request(self.hooks, method, url, None, started, attempt + throttled, page)
+                    raise
+
+                logging.warning(f"{method} {url} failed ({exception}), retrying.")
+                time.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+                continue
+
+            # resend the request if the api throttled it and it is safe, the rate limiter will hold it back as long as asked
+            throttle = self.rate_limiter.update(response.status_code, response.headers)
+            if throttle is not None and throttled < self.max_throttle_retries and (response.status_code == 429 or self.retry_policy.is_idempotent(method, idempotent)):
+                throttled += 1
+                continue
+
+            # resend the request after a server error, if it is safe
+            if self.retry_policy.should_retry(method, attempt, status_code=response.status_code, idempotent=idempotent):
+                logging.warning(f"{method} {url} returned {response.status_code}, retrying.")
+                time.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+                continue
+
+            record_request(self.hooks, method, url, response, started, attempt + throttled, page)
+            return response
+
+
+
+
+
+    def connection_stats(self):
+        """
+        Returns a dict with the number of requests sent and the number of connections opened to send them.
+        """
+
+        # sum up the connections opened by all pools (one pool per host)
+        n_connections = 0
+        pools = self.adapter.poolmanager.pools
+        for pool_key in list(pools.keys()):
+            pool = pools.get(pool_key)
+            if pool:
+                n_connections += pool.num_connections
+
+        return {
+                'requests'    : self.n_requests,
+                'connections' : n_connections,
+                'reused'      : max(self.n_requests - n_connections, 0),
+               }
+
+
+
+
+
+    def log_connection_stats(self):
+        """
+        Logs the connection reuse statistics and the requests per endpoint, if any requests have been sent, and exports the latter if asked to.
+        """
+        if not self.n_requests:
+            return
+
+        stats = self.connection_stats()
+        logging.info(f"Sent {stats['requests']} requests over {stats['connections']} connections ({stats['reused']} reused), retried {self.retry_policy.n_retries} times, throttled {self.rate_limiter.n_throttled} times, final rate {self.rate_limiter.rate:.1f} requests/s.")
+        self.stats.log_summary()
+        if self.stats_file:
+            self.stats.export(self.stats_file)
+
+
+
+
+
+    def get_json(self, url, params=None, data=None, page=None):
+        """
+        Sends a GET request and returns the decoded json response. {page} is the page number, if it is a page of a paginated listing.
+        """
+        logging.debug(f"Fetching URL: {url} {params or ''}")
+        response = self.request("GET", url, params=params, data=data, page=page)
+
+        # the api answers errors with a json body too, which must not be mistaken for data, e.g. an empty last page
+        response.raise_for_status()
+        return response.json()
+
+
+
+
+
+    def iter_pages(self, url, response, params=None, data=None, workers=1, max_results=None, start_param='start', limit_param='limit'):
+        """
+        Generator that yields the results of a paginated listing page by page, starting with the already fetched first page in {response}.
+        Follows _links.next when the API provides it and uses 0-based {start_param}/{limit_param} offsets otherwise.
+        Stops at the first page shorter than the page size, so a listing of N items costs ceil(N/limit) requests.
+        If {workers} is more than 1 and the first page tells the total, offset based pages are fetched that many at a time, never past the end.
+        At most {max_results} results are yielded, if given.
+        """
+
+        # init
+        n_results = 0
+        n_pages   = 0
+
+        # go through the pages, cutting the last one if the max number of results is reached
+        for page in self.follow_pages(url, response, dict(params or {}), data, workers, start_param, limit_param):
+
+            n_pages += 1
+            if max_results is not None and n_results + len(page) >= max_results:
+                yield page[:max_results - n_results]
+                break
+
+            n_results += len(page)
+            yield page
+
+        logging.debug(f"API pagination finished, {n_pages} pages fetched.")
+
+
+
+
+
+    def follow_pages(self, url, response, params, data, workers, start_param, limit_param):
+        """
+        Generator behind iter_pages, yields each page of results until the API runs out of them.
+        """
+
+        # save inital response
+        page  = page_results(response)
+        start = response.get(start_param, params.get(start_param, 0)) if isinstance(response, dict) else params.get(start_param, 0)
+
+        # learn the page size from the first response, confluence may have capped the limit we asked for
+        page_size = (response.get(limit_param) if isinstance(response, dict) else None) or params.get(limit_param) or len(page)
+
+        # only a known total lets the following pages be fetched concurrently without asking for pages past the end
+        total = page_total(response)
+
+        while True:
+
+            if page:
+                yield page
+
+            # a short page is the last one
+            if len(page) < page_size or not page:
+                return
+
+            # if the api tells us about next pages, trust it to say when there are no more
+            links    = response.get('_links') if isinstance(response, dict) else None
+            next_url = next_link(response, url)
+            if links is not None and not next_url:
+                return
+
+            # offset based pages of a known total can be fetched concurrently, anything else is followed one by one
+            start += len(page)
+            if workers > 1 and total is not None and not (next_url and 'cursor=' in next_url):
+                yield from self.prefetch_pages(url, params, data, start, page_size, workers, start_param, total)
+                return
+
+            # ask for a new batch of results
+            if next_url:
+                response = self.get_json(next_url, data=data, page=start // page_size + 1)
+            else:
+                params[start_param] = start
+                response = self.get_json(url, params=params, data=data, page=start // page_size + 1)
+
+            page = page_results(response) or []
+
+
+
+
+
+    def prefetch_pages(self, url, params, data, start, page_size, workers, start_param, total):
+        """
+        Generator that fetches the pages from offset {start} up to {total} results concurrently, {workers} pages at a time, and yields them
+        in order. Stops at the first short or empty page.
+        """
+
+        # init
+        pending = deque()
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            try:
+                while True:
+
+                    # keep the worker pool busy with the following offsets, but never ask past the end
+                    while len(pending) < workers and start < total:
+                        pending.append(executor.submit(self.get_json, url, params={**params, start_param:start}, data=data, page=start // page_size + 1))
+                        start += page_size
+                    if not pending:
+                        return
+
+                    # wait for the next page in order
+                    page = page_results(pending.popleft().result()) or []
+                    if page:
+                        yield page
+
+                    # a short page is the last one
+                    if len(page) < page_size:
+                        return
+
+            finally:
+                # skip whatever was queued after the last page
+                for future in pending:
+                    future.cancel()
+
+
+
+
+
+    def close(self):
+        """
+        Closes all pooled connections.
+        """
+        self.session.close()
+
+
+
+
+@lru_cache(maxsize=None)
+def load_config(path):
+    """
+    Helper function to read the yaml config file at {path}. Each file is only read and parsed once per process, so scripts run one after
+    another, e.g. through confluence-utils.py, share it. Exits with the parse error if the file is not valid yaml.
+    """
+    import yaml
+
+    with open(path, 'r') as file:
+        try:
+            return yaml.safe_load(file)
+        except yaml.YAMLError as exc:
+            sys.exit(f"ERROR: Could not parse {path}: {exc}")
+
+
+
+
+def parse_age(age):
+    """
+    Helper function to convert an age like 90, '90s', '30m', '12h' or '7d' to seconds.
+    """
+    units = {'s':1, 'm':60, 'h':3600, 'd':86400}
+    age   = str(age).strip()
+    if age[-1] in units:
+        return float(age[:-1]) * units[age[-1]]
+    return float(age)
+
+
+
+
+def pop_snapshot_args(argv):
+    """
+    Helper function to take the --snapshot <name>, --max-age <age> and --refresh options out of an argument list, so the positional arguments
+    can be parsed as before. Returns the snapshot name (None if not given), the max age in seconds (default 1 day) and if the snapshot
+    should be refreshed incrementally.
+    """
+
+    # init
+    snapshot_name = None
+    max_age       = parse_age('1d')
+    refresh       = False
+
+    if '--refresh' in argv:
+        argv.remove('--refresh')
+        refresh = True
+
+    for option in ['--snapshot', '--max-age']:
+        if option in argv:
+            i     = argv.index(option)
+            value = argv[i + 1]
+            del argv[i:i + 2]
+
+            if option == '--snapshot':
+                snapshot_name = value
+            else:
+                max_age = parse_age(value)
+
+    return snapshot_name, max_age, refresh
+
+
+
+
+class Snapshot_store:
+    """
+    On-disk store of API listings, kept as one json file per listing in {directory}/{name}/ together with the time it was fetched.
+    Listings older than {max_age} seconds are considered stale, None means they never are.
+    """
+
+    def __init__(self, name, directory='snapshots', max_age=None):
+
+        self.name      = name
+        self.directory = os.path.join(directory, name)
+        self.max_age   = max_age
+        os.makedirs(self.directory, exist_ok=True)
+
+
+
+
+
+    def path(self, key):
+        """
+        Returns the file path of the listing {key}.
+        """
+        return os.path.join(self.directory, f"{quote(key, safe='')}.json")
+
+
+
+
+
+    def read(self, key):
+        """
+        Returns the stored entry of listing {key}, a dict with the data and when it was fetched, or None if it is not stored.
+        """
+        try:
+            with open(self.path(key), 'r', encoding='utf-8') as snapshot_file:
+                return json.load(snapshot_file)
+        except (FileNotFoundError, ValueError):
+            return None
+
+
+
+
+
+    def load(self, key):
+        """
+        Returns the data of listing {key}, or None if it is not stored or older than {max_age}.
+        """
+        entry = self.read(key)
+        if entry is None:
+            return None
+
+        if self.max_age is not None and time.time() - entry['fetched'] > self.max_age:
+            logging.debug(f"Snapshot {self.name}/{key} is stale.")
+            return None
+
+        return entry['data']
+
+
+
+
+
+    def save(self, key, data, fetched=None):
+        """
+        Stores the data of listing {key}, fetched now unless the time {fetched} is given.
+        """
+
+        # write to a temporary file first, so an interrupted run never leaves a broken snapshot
+        tmp_path = f"{self.path(key)}.tmp.{threading.get_ident()}"
+        with open(tmp_path, 'w', encoding='utf-8') as snapshot_file:
+            json.dump({'fetched':fetched or time.time(), 'data':data}, snapshot_file)
+        os.replace(tmp_path, self.path(key))
+
+
+
+
+
+    def delete(self, key):
+        """
+        Removes listing {key} from the store, if it is there.
+        """
+        try:
+            os.remove(self.path(key))
+        except FileNotFoundError:
+            pass
+
+
+
+
+
+    def cached(self, key, fetch):
+        """
+        Returns the data of listing {key} from disk if it is fresh enough, otherwise calls {fetch} to get it and stores the result.
+        """
+        data = self.load(key)
+        if data is None:
+            data = fetch()
+            self.save(key, data)
+        else:
+            logging.debug(f"Using snapshot {self.name}/{key}.")
+        return data
+
+
+
+
+def pop_option(argv, option, default=None):
+    """
+    Helper function to take {option} and its value out of an argument list. Returns the value, or {default} if the option is not given.
+    """
+    if option not in argv:
+        return default
+
+    i     = argv.index(option)
+    value = argv[i + 1]
+    del argv[i:i + 2]
+    return value
+
+
+
+
+def pop_plan_args(argv):
+    """
+    Helper function to take the --plan-only <plan file> option out of an argument list. Returns the plan file name, or None if not given.
+    """
+    return pop_option(argv, '--plan-only')
+
+
+
+
+def write_plan(path, actions):
+    """
+    Helper function to write the actions in {actions} to the plan file {path}, one JSON object per line. Returns the number of actions.
+    Each action has an 'op' key naming the Confluence_cloud_api method to call, and the arguments to call it with.
+    """
+    n = 0
+    with open(path, 'w') as plan:
+        for action in actions:
+            plan.write(json.dumps(action, sort_keys=True) + '\n')
+            n += 1
+    logging.info(f"Wrote {n} actions to {path}")
+    return n
+
+
+
+
+def read_plan(path):
+    """
+    Helper function to read the list of actions in the plan file {path}.
+    """
+    with open(path, 'r') as plan:
+        return [ json.loads(line) for line in plan if line.strip() ]
+
+
+
+
+class Checkpoint:
+    """
+    Append-only log of the completed actions of a plan, one JSON object per line, so an interrupted run can be resumed without
+    redoing them. Safe to add to from several threads.
+    """
+
+    def __init__(self, path):
+
+        self.path = path
+        self.lock = threading.Lock()
+        self.done = set()
+
+        # read the actions completed in earlier runs
+        if os.path.exists(path):
+            with open(path, 'r') as log:
+                self.done = { line.strip() for line in log if line.strip() }
+            logging.info(f"Resuming from {path}, {len(self.done)} actions already done.")
+
+        self.log = open(path, 'a')
+
+
+
+
+
+    @staticmethod
+    def key(action):
+        """
+        Returns the line identifying {action} in the log.
+        """
+        return json.dumps(action, sort_keys=True)
+
+
+
+
+
+    def __contains__(self, action):
+        return self.key(action) in self.done
+
+
+
+
+
+    def add(self, action):
+        """
+        Records {action} as completed, written through to disk right away.
+        """
+        key = self.key(action)
+        with self.lock:
+            if key not in self.done:
+                self.log.write(key + '\n')
+                self.log.flush()
+                self.done.add(key)
+
+
+
+
+
+    def close(self):
+        self.log.close()
+
+
+
+
+class Intern_table:
+    """
+    Interns the strings of one kind, e.g. space keys, to consecutive small integers and back.
+    """
+
+    def __init__(self):
+
+        self.ids   = {}
+        self.names = []
+
+
+
+
+
+    def intern(self, value):
+        """
+        Returns the integer id of the string {value}, giving it a new one if it has not been seen before.
+        """
+        try:
+            return self.ids[value]
+        except KeyError:
+            self.ids[value] = len(self.names)
+            self.names.append(value)
+            return self.ids[value]
+
+
+
+
+
+    def get(self, value):
+        """
+        Returns the integer id of {value}, or None if it has not been interned.
+        """
+        return self.ids.get(value)
+
+
+
+
+class Permission_index:
+    """
+    Indexed in-memory model of who has which permissions in which spaces, built from spaces fetched with expand=permissions and the members of each group.
+    Space keys, subjects, operations and targets are interned to small integers, each kind in an Intern_table of its own, so e.g. a server group
+    named like a space key or an operation can't collide with it. Subjects are interned as (type, id) pairs, since on Confluence Server a user
+    and a group can have the same name. Where only an id is given, the user is looked up before the group. Each subject (user or group) has a set of (space, operation, target) grants, and
+    each space a set of subjects with permissions in it. Only a few fields of each space are kept, not the permissions payload.
+    Users are identified by {user_id_key} and groups by {group_id_key}, which differ between Confluence Cloud and Server.
+    """
+
+    space_fields = ('id', 'key', 'name', 'type', 'status')
+
+    def __init__(self, user_id_key='accountId', group_id_key='id'):
+
+        self.user_id_key    = user_id_key
+        self.group_id_key   = group_id_key
+
+        # interned space keys, (type, id) pairs of users and groups, operations and targets, to int and back
+        self.space_table     = Intern_table()
+        self.subject_table   = Intern_table()
+        self.operation_table = Intern_table()
+        self.target_table    = Intern_table()
+
+        # subject int -> set of (space int, operation int, target int)
+        self.grants         = defaultdict(set)
+
+        # space int -> set of subject ints, and space id -> space key int
+        self.space_subjects = defaultdict(set)
+        self.space_ids      = {}
+
+        # group int -> set of user ints, and the reverse
+        self.group_members  = defaultdict(set)
+        self.user_groups    = defaultdict(set)
+
+        # info about each space, user and group, and group names to ids
+        self.spaces         = {}
+        self.subjects       = {}
+        self.subject_types  = {}
+        self.group_names    = {}
+
+        # memoized spaces reached by each subject
+        self.reach          = {}
+
+
+
+
+
+    def add_subject(self, subject_type, entity):
+        """
+        Saves a user or group entity and returns its interned id.
+        """
+        id_key  = self.user_id_key if subject_type == 'user' else self.group_id_key
+        subject = self.subject_table.intern((subject_type, entity[id_key]))
+        self.subject_types[subject] = subject_type
+        self.subjects.setdefault(subject, entity)
+        if subject_type == 'group' and 'name' in entity:
+            self.group_names[entity['name']] = entity[id_key]
+        return subject
+
+
+
+
+
+    def add_spaces(self, spaces, include=None):
+        """
+        Adds the permissions of spaces fetched with expand=permissions. If {include} is given, only spaces it returns True for are added.
+        """
+
+        for space in spaces:
+
+            # skip filtered spaces
+            if include and not include(space):
+                continue
+
+            # keep the space info, not its permissions
+            space_int = self.space_table.intern(space['key'])
+            self.spaces[space_int] = { field:space.get(field) for field in self.space_fields }
+            if 'id' in space:
+                self.space_ids[space['id']] = space_int
+
+            # go through all permissions
+            for permission in space.get('permissions', []):
+
+                # skip empty permissions
+                if 'subjects' not in permission:
+                    continue
+
+                # the operation of the permission, e.g. read space
+                operation = self.operation_table.intern(permission['operation']['operation'])
+                target    = self.target_table.intern(permission['operation']['targetType'])
+
+                # for each subject with this permission
+                for subject_type, subject_list in permission['subjects'].items():
+
+                    # skip metadata
+                    if subject_type not in ('user', 'group'):
+                        continue
+
+                    for entity in subject_list['results']:
+                        subject = self.add_subject(subject_type, entity)
+                        self.grants[subject].add((space_int, operation, target))
+                        self.space_subjects[space_int].add(subject)
+
+        self.reach.clear()
+
+
+
+
+
+    def add_users(self, users):
+        """
+        Adds users, to make sure users without any permissions are known as well.
+        """
+        for user in users:
+            self.add_subject('user', user)
+
+
+
+
+
+    def add_group_members(self, group, members):
+        """
+        Adds the members of a group.
+        """
+
+        # init
+        group_int = self.add_subject('group', group)
+
+        for member in members:
+            user = self.add_subject('user', member)
+            self.group_members[group_int].add(user)
+            self.user_groups[user].add(group_int)
+
+        self.reach.clear()
+
+
+
+
+
+    def space(self, space_key):
+        """
+        Returns the saved info about a space.
+        """
+        return self.spaces[self.space_table.ids[space_key]]
+
+
+
+
+
+    def space_key(self, space_id):
+        """
+        Returns the key of the space with id {space_id}.
+        """
+        return self.space_table.names[self.space_ids[space_id]]
+
+
+
+
+
+    def subject_int(self, subject_id, subject_type=None):
+        """
+        Returns the interned id of the user or group {subject_id}, or None if it is not known. If {subject_type} is None, a user with that id
+        is preferred over a group.
+        """
+        if subject_type:
+            return self.subject_table.get((subject_type, subject_id))
+
+        subject = self.subject_table.get(('user', subject_id))
+        if subject is None:
+            subject = self.subject_table.get(('group', subject_id))
+        return subject
+
+
+
+
+
+    def subject(self, subject_id, subject_type=None):
+        """
+        Returns the saved user or group entity of {subject_id}.
+        """
+        subject = self.subject_int(subject_id, subject_type)
+        if subject is None:
+            raise KeyError(subject_id)
+        return self.subjects[subject]
+
+
+
+
+
+    def subject_type(self, subject_id):
+        """
+        Returns 'user' or 'group', or None if {subject_id} is not known.
+        """
+        return self.subject_types.get(self.subject_int(subject_id))
+
+
+
+
+
+    def user_ids(self):
+        """
+        Returns a list of the ids of all known users.
+        """
+        return [ self.subject_table.names[subject][1] for subject, subject_type in self.subject_types.items() if subject_type == 'user' ]
+
+
+
+
+
+    def members_of(self, group_id):
+        """
+        Returns a set of the ids of the members of group {group_id}.
+        """
+        group = self.subject_int(group_id, 'group')
+        return { self.subject_table.names[user][1] for user in self.group_members.get(group, ()) }
+
+
+
+
+
+    def group_id(self, group_name):
+        """
+        Returns the id of the group named {group_name}, or None if there is no such group.
+        """
+        return self.group_names.get(group_name)
+
+
+
+
+
+    def reached_spaces(self, subject):
+        """
+        Returns a frozenset of the interned space ids interned subject {subject} has any permission in, directly or via its groups.
+        Memoized, so repeated lookups are O(1).
+        """
+        try:
+            return self.reach[subject]
+        except KeyError:
+            pass
+
+        # direct permissions and those of the subject's groups
+        spaces = { grant[0] for grant in self.grants.get(subject, ()) }
+        for group in self.user_groups.get(subject, ()):
+            spaces.update( grant[0] for grant in self.grants.get(group, ()) )
+
+        self.reach[subject] = frozenset(spaces)
+        return self.reach[subject]
+
+
+
+
+
+    def spaces_of(self, subject_id, via_groups=True, subject_type=None):
+        """
+        Returns a set of the keys of the spaces {subject_id} has any permission in, directly or, if {via_groups} is True, via its groups.
+        """
+        subject = self.subject_int(subject_id, subject_type)
+        if subject is None:
+            return set()
+
+        if via_groups:
+            spaces = self.reached_spaces(subject)
+        else:
+            spaces = { grant[0] for grant in self.grants.get(subject, ()) }
+
+        return { self.space_table.names[space] for space in spaces }
+
+
+
+
+
+    def grants_of(self, subject_id, subject_type=None):
+        """
+        Returns a set of (space key, operation, target type) tuples that {subject_id} has been granted directly.
+        """
+        subject = self.subject_int(subject_id, subject_type)
+        if subject is None:
+            return set()
+
+        return { (self.space_table.names[space], self.operation_table.names[operation], self.target_table.names[target]) for space, operation, target in self.grants.get(subject, ()) }
+
+
+
+
+
+    def subjects_of(self, space_key):
+        """
+        Returns a set of the ids of the users and groups with permissions in space {space_key}.
+        """
+        space = self.space_table.ids.get(space_key)
+        return { self.subject_table.names[subject][1] for subject in self.space_subjects.get(space, ()) }
+
+
+
+
+def popcount(bits):
+    """
+    Helper function to count the set bits of an int.
+    """
+    return bin(bits).count('1')
+
+# use the builtin popcount where there is one (python 3.10+)
+if hasattr(int, 'bit_count'):
+    popcount = int.bit_count
+
+
+
+
+class Access_matrix:
+    """
+    User x space access matrix built from a Permission_index. Each user's row is a packed bitset, a Python int with one bit per space.
+    Group grants are applied by OR-ing the group's row into the rows of its members, and the number of spaces a user reaches is a popcount,
+    so cutoff queries over tens of thousands of users take milliseconds and can be repeated with different cutoffs without refetching.
+    Spaces can be excluded from the count per user, e.g. their personal space.
+    """
+
+    def __init__(self, index):
+
+        self.index     = index
+
+        # one column per space, one row per user
+        self.space_ints = list(index.spaces)
+        self.column     = { space:n for n, space in enumerate(self.space_ints) }
+        self.user_ids   = index.user_ids()
+        self.row        = { user_id:n for n, user_id in enumerate(self.user_ids) }
+
+        # bitset of the spaces each subject has direct permissions in
+        direct = {}
+        for subject, grants in index.grants.items():
+            bits = 0
+            for space, operation, target in grants:
+                bits |= 1 << self.column[space]
+            direct[subject] = bits
+
+        # add the bits of the user's groups
+        self.rows = []
+        for user_id in self.user_ids:
+            user = index.subject_int(user_id, 'user')
+            bits = direct.get(user, 0)
+            for group in index.user_groups.get(user, ()):
+                bits |= direct.get(group, 0)
+            self.rows.append(bits)
+
+        # spaces not to count, per user
+        self.excluded = [0] * len(self.rows)
+        self.counts   = None
+
+
+
+
+
+    def space_mask(self, space_keys):
+        """
+        Returns a bitset with the columns of the spaces in {space_keys} set.
+        """
+        bits = 0
+        for space_key in space_keys:
+            bits |= 1 << self.column[self.index.space_table.ids[space_key]]
+        return bits
+
+
+
+
+
+    def exclude(self, user_id, space_keys):
+        """
+        Stops counting the spaces in {space_keys} for user {user_id}.
+        """
+        self.excluded[self.row[user_id]] |= self.space_mask(space_keys)
+        self.counts = None
+
+
+
+
+
+    def space_keys(self, bits):
+        """
+        Returns a list of the keys of the spaces set in the bitset {bits}.
+        """
+
+        # init
+        space_keys = []
+
+        # peel off the lowest set bit until there are none left
+        while bits:
+            lowest = bits & -bits
+            space_keys.append(self.index.space_table.names[self.space_ints[lowest.bit_length() - 1]])
+            bits ^= lowest
+        return space_keys
+
+
+
+
+
+    def spaces_of(self, user_id, counted_only=False):
+        """
+        Returns a list of the keys of the spaces user {user_id} reaches, leaving out the excluded ones if {counted_only} is True.
+        """
+        row = self.row[user_id]
+        if counted_only:
+            return self.space_keys(self.rows[row] & ~self.excluded[row])
+        return self.space_keys(self.rows[row])
+
+
+
+
+
+    def space_counts(self):
+        """
+        Returns a list with the number of counted spaces each user reaches, in the order of user_ids. Computed once and reused.
+        """
+        if self.counts is None:
+            self.counts = [ popcount(bits & ~excluded) for bits, excluded in zip(self.rows, self.excluded) ]
+        return self.counts
+
+
+
+
+
+    def users_within(self, cutoff):
+        """
+        Returns a list of the ids of the users reaching at most {cutoff} spaces. If negative, all users are returned.
+        """
+        if cutoff < 0:
+            return list(self.user_ids)
+        return [ user_id for user_id, count in zip(self.user_ids, self.space_counts()) if count <= cutoff ]
+
+
+
+
+class Personal_space_matcher:
+    """
+    Finds which users a personal space belongs to. Space keys like ~{user id} and the space creator are matched exactly first,
+    otherwise the space name is fuzzy matched against the user names. User names are normalized once, and only users sharing a
+    character bigram with the space name (or with names too short to need one) and of a length that could reach {cutoff} are scored. Scoring is done in a batch with
+    rapidfuzz if it is installed, and with thefuzz otherwise. Names are unicode folded unless {fold} is False, so Åsa matches Asa.
+    """
+
+    def __init__(self, users, user_id_key='accountId', name_key='publicName', cutoff=75, fold=True):
+
+        self.user_id_key = user_id_key
+        self.cutoff      = cutoff
+        self.fold        = fold
+
+        # thefuzz rounds scores to integers, so anything from half a point below the cutoff can make it
+        self.min_score   = cutoff - 0.5
+
+        # normalize all user names once
+        users         = list(users)
+        self.user_ids = [ user[user_id_key] for user in users ]
+        self.names    = normalize_many((user.get(name_key) or user.get('displayName') or '' for user in users), fold=fold)
+        self.user_rows = { user_id:n for n, user_id in enumerate(self.user_ids) }
+
+        # names sharing no bigram can only reach the cutoff if they are short, at most 3 matching characters for a cutoff of 75.
+        # Below a cutoff of 67 any pair can, so bucketing is turned off
+        self.max_unshared = None
+        if 3 * self.min_score > 200:
+            self.max_unshared = int(200 * (self.min_score // (3 * self.min_score - 200)) / self.min_score)
+
+        # bucket the users by the bigrams in their names, and the short names by length
+        self.blocks      = defaultdict(set)
+        self.short_names = defaultdict(set)
+        for n, name in enumerate(self.names):
+            for bigram in self.bigrams(name):
+                self.blocks[bigram].add(n)
+            if self.max_unshared is not None and len(name) < self.max_unshared:
+                self.short_names[len(name)].add(n)
+
+        # use the batch scorer from rapidfuzz if available
+        try:
+            from rapidfuzz import process, fuzz
+            self.scorer = lambda name, choices: [ choice[2] for choice in process.extract(name, choices, scorer=fuzz.ratio, score_cutoff=self.min_score, limit=None) ]
+        except ImportError:
+            from thefuzz import fuzz
+            self.scorer = lambda name, choices: [ n for n, choice in enumerate(choices) if fuzz.ratio(name, choice) >= self.cutoff ]
+
+
+
+
+
+    @staticmethod
+    def bigrams(name):
+        """
+        Returns the set of character bigrams in {name}, or the name itself if it is shorter than two characters.
+        """
+        if len(name) < 2:
+            return {name} if name else set()
+        return { name[i:i+2] for i in range(len(name) - 1) }
+
+
+
+
+
+    def exact_owner(self, space):
+        """
+        Returns the id of the user whose id is in the key of personal space {space}, or who created it, or None.
+        """
+        key_owner = space.get('key', '').lstrip('~')
+        if key_owner in self.user_rows:
+            return key_owner
+        creator = space.get('history', {}).get('createdBy', {}).get(self.user_id_key)
+        if creator in self.user_rows:
+            return creator
+
+
+
+
+
+    def owners(self, space):
+        """
+        Returns a list of the ids of the users personal space {space} could belong to.
+        """
+
+        # exact matches first
+        owner = self.exact_owner(space)
+        if owner is not None:
+            return [owner]
+
+        # get the users sharing a bigram with the space name, and the ones short enough to match without
+        name = name_processor(space.get('name') or '', self.fold)
+        if self.max_unshared is None:
+            candidates = set(range(len(self.names)))
+        else:
+            candidates = set()
+            for bigram in self.bigrams(name):
+                candidates |= self.blocks.get(bigram, set())
+            for length in range(1, self.max_unshared - len(name) + 1):
+                candidates |= self.short_names.get(length, set())
+
+        # skip users whose name length alone keeps them below the cutoff
+        candidates = [ n for n in candidates if 200 * min(len(name), len(self.names[n])) >= self.min_score * (len(name) + len(self.names[n])) ]
+        if not candidates:
+            return []
+
+        # score the remaining candidates in one go
+        return [ self.user_ids[candidates[i]] for i in self.scorer(name, [ self.names[n] for n in candidates ]) ]
+
+
+
+
+
+    def match(self, spaces):
+        """
+        Returns a dict with the keys of the spaces in {spaces} and lists of the ids of the users each space could belong to.
+        """
+        return { space['key']:self.owners(space) for space in spaces }
+
+
+
+
+class Transfer_planner:
+    """
+    Plans permission transfers between users and groups from a Permission_index. The names of all users and groups are indexed once,
+    and the grants to add for a pair are the old subject's grants minus the new subject's, so planning is linear in the number of grants.
+    """
+
+    def __init__(self, index):
+
+        self.index = index
+
+        # ids of the users and groups with each name, user display names are not unique
+        self.named = defaultdict(set)
+        for subject, entity in index.subjects.items():
+            name = entity.get('displayName') if index.subject_types.get(subject) == 'user' else entity.get('name')
+            if name:
+                self.named[name].add(index.subject_table.names[subject][1])
+
+
+
+
+
+    def resolve(self, entity):
+        """
+        Returns the id of {entity}, given as either an id or the name of a user or group. Raises ValueError if no or multiple entities match.
+        """
+
+        # check if the entity is an id
+        if self.index.subject_type(entity):
+            return entity
+
+        # otherwise it has to be the name of exactly one user or group
+        matches = self.named.get(entity, set())
+        if len(matches) > 1:
+            raise ValueError(f"multiple matching entities for name '{entity}'")
+        elif len(matches) == 0:
+            raise ValueError(f"no matching entities for name '{entity}'")
+        return next(iter(matches))
+
+
+
+
+
+    def plan(self, old_entity, new_entity):
+        """
+        Returns a list of the grants that give {new_entity} the permissions of {old_entity}, as dicts with the keys space_key, entity_type,
+        entity_id, target and operation, ready for Confluence_cloud_api.add_permissions. Both entities can be ids or names.
+        Read-space is planned first in every space it is missing from, since the other permissions need it.
+        """
+
+        # init
+        old_id     = self.resolve(old_entity)
+        new_id     = self.resolve(new_entity)
+        new_type   = self.index.subject_type(new_id)
+        new_grants = self.index.grants_of(new_id)
+        missing    = self.index.grants_of(old_id) - new_grants
+
+        # add read-space where it is needed and missing
+        missing   |= { (space_key, 'read', 'space') for space_key, operation, target in missing if (space_key, 'read', 'space') not in new_grants }
+
+        return [ {'space_key':space_key, 'entity_type':new_type, 'entity_id':new_id, 'target':target, 'operation':operation}
+                 for space_key, operation, target in sorted(missing, key=lambda grant: (grant[0], grant[1:] != ('read', 'space'), grant[1:])) ]
+
+
+
+
+class Confluence_server_api:
+    """
+    Class to interact with the Confluence Server API.
+    """
+
+    # create a object from a config file
+    def __init__(self, config):
+
+        self.user       = config['user']
+        self.password   = config['password']
+        self.baseurl    = config['url']
+        self.auth       = HTTPBasicAuth(self.user, self.password)
+        self.headers    = {
+                            "Accept": "application/json",
+                            "Content-Type": "application/json",
+                          }
+        self.session    = Api_session(self.auth, self.headers, pool_size=config.get('pool_size', 10), rate_limiter=Rate_limiter(rate=config.get('rate_limit', 20), max_rate=config.get('max_rate_limit', 200)), retry_policy=Retry_policy(config.get('retry_attempts')), stats_file=config.get('request_stats_file'))
+        self.prefetch_workers = config.get('prefetch_workers', 4)
+        self.fetch_workers    = config.get('fetch_workers', 8)
+        self.run_summary_file = config.get('run_summary_file')
+        self.group_members    = {}
+
+
+
+
+
+
+    def get(self, url, params=None, data=None, paginate=True):
+        """
+        Wrapper function to make API calls that will keep sending subsequent requests if the answer is paginated.
+        """
+
+        # fetch results
+        params   = dict(params or {})
+        response = self.session.get_json(url, params=params, data=data)
+
+        # other type of response, return it all
+        if 'results' not in response.keys():
+            return response
+
+        # return at most the limit the user asked for, if any
+        max_results = params.get('limit', 10000)
+        if not paginate:
+            return response['results'][:max_results]
+
+        # keep asking for more until there is no more or the limit is reached
+        results = []
+        for page in self.session.iter_pages(url, response, params=params, data=data, workers=self.prefetch_workers, max_results=max_results):
+
+            # save the new batch together with the previous ones
+            results += page
+
+        return results
+
+
+
+
+
+    def iter_results(self, url, params=None, data=None):
+        """
+        Generator version of get, yields the results of a paginated listing one by one as the pages arrive.
+        """
+
+        # fetch the first page
+        params   = dict(params or {})
+        response = self.session.get_json(url, params=params, data=data)
+
+        # nothing to iterate over if it is not a listing
+        if not page_results(response):
+            return
+
+        # yield the results page by page
+        for page in self.session.iter_pages(url, response, params=params, data=data, workers=self.prefetch_workers):
+            yield from page
+
+
+
+
+
+    def get_spaces(self, limit=1000, expand=None):
+        """
+        Returns a list of spaces, limited in number by {limit}. Expands properties listed comma-separated in {expand}.
+        """
+
+        # define url and send request
+        url    = f"{self.baseurl}/rest/api/space"
+        params = {
+                    'limit':limit,
+                 }
+
+        # if there is anything to expand
+        if expand:
+            params['expand'] = expand
+
+        return self.get(url, params=params)
+
+
+    def iter_spaces(self, expand=None):
+        """
+        Generator that yields all spaces as they are fetched. Expands properties listed comma-separated in {expand}.
+        """
+        params = {
+                    'limit':1000,
+                 }
+
+        # if there is anything to expand
+        if expand:
+            params['expand'] = expand
+
+        yield from self.iter_results(f"{self.baseurl}/rest/api/space", params=params)
+
+
+    def update_space_name(self, space_key, name):
+        """
+        Updates a space's name. Takes a space key string and a new name as a string as inputs.
+        """
+        
+        # define url and payload, then send the request
+        url = f"{self.baseurl}/rest/api/space/{space_key}"
+        payload = f'{{"name": "{name}"}}'
+
+        logging.debug(f"Putting URL: {url}\tPayload: {payload}")
+        #pdb.set_trace()
+        return self.session.request("PUT", url, data=payload).json()
+
+
+#    def get_groups(self, limit=1000, expand=None):
+#        """
+#        Returns a list of groups, limited in number by {limit}. Expands properties listed comma-separated in {expand}.
+#        """
+#
+#        if expand:
+#            expand = f"&expand={expand}"
+#        else:
+#            expand = ''
+#
+#        # define url and send request
+#        url = f"{self.baseurl}/rest/api/group?limit={limit}{expand}"
+#        return requests.request("GET", url, headers=self.headers, auth=self.auth).json()['results']
+
+
+#    def get_space_property(self, space_key, expand=None):
+#        """
+#        Returns properties of a space. Expands properties listed comma-separated in {expand}.
+#        """
+#
+#        if expand:
+#            expand = f"?expand={expand}"
+#        else:
+#            expand = ''
+#
+#        pdb.set_trace()
+#        # define url and send request
+#        url = f"{self.baseurl}/rest/api/space/{space_key}/property{expand}"
+#        return requests.request("GET", url, headers=self.headers, auth=self.auth).json()['results']
+
+
+
+
+
+
+    def get_groups(self):
+        """
+        Returns a list of all groups.
+        """
+
+        # get all groups
+        url = f"{self.baseurl}/rest/api/group"
+        params = {
+                    'limit':1000,
+                 }
+        return self.get(url, params=params)
+
+
+
+
+
+    def get_group_members(self, group_name):
+        """
+        Returns a list of all users who are members of a group. The members of each group are only fetched once and kept in {group_members},
+        so iter_users, find_possible_guest_users and the scripts share them.
+        """
+
+        # fetched before
+        if group_name in self.group_members:
+            return self.group_members[group_name]
+
+        # get all group members
+        url = f"{self.baseurl}/rest/api/group/{group_name}/member"
+        params = {
+                    'limit':1000,
+                 }
+        self.group_members[group_name] = self.get(url, params=params)
+        return self.group_members[group_name]
+
+
+
+
+
+    def iter_groups(self):
+        """
+        Generator that yields all groups as they are fetched.
+        """
+        yield from self.iter_results(f"{self.baseurl}/rest/api/group", params={'limit':1000})
+
+
+
+
+
+    def iter_group_members(self, group_name):
+        """
+        Generator that yields all users who are members of a group as they are fetched.
+        """
+        yield from self.iter_results(f"{self.baseurl}/rest/api/group/{group_name}/member", params={'limit':1000})
+
+
+
+
+
+    def iter_users(self, groups=None):
+        """
+        Generator that yields all users as they are fetched, each user only once.
+        The CQL search lists each user once, so it is streamed first. It won't return disabled accounts, so group memberships are then
+        fetched concurrently to find the users the search can't see. {groups} restricts which group names are consulted, all by default.
+        Counts of where the users came from, the groups left out and the group member fetches avoided by reusing earlier ones are kept in {user_stats}.
+        """
+
+        # init
+        seen_usernames = set()
+        stats = {'search_users':0, 'group_users':0, 'groups_fetched':0, 'groups_reused':0, 'groups_skipped':0}
+        self.user_stats = stats
+
+        # CQL method, each user only once
+        for result in self.iter_results(f"{self.baseurl}/rest/api/search", params={'cql':'type=user', 'limit':1000}):
+            if result['user']['username'] not in seen_usernames:
+                seen_usernames.add(result['user']['username'])
+                stats['search_users'] += 1
+                yield result['user']
+
+        # group based method, for the users the search didn't return
+        group_names = [ group['name'] for group in self.get_groups() ]
+        if groups is not None:
+            stats['groups_skipped'] = len(group_names)
+            group_names = [ group_name for group_name in group_names if group_name in groups ]
+            stats['groups_skipped'] -= len(group_names)
+
+        stats['groups_reused'] = sum(1 for group_name in group_names if group_name in self.group_members)
+        stats['groups_fetched'] = len(group_names) - stats['groups_reused']
+        for group_name, members in fetch_concurrently(self.get_group_members, group_names, workers=self.fetch_workers, description="group members", summary_file=self.run_summary_file):
+            for user in members:
+                if user['username'] in seen_usernames:
+                    continue
+                seen_usernames.add(user['username'])
+                stats['group_users'] += 1
+                yield user
+
+        logging.info(f"Found {stats['search_users']} users by search and {stats['group_users']} more in {stats['groups_fetched'] + stats['groups_reused']} groups, fetched the members of {stats['groups_fetched']} groups, reused {stats['groups_reused']} and skipped {stats['groups_skipped']}.")
+
+
+
+
+
+    def get_users(self, groups=None):
+        """
+        Returns a list of all users, see iter_users.
+        """
+        return list(self.iter_users(groups=groups))
+
+
+
+
+    def get_user_info(self, username):
+        """
+        Returns more info about a username.
+        """
+
+        # get user info
+        url = f"{self.baseurl}/rest/api/user?username={username}"
+        url = f"{self.baseurl}/rest/mobile/1.0/profile/{username}"
+        params = {
+                    'limit':1000,
+                 }
+        return self.get(url, params=params)
+
+
+
+
+    def get_user_infos(self, usernames):
+        """
+        Returns a dict with the info about each username in {usernames}, keyed on username. Fetched {fetch_workers} at a time.
+        """
+        return dict(fetch_concurrently(self.get_user_info, usernames, workers=self.fetch_workers, description="user profiles", summary_file=self.run_summary_file))
+
+
+
+
+    def search(self, cql_query):
+        """
+        Returns the result of a CQL query (https://developer.atlassian.com/server/confluence/advanced-searching-using-cql/).
+        """
+
+        url = f"{self.baseurl}/rest/api/search"
+        params = {
+                    'cql':cql_query,
+                    'limit':1000,
+                 }
+        return self.get(url, params=params)
+
+
+
+
+
+    def find_possible_guest_users(self, n_spaces=1, ignore_personal_spaces=False, ignore_unlicenced=True, ignore_deleted=True):
+        """
+        Find all users that are members of maximum {n_spaces} spaces.
+        If {ignore_personal_spaces} is True it will not count the personal space (a space with same name as username) to wards this number.
+        Will only check if a user is mentioned in a space's permissions, not what permissions they actually have.
+
+        A huge function since there is no way to ask Confluence about what permissions a user has. You have to reconstruct the permissions
+        by asking all spaces which users and groups have permission to it, and which group members each group has.
+        """
+
+    #pdb.set_trace()
+
+        # get a list of all spaces
+        spaces = self.get_spaces(expand="permissions")
+
+        ## Get all user-space and group-space memberships, server users are identified by username and groups by name
+        logging.info("Parsing permissions.")
+        index = Permission_index(user_id_key='username', group_id_key='name')
+        index.add_spaces(spaces)
+        logging.debug("Parsing permissions finished.")
+
+        # only the groups that have permissions in any space change the space counts
+        logging.info(f"Fetching groups.")
+        groups = [ group for group in self.get_groups() if index.subject_int(group['name'], 'group') in index.grants ]
+
+        ## get a complete list of all users, to make sure all users are present, even those who don't have any stated permissions in spaces.
+        ## Only the members of the groups with permissions are fetched, the search lists all active users, so this only leaves out disabled
+        ## users that are in none of these groups and have no permissions of their own, i.e. reach no space
+        logging.info("Fetching all users from API.")
+        index.add_users(self.get_users(groups={ group['name'] for group in groups }))
+
+        # add the members of the groups with permissions, get_users already fetched them, so they are reused rather than fetched again
+        reused = sum(1 for group in groups if group['name'] in self.group_members)
+        for group, members in fetch_concurrently(lambda group: self.get_group_members(group['name']), groups, workers=self.fetch_workers, description="group members", summary_file=self.run_summary_file):
+            index.add_group_members(group, members)
+        logging.info(f"Reused the members of {reused} of {len(groups)} groups with space permissions, avoiding as many fetches.")
+
+
+        # find out which users each space could be the personal space of, if asked to
+        space_owners = {}
+        if ignore_personal_spaces:
+            matcher      = Personal_space_matcher([ index.subject(user_id, 'user') for user_id in index.user_ids() ], user_id_key='username', name_key='displayName')
+            space_owners = { space_key:set(owners) for space_key, owners in matcher.match(index.spaces.values()).items() }
+
+        # init
+        logging.debug(f"Findinig users with {n_spaces} or less spaces.")
+        total_users = 0
+        found_users = 0
+
+        # find users with access to only n_spaces spaces
+        possible_guests = {}
+        for user_id in index.user_ids():
+
+            user = index.subject(user_id, 'user')
+
+            # filter out unlicensed users
+            if ignore_unlicenced and 'Unlicensed' in user['displayName']:
+                continue
+
+            # filter out deleted users
+            if ignore_deleted and 'Deleted' in user['displayName']:
+                continue
+
+
+            # count user towards total
+            total_users += 1
+
+            # get the spaces a user has access to, directly or via groups
+            spaces_reached = { space_key:index.space(space_key) for space_key in index.spaces_of(user_id, subject_type='user') }
+            user_spaces    = spaces_reached.copy()
+
+
+            # filter out perosnal spaces if asked to
+            for user_space_key in spaces_reached:
+                if user_id in space_owners.get(user_space_key, ()):
+                    del user_spaces[user_space_key]
+
+
+
+            # check if the user is a member in few enough spaces to be eligible to be selected
+            if len(user_spaces) <= n_spaces:
+
+                # count number of found users
+                found_users += 1
+
+                # print user entry
+                logging.debug(f"{user.get('displayName', None)}\t{user.get('email', None)}\t{','.join(user_spaces.keys())}")
+
+                # save the user in the keep list
+                possible_guests[user_id] = {'user':user, 'spaces':spaces_reached}
+
+
+        logging.debug(f"Found {found_users} users out of {total_users} total users that are members of {n_spaces} or less spaces.")
+        return possible_guests
+
+
+
+
+
+
+
+
+
+
+
+
+class Confluence_cloud_api:
+    """
+    Class to interact with the Confluence Cloud API.
+    """
+
+    # create a object from a config file
+    def __init__(self, config):
+
+        self.user       = config['user']
+        self.api_token  = config['api_token']
+        self.baseurl    = config['url']
+        self.auth       = HTTPBasicAuth(self.user, self.api_token)
+        self.headers    = {
+                            "Accept": "application/json",
+                            "Content-Type": "application/json",
+                          }
+        self.session    = Api_session(self.auth, self.headers, pool_size=config.get('pool_size', 10), rate_limiter=Rate_limiter(rate=config.get('rate_limit', 20), max_rate=config.get('max_rate_limit', 200)), retry_policy=Retry_policy(config.get('retry_attempts')), stats_file=config.get('request_stats_file'))
+        self.prefetch_workers = config.get('prefetch_workers', 4)
+        self.fetch_workers    = config.get('fetch_workers', 8)
+        self.run_summary_file = config.get('run_summary_file')
+        self.snapshot_dir     = config.get('snapshot_dir', 'snapshots')
+        self.snapshot         = None
+        self.access_matrices  = {}
+
+
+
+
+
+    def get(self, url, params=None, data=None, expand=None, paginate=True):
+        """
+        Wrapper function to make API calls that will keep sending subsequent requests if the answer is paginated.
+        """
+
+        # merge the url parameters, expansions and data into a single query
+        query = dict(params or {})
+        if expand:
+            query['expand'] = expand
+        if data:
+            query.update(data)
+
+        # fetch results
+        response = self.session.get_json(url, params=query)
+        results  = response.get('results')
+
+        # if there is no results key, return whole response object
+        if not results:
+            return response
+
+        # got them all in the first request
+        if not paginate:
+            return results
+
+        # confluence limits the number of hits, setting it to 50 if you ask for expansions, so keep asking for more until there is no more
+        results = []
+        for page in self.session.iter_pages(url, response, params=query, workers=self.prefetch_workers):
+
+            # save the new batch together with the previous ones
+            results += page
+
+        return results
+
+
+    def iter_results(self, url, params=None, expand=None):
+        """
+        Generator version of get, yields the results of a paginated listing one by one as the pages arrive.
+        """
+
+        # merge the url parameters and expansions into a single query
+        query = dict(params or {})
+        if expand:
+            query['expand'] = expand
+
+        # fetch the first page
+        response = self.session.get_json(url, params=query)
+
+        # nothing to iterate over if it is not a listing
+        if not page_results(response):
+            return
+
+        # yield the results page by page
+        for page in self.session.iter_pages(url, response, params=query, workers=self.prefetch_workers):
+            yield from page
+
+
+    def post(self, url, data=None, params=None, idempotent=False):
+        """
+        Wrapper function to post data to the API. Set {idempotent} if posting the same data twice does no harm, to let failed posts be retried.
+        """
+        #pdb.set_trace()
+        return self.session.request("POST", url, data=data, params=params, idempotent=idempotent)
+
+
+
+    def delete(self, url, data=None, params=None):
+        """
+        Wrapper function to delete data to the API.
+        """
+        #pdb.set_trace()
+        return self.session.request("DELETE", url, data=data, params=params)
+
+
+
+
+    def use_snapshot(self, name, max_age=None, refresh=False):
+        """
+        Makes the full listings of spaces, users, groups and group members be read from the on-disk snapshot {name} when it is younger than
+        {max_age} seconds, and stored there when fetched from the API. If {refresh} is True, an existing snapshot is first brought up to date
+        with refresh_snapshot, whatever its age.
+        """
+        self.snapshot = Snapshot_store(name, directory=self.snapshot_dir, max_age=max_age)
+        logging.info(f"Using snapshot '{name}' in {self.snapshot.directory}.")
+
+        if refresh:
+            self.refresh_snapshot()
+
+
+
+    def get_changes_since(self, since):
+        """
+        Returns the keys of spaces, and the names of spaces, groups and users, that changed after the time {since}.
+        Uses a CQL lastmodified search for spaces and the audit log for permission and group membership changes.
+        The audit log needs admin rights, without it only changed spaces are found. Any other failed request raises an HTTPError.
+        """
+
+        # init
+        changes = {'space_keys':set(), 'space_names':set(), 'group_names':set(), 'user_ids':set()}
+
+        # CQL dates are in the timezone of the user, so look back an extra day to be on the safe side
+        cql_since = datetime.fromtimestamp(since - 86400).strftime('%Y/%m/%d %H:%M')
+        for result in self.iter_results(f"{self.baseurl}/wiki/rest/api/search", params={'cql':f'type=space and lastmodified >= "{cql_since}"', 'limit':100}):
+            if result.get('space', {}).get('key'):
+                changes['space_keys'].add(result['space']['key'])
+
+        # permission and membership changes only show up in the audit log, any other failure than missing admin rights must stop the refresh
+        try:
+            records = list(self.iter_results(f"{self.baseurl}/wiki/rest/api/audit", params={'startDate':int(since * 1000), 'endDate':int(time.time() * 1000), 'limit':1000}))
+        except requests.HTTPError as exception:
+            if exception.response is None or exception.response.status_code not in (401, 403):
+                raise
+            logging.warning(f"Could not read the audit log ({exception}), group membership changes will not be detected.")
+            records = []
+
+        # collect the spaces, groups and users the records are about
+        for record in records:
+            for audit_object in [record.get('affectedObject', {})] + record.get('associatedObjects', []):
+                object_type = audit_object.get('objectType', '').lower()
+                if object_type == 'space':
+                    changes['space_names'].add(audit_object.get('name'))
+                elif object_type == 'group':
+                    changes['group_names'].add(audit_object.get('name'))
+                elif object_type == 'user' and audit_object.get('id'):
+                    changes['user_ids'].add(audit_object['id'])
+
+        return changes
+
+
+
+    def refresh_snapshot(self):
+        """
+        Brings the snapshot in use up to date by fetching only what changed since it was stored, and merging it into the stored listings.
+        Changed spaces are fetched one by one, the members of new groups and groups named in the audit log are listed again in full, and the
+        group list is compared by id to find removed groups. Users named in the audit log or no longer in a relisted guest or user group are
+        fetched again and dropped if they have been deleted. Nothing is saved until everything was fetched, so a failed request, which raises
+        an HTTPError, leaves the snapshot as it was. Returns a dict with the number of refreshed spaces, groups and users.
+        """
+
+        # init
+        spaces_entry = self.snapshot.read(self.snapshot_key('spaces', 'permissions'))
+        groups_entry = self.snapshot.read(self.snapshot_key('groups', None))
+        users_entry  = self.snapshot.read(self.snapshot_key('users'))
+        refreshed    = {'spaces':0, 'groups':0, 'users':0}
+
+        # nothing to refresh yet, everything will be fetched when asked for
+        if not (spaces_entry and groups_entry and users_entry):
+            logging.info(f"Snapshot '{self.snapshot.name}' is incomplete, not refreshing it.")
+            return refreshed
+
+        # save everything as fetched when the refresh started, so nothing that changes during it is missed next time
+        refresh_started = time.time()
+        since           = min(spaces_entry['fetched'], groups_entry['fetched'], users_entry['fetched'])
+        logging.info(f"Refreshing snapshot '{self.snapshot.name}' with changes since {datetime.fromtimestamp(since)}.")
+        changes = self.get_changes_since(since)
+
+        ## spaces
+        spaces       = { space['key']:space for space in spaces_entry['data'] }
+        name_to_key  = { space['name']:space['key'] for space in spaces.values() }
+        changed_keys = changes['space_keys'] | { name_to_key[name] for name in changes['space_names'] if name in name_to_key }
+        for space_key in changed_keys:
+
+            # deleted spaces are gone from the api, any other error stops the refresh before anything is saved
+            response = self.session.request("GET", f"{self.baseurl}/wiki/rest/api/space/{space_key}", params={'expand':'permissions'})
+            if response.status_code == 404:
+                spaces.pop(space_key, None)
+            else:
+                response.raise_for_status()
+                spaces[space_key] = response.json()
+            refreshed['spaces'] += 1
+
+        ## groups, the group list is short enough to compare as a whole
+        old_group_ids = { group['id'] for group in groups_entry['data'] }
+        groups        = self.get(f"{self.baseurl}/wiki/rest/api/group")
+
+        # list the members of new groups and groups with membership changes again, which also drops those who left them
+        group_members = {}
+        for group in groups:
+            if group['id'] in old_group_ids and group['name'] not in changes['group_names']:
+                continue
+
+            members = self.get(f"{self.baseurl}/wiki/rest/api/group/{group['id']}/membersByGroupId")
+            group_members[group['id']] = members if isinstance(members, list) else []
+            refreshed['groups'] += 1
+
+        ## users, add the new members of the relisted guest and user groups, and note who left them
+        users   = { user['accountId']:user for user in users_entry['data'] }
+        recheck = set(changes['user_ids'])
+        for group in groups:
+            if not (group['id'] in group_members and (group['name'].startswith('confluence-guests-') or group['name'].startswith('confluence-users'))):
+                continue
+
+            members     = { member['accountId']:member for member in group_members[group['id']] }
+            old_entry   = self.snapshot.read(self.snapshot_key('group_members', group['id'], None))
+            old_members = { member['accountId'] for member in old_entry['data'] } if old_entry else set()
+            recheck    |= old_members - set(members)
+            for user_id, member in members.items():
+                if user_id not in users:
+                    users[user_id] = member
+                    refreshed['users'] += 1
+
+        # fetch the users named in the audit log or who left a group again, the deleted ones are gone from the api
+        for user_id in recheck:
+            try:
+                users[user_id] = self.get_user(user_id)
+            except requests.HTTPError as exception:
+                if exception.response is None or exception.response.status_code != 404:
+                    raise
+                users.pop(user_id, None)
+            refreshed['users'] += 1
+
+        ## everything was fetched, save it
+        self.snapshot.save(self.snapshot_key('spaces', 'permissions'), list(spaces.values()), fetched=refresh_started)
+        self.snapshot.save(self.snapshot_key('groups', None), groups, fetched=refresh_started)
+        for group_id, members in group_members.items():
+            self.snapshot.save(self.snapshot_key('group_members', group_id, None), members, fetched=refresh_started)
+
+        # drop the members of removed groups
+        for group_id in old_group_ids - { group['id'] for group in groups }:
+            self.snapshot.delete(self.snapshot_key('group_members', group_id, None))
+
+        self.snapshot.save(self.snapshot_key('users'), list(users.values()), fetched=refresh_started)
+
+        logging.info(f"Refreshed {refreshed['spaces']} spaces, {refreshed['groups']} groups and {refreshed['users']} users.")
+        return refreshed
+
+
+
+    @staticmethod
+    def snapshot_key(listing, *args):
+        """
+        Returns the name a listing is stored under in a snapshot, e.g. spaces.permissions for get_spaces(expand='permissions').
+        Used both when listings are fetched and when a snapshot is refreshed, so they always agree.
+        """
+        return '.'.join([listing] + [ str(arg) for arg in args ])
+
+
+
+
+
+    def cached(self, key, fetch):
+        """
+        Returns the result of {fetch}, going through the snapshot with listing name {key} if one is in use.
+        """
+        if self.snapshot is None:
+            return fetch()
+        return self.snapshot.cached(key, fetch)
+
+
+
+
+    def get_spaces(self, limit=10000, expand=None, paginate=True):
+        """
+        Returns a list of spaces, limited in number by {limit}. Expands properties listed comma-separated in {expand}.
+        """
+        # define url and send request
+        fetch = lambda: self.get(f"{self.baseurl}/wiki/rest/api/space", expand=expand, paginate=paginate)
+        if not paginate:
+            return fetch()[:limit]
+        return self.cached(self.snapshot_key('spaces', expand), fetch)[:limit]
+
+
+    def get_search_users(self, limit=10000, expand=None, paginate=True):
+        """
+        Returns a list of all Confluence users (not guests), limited in number by {limit}.
+        """
+        return self.get(f"{self.baseurl}/wiki/rest/api/search/user", params={"cql":"type=user"}, expand=expand, paginate=paginate)[:limit]
+
+
+    def get_users(self, limit=999999, expand=None, paginate=True):
+        """
+        Returns a list of all Confluence users, limited in number by {limit}.
+        """
+        return self.cached(self.snapshot_key('users'), lambda: list(self.iter_users()))[:limit]
+
+
+
+    def iter_spaces(self, expand=None):
+        """
+        Generator that yields all spaces as they are fetched. Expands properties listed comma-separated in {expand}.
+        """
+        yield from self.iter_results(f"{self.baseurl}/wiki/rest/api/space", expand=expand)
+
+
+    def iter_users(self):
+        """
+        Generator that yields all Confluence users as they are fetched, each user only once.
+        """
+
+        # init
+        seen_ids = set()
+        groups   = self.get_groups()
+
+        # search users will not include guests, so also go through the members of the guest and ordinary user groups
+        guest_group_id         = [group['id'] for group in groups if group['name'].startswith('confluence-guests-')][0]
+        ordinary_user_group_id = [group['id'] for group in groups if group['name'].startswith('confluence-users')][0]
+        possible_users = chain(self.iter_results(f"{self.baseurl}/wiki/rest/api/search/user", params={"cql":"type=user"}),
+                               self.iter_group_members(guest_group_id),
+                               self.iter_group_members(ordinary_user_group_id))
+
+        for user in possible_users:
+
+            # serach users are wrapped in a user key, group membership users are not
+            user = user.get('user', user)
+            if user['accountId'] not in seen_ids:
+                seen_ids.add(user['accountId'])
+                yield user
+
+
+    def iter_groups(self, expand=None):
+        """
+        Generator that yields all groups as they are fetched.
+        """
+        yield from self.iter_results(f"{self.baseurl}/wiki/rest/api/group", expand=expand)
+
+
+    def iter_group_members(self, group_id, expand=None):
+        """
+        Generator that yields the members of group {group_id} as they are fetched.
+        """
+        yield from self.iter_results(f"{self.baseurl}/wiki/rest/api/group/{group_id}/membersByGroupId", expand=expand)
+
+
+
+    def get_user(self, user_id, expand=None, paginate=True):
+        """
+        Returns info about a user.
+        """
+        return self.get(f"{self.baseurl}/wiki/rest/api/user", data={"accountId":user_id}, expand=expand, paginate=paginate)
+
+
+    def get_groups(self, limit=1000, expand=None, paginate=True):
+        """
+        Returns a list of groups, limited in number by {limit}.
+        """
+        fetch = lambda: self.get(f"{self.baseurl}/wiki/rest/api/group", expand=expand, paginate=paginate)
+        if not paginate:
+            return fetch()[:limit]
+        return self.cached(self.snapshot_key('groups', expand), fetch)[:limit]
+
+
+    def get_group_members(self, group_id, limit=1000, expand=None, paginate=True):
+        """
+        Returns a list of groups members of group {group_id}, limited in number by {limit}.
+        """
+        def fetch():
+            # empty groups give a response object instead of a list
+            members = self.get(f"{self.baseurl}/wiki/rest/api/group/{group_id}/membersByGroupId", expand=expand, paginate=paginate)
+            return members if isinstance(members, list) else []
+
+        if not paginate:
+            return fetch()[:limit]
+        return self.cached(self.snapshot_key('group_members', group_id, expand), fetch)[:limit]
+
+
+    def convert_to_guest_user(self, user_id, guest_group_id, remove_other_groups=False):
+        """
+        Coverts a user, identified by {user_id}, to a guest user by adding them to the guest group, identified by {guest_group_id}.
+        Will handle removing other groups if need be.
+        """
+
+        # get user's group memberships
+        user_group_memberships = self.get_user_group_memberships(user_id)
+
+        # check if the user already is a guest user
+        if guest_group_id in [ group['id'] for group in user_group_memberships ]:
+            logging.debug(f'Skipping converting users {user_id} to guest since they already are a guest.')
+
+            # skip in that case
+            return
+
+        # check if all other groups should be removed
+        if remove_other_groups:
+            # remove user from all current groups
+            for group in user_group_memberships:
+                self.remove_user_from_group(user_id, group['id'])
+
+
+        #pdb.set_trace()
+        # add user to the guest group
+        return self.add_user_to_group(user_id, guest_group_id)
+
+
+    def add_user_to_group(self, user_id, group_id):
+        """
+        Adds a user, identified by {user_id}, to a group, indentified by {group_id}.
+        """
+        # define url and payload
+        url     = f"{self.baseurl}/wiki/rest/api/group/userByGroupId"
+        query   = {
+                    'groupId' : group_id
+                  }
+        payload = json.dumps({
+                                'accountId' : user_id,
+                             })
+
+#        pdb.set_trace()
+        return self.post(url, params=query, data=payload, idempotent=True)
+
+
+
+
+    def remove_user_from_group(self, user_id, group_id):
+        """
+        Removes a user, identified by {user_id}, from a group, indentified by {group_id}.
+        """
+        # define url and payload
+        url     = f"{self.baseurl}/wiki/rest/api/group/userByGroupId"
+        query   = {
+                    'groupId'   : group_id,
+                    'accountId' : user_id,
+                  }
+
+        #pdb.set_trace()
+        return self.delete(url, params=query)
+
+
+
+
+    def get_user_group_memberships(self, user_id):
+        """
+        Fetch a list of all groups a user is member of.
+        """
+
+        # define url and payload
+        url     = f"{self.baseurl}/wiki/rest/api/user/memberof"
+        query   = {
+                    'accountId' : user_id
+                  }
+
+        return self.get(url, params=query)
+
+
+
+
+
+    def add_label_to_space(self, space_key, label, prefix='team'):
+        """
+        Adds the label {label} to a space, indentified by {space_key}, using the prefix {prefix}.
+        """
+        # define url and payload
+        url     = f"{self.baseurl}/wiki/rest/api/space/{space_key}/label"
+        payload = json.dumps([{
+                                'prefix' : prefix,
+                                'name'   : label,
+                             }])
+        query = {}
+
+#        pdb.set_trace()
+        return self.post(url, params=query, data=payload, idempotent=True)
+
+
+
+
+
+    def remove_label_from_space(self, space_key, label, prefix='team'):
+        """
+        Removes the label {label} from a space, indentified by {space_key}.
+        """
+        # define url and payload
+        url     = f"{self.baseurl}/wiki/rest/api/space/{space_key}/label"
+        query = {
+                    'prefix' : prefix,
+                    'name'   : label,
+                }
+
+#        pdb.set_trace()
+        return self.delete(url, params=query)
+
+
+
+
+
+
+
+
+
+    def add_group_members_to(self, index, groups):
+        """
+        Fetches the members of the groups in {groups} concurrently and adds them to the Permission_index {index} as they arrive.
+        """
+        for group, members in fetch_concurrently(lambda group: self.get_group_members(group_id=group['id']), groups, workers=self.fetch_workers, description="group members", summary_file=self.run_summary_file):
+            index.add_group_members(group, members)
+
+
+
+
+
+    def get_access_matrix(self, ignore_personal_spaces=True, ignore_own_personal_space=False, member_groups=()):
+        """
+        Returns the user x space Access_matrix of all users, spaces and group memberships. Archived spaces are left out, and so are all
+        personal spaces if {ignore_personal_spaces} is True.
+        If {ignore_own_personal_space} is True, and personal spaces are kept, a user's own personal space, found by Personal_space_matcher from
+        its key, creator or a name similar to the user's, is excluded from their count. Other personal spaces the user has access to still count.
+        The matrix is built once per setting and kept, so repeated queries with different cutoffs don't fetch anything again.
+        Only the members of groups with space permissions are fetched, plus those of the groups named in {member_groups}.
+        """
+
+        # reuse the matrix if it is already built, only fetching the members of any new {member_groups}
+        setting = (ignore_personal_spaces, ignore_own_personal_space)
+        if setting in self.access_matrices:
+            matrix = self.access_matrices[setting]
+            if any(group_name not in matrix.index.group_names for group_name in member_groups):
+                self.add_group_members_to(matrix.index, [ group for group in self.get_groups() if group['name'] in member_groups and matrix.index.subject_int(group['id'], 'group') is None ])
+            return matrix
+
+        # get a list of all spaces
+        logging.info("Fetching all spaces from API.")
+        spaces = self.get_spaces(expand="permissions")
+
+        ## Get all user-space and group-space memberships, skipping archived spaces, and personal spaces if asked to
+        logging.info("Parsing permissions.")
+        index = Permission_index()
+        index.add_spaces(spaces, include=lambda space: space['status'] != 'archived' and not (ignore_personal_spaces and space['type'] == 'personal'))
+        logging.debug("Parsing permissions finished.")
+
+        ## get a complete list of all users, to make sure all users are present, even those who don't have any stated permissions in spaces
+        logging.info("Fetching all users from API.")
+        index.add_users(self.get_users())
+
+        # get all groups
+        logging.info(f"Fetching groups.")
+        groups = self.get_groups()
+
+        # fetch the members of the groups that have permissions in any space, the others don't change the space counts
+        self.add_group_members_to(index, [ group for group in groups if index.subject_int(group['id'], 'group') in index.grants or group['name'] in member_groups ])
+
+        # build the matrix
+        matrix = Access_matrix(index)
+
+        # don't count a user's own personal space, if asked to
+        personal_spaces = [ space for space in index.spaces.values() if space['type'] == 'personal' ]
+        if ignore_own_personal_space and personal_spaces:
+            matcher = Personal_space_matcher(index.subject(user_id) for user_id in matrix.user_ids)
+            for space_key, owners in matcher.match(personal_spaces).items():
+                space_bit = matrix.space_mask([space_key])
+                for user_id in owners:
+
+                    # only if the user reaches the space
+                    if matrix.rows[matrix.row[user_id]] & space_bit:
+                        matrix.exclude(user_id, [space_key])
+
+        self.access_matrices[setting] = matrix
+        return matrix
+
+
+
+
+
+    def find_possible_guest_users(self, n_spaces_cutoff=-1, ignore_personal_spaces=True, ignore_unlicenced=True, ignore_deleted=True, guest_group_name='confluence-guests-scilifelab', skip_guest_users=True, require_confluence_access=True, ignore_own_personal_space=False):
+        """
+        Find all users that are members of maximum {n_spaces_cutoff} spaces. If negative, all users will be returned.
+        If {ignore_personal_spaces} is True it will not count the personal space (a space with same name as username) towards this number.
+        ignore_own_personal_space will, with ignore_personal_spaces False, only leave out the user's own personal space and count the others.
+        Will only check if a user is mentioned in a space's permissions, not what permissions they actually have.
+        ignore_unlicenced will filter out users with 'Unlicensed' in their name.
+        ignore_deleted will filter out users with 'Deleted' in their name.
+        guest_group_name is the name of the group that is considered the guest group.
+        skip_guest_users will ignore users who are already members of the guest group.
+        require_confluence_access will filter out users who are not members of the confluence-users group.
+
+        A huge function since there is no way to ask Confluence about what permissions a user has. You have to reconstruct the permissions
+        by asking all spaces which users and groups have permission to it, and which group members each group has.
+        """
+
+        # get the access matrix, built on the first call and reused after that
+        matrix = self.get_access_matrix(ignore_personal_spaces=ignore_personal_spaces, ignore_own_personal_space=ignore_own_personal_space, member_groups=(guest_group_name, 'confluence-users'))
+        index  = matrix.index
+
+        # the guest and ordinary user group members
+        guest_users    = index.members_of(index.group_id(guest_group_name))
+        ordinary_users = index.members_of(index.group_id('confluence-users'))
+
+        # init
+        logging.debug(f"Findinig users with {n_spaces_cutoff} or less spaces.")
+        total_users = 0
+        found_users = 0
+        n_spaces    = matrix.space_counts()
+
+        # find users with access to only n_spaces_cutoff spaces
+        possible_guests = {}
+        for user_id, user_n_spaces in zip(matrix.user_ids, n_spaces):
+
+            user = index.subject(user_id)
+
+            # filter out unlicensed users
+            if ignore_unlicenced and 'Unlicensed' in user['displayName']:
+                continue
+
+            # filter out deleted users
+            if ignore_deleted and 'Deleted' in user['displayName']:
+                continue
+
+            # filter out users who are not members of the confluence-users group
+            if require_confluence_access and user_id not in ordinary_users:
+                continue
+
+            # count user towards total
+            total_users += 1
+
+            # check if users who are members of the guest group should be skipped
+            user_class = 'ordinary'
+            if skip_guest_users and user_id in guest_users:
+                continue
+            # check if the user is a guest
+            elif user_id in guest_users:
+                user_class = 'guest'
+
+            # check if the user is a member in too many spaces to be eligible to be selected
+            if n_spaces_cutoff >= 0 and user_n_spaces > n_spaces_cutoff:
+                continue
+
+            # count number of found users
+            found_users += 1
+
+            # get the spaces a user has access to, directly or via groups
+            spaces_reached = { space_key:index.space(space_key) for space_key in matrix.spaces_of(user_id) }
+
+            # print user entry
+            logging.debug(f"{user.get('displayName', None)}\t{user_class}\t{user_n_spaces}\t{','.join(matrix.spaces_of(user_id, counted_only=True))}")
+
+            # save the user in the keep list
+            possible_guests[user_id] = {'user':user, 'spaces':spaces_reached, 'n_spaces':user_n_spaces, 'class':user_class}
+
+
+
+        logging.debug(f"Found {found_users} users out of {total_users} total users that are members of {n_spaces_cutoff} or less spaces.")
+        return possible_guests
+
+
+
+
+
+    def get_user_properties(self, user_id, limit=1000, expand=None, paginate=True):
+        """
+        Returns a user's properties
+        """
+        return self.get(f"{self.baseurl}/wiki/rest/api/user/{user_id}/property", expand=expand, paginate=paginate)[:limit]
+
+
+
+    def add_permission_to_space(self, space_key, entity_type, entity_id, target, operation):
+        """
+        Adds the permission to {operation} to content type {target} for entity of type {entity_type} with id {entity_id} in space {space_key}
+        """
+        # define url and payload
+        url     = f"{self.baseurl}/wiki/rest/api/space/{space_key}/permission"
+        payload = json.dumps({
+                                'subject'  : {
+                                                'type'      : entity_type,
+                                                'identifier': entity_id
+                                             },
+                                'operation': {
+                                                'key'   : operation,
+                                                'target': target,
+                                             }
+                            })
+
+        return self.post(url, data=payload, idempotent=True)
+
+
+
+
+    def add_space_grants(self, space_key, grants):
+        """
+        Adds the permissions in {grants} to space {space_key} one by one, read-space first since the others need it. If read-space
+        fails, the rest are not sent. Returns a list with a result dict per grant, see add_permissions.
+        """
+
+        # init
+        results = []
+        grants  = sorted(grants, key=lambda grant: (grant['operation'], grant['target']) != ('read', 'space'))
+        blocked = None
+
+        for grant in grants:
+
+            # don't send anything after a failed read-space grant
+            if blocked:
+                results.append({**grant, 'ok':False, 'status_code':None, 'error':blocked})
+                continue
+
+            try:
+                response = self.add_permission_to_space(space_key, grant['entity_type'], grant['entity_id'], grant['target'], grant['operation'])
+                ok       = response.ok or (response.status_code == 400 and 'already exist' in response.text.lower())
+                result   = {**grant, 'ok':ok, 'status_code':response.status_code, 'error':None if ok else response.text}
+            except requests.RequestException as e:
+                result   = {**grant, 'ok':False, 'status_code':None, 'error':str(e)}
+            results.append(result)
+
+            if not result['ok'] and (grant['operation'], grant['target']) == ('read', 'space'):
+                blocked = f"read-space failed: {result['error']}"
+
+        return results
+
+
+
+
+
+    def apply_action(self, action):
+        """
+        Applies a single plan action, calling the method named by its 'op' key with the rest of its keys as arguments.
+        Returns the action plus ok, status_code and error.
+        """
+        arguments = { key:value for key, value in action.items() if key != 'op' }
+        try:
+            response = getattr(self, action['op'])(**arguments)
+        except requests.RequestException as e:
+            return {**action, 'ok':False, 'status_code':None, 'error':str(e)}
+
+        # convert_to_guest_user returns nothing for users that already are guests
+        if response is None:
+            return {**action, 'ok':True, 'status_code':None, 'error':None}
+        return {**action, 'ok':response.ok, 'status_code':response.status_code, 'error':None if response.ok else response.text}
+
+
+
+
+
+    def apply_actions(self, actions):
+        """
+        Applies the plan actions in {actions} in order. Permission grants of one space are handed to add_space_grants, for read-space first.
+        Returns a list with a result per action.
+        """
+        if actions[0]['op'] == 'add_permission_to_space':
+            return self.add_space_grants(actions[0]['space_key'], actions)
+        return [ self.apply_action(action) for action in actions ]
+
+
+
+
+
+    def apply_plan(self, actions, checkpoint=None, description='plan actions'):
+        """
+        Applies the plan actions in {actions}, e.g. read from a plan file with read_plan, {fetch_workers} at a time.
+        Permission grants to the same space are applied in order with read-space first, all other actions are independent of each other.
+        Actions found in {checkpoint}, a Checkpoint or the path to one, are skipped, and completed actions are added to it, so an interrupted
+        run can just be started again. The progress is reported as {description}, and the run summary written to the configured run_summary_file.
+        Returns a list with a result per applied action, the action plus ok, status_code and error.
+        """
+
+        # init
+        checkpoint_path = isinstance(checkpoint, str)
+        if checkpoint_path:
+            checkpoint = Checkpoint(checkpoint)
+        progress = Progress(len(actions), description, summary_file=self.run_summary_file)
+        units    = {}
+
+        # split the actions into units that can run concurrently
+        for n, action in enumerate(actions):
+            if checkpoint is not None and action in checkpoint:
+                progress.skip()
+                continue
+
+            unit = ('space', action['space_key']) if action['op'] == 'add_permission_to_space' else ('action', n)
+            units.setdefault(unit, []).append(action)
+
+        # run the units, recording each completed action
+        results = []
+        for unit, unit_results in fetch_concurrently(self.apply_actions, units.values(), workers=self.fetch_workers, progress=progress,
+                                                     tally=lambda unit_results: (len(unit_results), sum(1 for result in unit_results if not result['ok']))):
+            for result in unit_results:
+                if result['ok'] and checkpoint is not None:
+                    checkpoint.add({ key:value for key, value in result.items() if key not in ('ok', 'status_code', 'error') })
+                results.append(result)
+
+        if checkpoint_path:
+            checkpoint.close()
+
+        # log a summary
+        summary = progress.close()
+        failed  = [ result for result in results if not result['ok'] ]
+        logging.info(f"Applied {summary['done'] - summary['errors']} of {summary['done']} {description} in {summary['seconds']:.1f}s ({summary['per_second']:.1f}/s), {summary['errors']} failed and {summary['skipped']} were already done.")
+        for result in failed:
+            logging.error(f"Failed {result}")
+
+        return results
+
+
+
+
+
+    def mutate_groups(self, changes, checkpoint=None):
+        """
+        Applies the group membership changes in {changes}, (user id, group id, 'add' or 'remove') tuples, {fetch_workers} at a time.
+        Each completed change is logged to {checkpoint}, a Checkpoint or the path to one, and skipped when run again, so an interrupted run
+        can just be restarted. Returns a summary dict with the number of changes done, failed and skipped, the time taken, the changes
+        per second and the results of the failed changes.
+        """
+
+        # init
+        ops     = {'add':'add_user_to_group', 'remove':'remove_user_from_group'}
+        actions = [ {'op':ops[op], 'user_id':user_id, 'group_id':group_id} for user_id, group_id, op in changes ]
+        started = time.monotonic()
+
+        results = self.apply_plan(actions, checkpoint=checkpoint, description="group changes")
+
+        # summarize
+        seconds = time.monotonic() - started
+        failed  = [ result for result in results if not result['ok'] ]
+        return {
+                    'done'      : len(results) - len(failed),
+                    'failed'    : len(failed),
+                    'skipped'   : len(actions) - len(results),
+                    'seconds'   : seconds,
+                    'per_second': len(results) / max(seconds, 1e-9),
+                    'failures'  : failed,
+               }
+
+
+
+
+
+    def add_permissions(self, grants, rounds=3):
+        """
+        Adds all permissions in {grants}, a list of dicts with the keys space_key, entity_type, entity_id, target and operation.
+        The grants of each space are sent in order with read-space first, while different spaces are handled {fetch_workers} at a time.
+        Grants that fail are retried for up to {rounds} rounds in all, without resending the ones that succeeded. A grant that already
+        exists counts as a success.
+        Returns a list with a result dict per grant, the grant plus ok, status_code and error.
+        """
+
+        # init, each grant only once
+        results = {}
+        pending = list({ (grant['space_key'], grant['entity_type'], grant['entity_id'], grant['target'], grant['operation']):grant for grant in grants }.values())
+
+        for round_n in range(rounds):
+
+            # wait a bit before retrying
+            if round_n:
+                time.sleep(self.session.retry_policy.delay(round_n))
+                logging.info(f"Retrying {len(pending)} failed permission grants, round {round_n + 1}/{rounds}.")
+
+            # group the grants per space
+            space_grants = defaultdict(list)
+            for grant in pending:
+                space_grants[grant['space_key']].append(grant)
+
+            # send the grants of different spaces concurrently
+            pending = []
+            for space_key, space_results in fetch_concurrently(lambda space_key: self.add_space_grants(space_key, space_grants[space_key]), space_grants, workers=self.fetch_workers, description="space permissions", summary_file=self.run_summary_file):
+                for result in space_results:
+                    key = (result['space_key'], result['entity_type'], result['entity_id'], result['target'], result['operation'])
+                    results[key] = result
+                    if not result['ok']:
+                        pending.append({ field:result[field] for field in ('space_key', 'entity_type', 'entity_id', 'target', 'operation') })
+
+            if not pending:
+                break
+
+        # log a summary
+        failed = [ result for result in results.values() if not result['ok'] ]
+        logging.info(f"Added {len(results) - len(failed)} of {len(results)} permissions.")
+        for result in failed:
+            logging.error(f"Failed to add {result['operation']}-{result['target']} for {result['entity_type']} {result['entity_id']} on space {result['space_key']}: {result['error']}")
+
+        return list(results.values())
+
+
+
+
+
+
+
+
+
+
+
+class Api_response:
+    """
+    Minimal stand-in for requests.Response returned by the async API, with the attributes the scripts use.
+    """
+
+    def __init__(self, status_code, text, headers):
+
+        self.status_code = status_code
+        self.text        = text
+        self.headers     = headers
+
+
+
+    @property
+    def ok(self):
+        return self.status_code < 400
+
+
+
+    @property
+    def content(self):
+        return self.text.encode()
+
+
+
+    def json(self):
+        return json.loads(self.text)
+
+
+
+
+
+class Async_confluence_cloud_api:
+    """
+    Asyncio counterpart of Confluence_cloud_api, with the same methods as coroutines. At most {max_concurrency} requests are in flight at once.
+    Requires aiohttp.
+    """
+
+    # create a object from a config file
+    def __init__(self, config):
+
+        self.user       = config['user']
+        self.api_token  = config['api_token']
+        self.baseurl    = config['url']
+        self.headers    = {
+                            "Accept": "application/json",
+                            "Content-Type": "application/json",
+                          }
+        self.max_concurrency  = config.get('max_concurrency', 50)
+        self.prefetch_workers = config.get('prefetch_workers', 4)
+        self.rate_limiter     = Rate_limiter(rate=config.get('rate_limit', 20), max_rate=config.get('max_rate_limit', 200))
+        self.retry_policy     = Retry_policy(config.get('retry_attempts'))
+        self.max_throttle_retries = 5
+        self.stats      = Request_stats()
+        self.hooks      = [self.stats]
+        self.stats_file = config.get('request_stats_file')
+
+        # the http session and semaphore belong to an event loop, so they are created on first use
+        self.http       = None
+        self.semaphore  = None
+
+
+
+
+
+    async def open(self):
+        """
+        Opens the pooled http session. Called automatically by the first request.
+        """
+        import asyncio
+        import aiohttp
+
+        self.semaphore = asyncio.Semaphore(self.max_concurrency)
+        self.http      = aiohttp.ClientSession(auth=aiohttp.BasicAuth(self.user, self.api_token),
+                                               headers=self.headers,
+                                               connector=aiohttp.TCPConnector(limit=self.max_concurrency),
+                                               )
+
+
+
+    async def close(self):
+        """
+        Closes the pooled http session, and logs and exports the requests per endpoint.
+        """
+        if self.http:
+            await self.http.close()
+            self.http = None
+            self.stats.log_summary()
+            if self.stats_file:
+                self.stats.export(self.stats_file)
+
+
+
+    async def __aenter__(self):
+        await self.open()
+        return self
+
+
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+
+
+
+
+    async def request(self, method, url, params=None, data=None, idempotent=False, page=None):
+        """
+        Sends a request, waiting for a free slot if {max_concurrency} requests are already in flight.
+        Throttled and failed requests are resent and recorded the same way as in Api_session.request.
+        """
+        import asyncio
+        import aiohttp
+
+        if self.http is None:
+            await self.open()
+
+        # init
+        attempt   = 0
+        throttled = 0
+        started   = time.monotonic()
+
+        while True:
+
+            # wait for the rate limiter
+            await asyncio.sleep(self.rate_limiter.reserve())
+
+            try:
+                async with self.semaphore:
+                    async with self.http.request(method, url, params=params, data=data) as response:
+                        api_response = Api_response(response.status, await response.text(), response.headers)
+
+            except (aiohttp.ClientConnectionError, asyncio.TimeoutError) as exception:
+
+                # a failed connect never reached the api, anything else might have
+                connect_failed = isinstance(exception, aiohttp.ClientConnectorError)
+                if not self.retry_policy.should_retry(method, attempt, connect_failed=connect_failed, idempotent=idempotent):
+                    record_request(self.hooks, method, url, None, started, attempt + throttled, page)
+                    raise
+
+                logging.warning(f"{method} {url} failed ({exception}), retrying.")
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+                continue
+
+            # resend the request if the api throttled it and it is safe, the rate limiter will hold it back as long as asked
+            throttle = self.rate_limiter.update(api_response.status_code, api_response.headers)
+            if throttle is not None and throttled < self.max_throttle_retries and (api_response.status_code == 429 or self.retry_policy.is_idempotent(method, idempotent)):
+                throttled += 1
+                continue
+
+            # resend the request after a server error, if it is safe
+            if self.retry_policy.should_retry(method, attempt, status_code=api_response.status_code, idempotent=idempotent):
+                logging.warning(f"{method} {url} returned {api_response.status_code}, retrying.")
+                await asyncio.sleep(self.retry_policy.delay(attempt))
+                attempt += 1
+                continue
+
+            record_request(self.hooks, method, url, api_response, started, attempt + throttled, page)
+            return api_response
+
+
+
+    async def get_json(self, url, params=None, page=None):
+        """
+        Sends a GET request and returns the decoded json response. {page} is the page number, if it is a page of a paginated listing.
+        """
+        logging.debug(f"Fetching URL: {url} {params or ''}")
+        response = await self.request("GET", url, params=params, page=page)
+
+        # the api answers errors with a json body too, which must not be mistaken for data, e.g. an empty last page
+        if not response.ok:
+            raise requests.HTTPError(f"GET {url} failed with status {response.status_code}: {response.text[:200]}", response=response)
+        return response.json()
+
+
+
+
+
+    async def get(self, url, params=None, data=None, expand=None, paginate=True):
+        """
+        Wrapper function to make API calls that will keep sending subsequent requests if the answer is paginated.
+        """
+
+        # merge the url parameters, expansions and data into a single query
+        query = dict(params or {})
+        if expand:
+            query['expand'] = expand
+        if data:
+            query.update(data)
+
+        # fetch results
+        response = await self.get_json(url, params=query)
+        results  = response.get('results')
+
+        # if there is no results key, return whole response object
+        if not results:
+            return response
+
+        # got them all in the first request
+        if not paginate:
+            return results
+
+        # keep asking for more until there is no more
+        results = []
+        async for page in self.iter_pages(url, response, query):
+            results += page
+
+        return results
+
+
+
+    async def iter_pages(self, url, response, params):
         """
-        Wrapper function to make API calls that will keep sending subsequent requests if the answer is paginated.
+        Async generator that yields the results of a paginated listing page by page, starting with the already fetched first page in {response}.
+        Works like Api_session.iter_pages, fetching {prefetch_workers} offset based pages at a time if the total is known.
+        """
+        import asyncio
+
+        # save inital response and learn the page size and the total, if there is one, from it
+        page      = response['results']
+        start     = response.get('start', params.get('start', 0))
+        page_size = response.get('limit') or params.get('limit') or len(page)
+        total     = page_total(response)
+
+        while True:
+
+            if page:
+                yield page
+
+            # a short page is the last one
+            if len(page) < page_size:
+                return
+
+            # if the api tells us about next pages, trust it to say when there are no more
+            next_url = next_link(response, url)
+            if '_links' in response and not next_url:
+                return
+
+            # fetch offset based pages of a known total a batch at a time, never past the end, stopping at the first short page
+            start += len(page)
+            if total is not None and not (next_url and 'cursor=' in next_url):
+                while start < total:
+                    offsets = range(start, min(start + page_size * self.prefetch_workers, total), page_size)
+                    batch   = await asyncio.gather(*[ self.get_json(url, params={**params, 'start':offset}, page=offset // page_size + 1) for offset in offsets ])
+                    for response in batch:
+                        page = response.get('results') or []
+                        if page:
+                            yield page
+                        if len(page) < page_size:
+                            return
+                    start += page_size * self.prefetch_workers
+                return
+
+            # anything else has to be followed one by one
+            if next_url:
+                response = await self.get_json(next_url, page=start // page_size + 1)
+            else:
+                response = await self.get_json(url, params={**params, 'start':start}, page=start // page_size + 1)
+            page = response.get('results') or []
+
+
+
+    async def iter_results(self, url, params=None, expand=None):
+        """
+        Async generator version of get, yields the results of a paginated listing one by one as the pages arrive.
         """
 
-        #pdb.set_trace()
-        # init
-        url_parameters = []
-
-        # if there is anything to expand
+        # merge the url parameters and expansions into a single query
+        query = dict(params or {})
         if expand:
-            url_parameters.append(f"expand={expand}")
+            query['expand'] = expand
 
-        # if there is a parameter dict
-        if params:
-            for key,val in params.items():
-                url_parameters.append(f"{str(key)}={str(val)}")
-
-        # check if a parameter separator (?) should be inserted in the url
-        if url_parameters:
-            url_parameters = f"?{'&'.join(url_parameters)}"
-            request_url = f"{url}{url_parameters}"
-        else:
-            request_url = url
-
-
-        # define url and send request
-        logging.debug(f"Fetching URL: {request_url}")
+        # nothing to iterate over if it is not a listing
+        response = await self.get_json(url, params=query)
+        if not response.get('results'):
+            return
 
-        # fetch results
-        response = requests.request( "GET", 
-                                     request_url, 
-                                     headers=self.headers, 
-                                     params=data,
-                                     auth=self.auth, 
-                                     ).json()
-
-        # check if confluence limited the number of hits, seems to do that if you ask for expansions, setting it to 50
-        if response.get('results') and paginate:
-
-            logging.debug(f"Possible API pagination detected, continuing sending more requests.")
-
-            # save inital response
-            results = response['results']
-
-            # loop until all hits are collected
-            i = 1
-            while response['results']:
-
-                # check if ? if already in the url
-                last_url_part = request_url.split('/')[-1]
-                if '?' in last_url_part:
-                    # add a & if there already is an url argument there
-                    argument_glue = '&'
-                else:
-                    # add it if it's not there already
-                    argument_glue = '?'
-
-
-                logging.debug(f"Fetching URL: {request_url}{argument_glue}start={ len(results) + 1 }")
-                # ask for a new batch of results
-                response = requests.request("GET",
-                                            f"{request_url}{argument_glue}start={ len(results) + 1 }", 
-                                            headers=self.headers,
-                                            params=data,
-                                            auth=self.auth,
-                                            ).json()
-
-                # save the new batch together with the previous ones
-                results += response['results']
-
-                # increase counteults = response['results']
-                i+=1
-            
-            logging.debug(f"API pagination finished, {i} pages fetched.")
+        async for page in self.iter_pages(url, response, query):
+            for result in page:
+                yield result
 
-        else:
-            # got them all in the first request
-            results = response.get('results')
 
-            # if there is no results key, return whole response object
-            if not results:
-                return response
 
-        # return
-        return results
 
 
-    def post(self, url, data=None, params=None):
+    async def post(self, url, data=None, params=None, idempotent=False):
         """
-        Wrapper function to post data to the API.
+        Wrapper function to post data to the API. Set {idempotent} if posting the same data twice does no harm, to let failed posts be retried.
         """
-        #pdb.set_trace()
-        return requests.request("POST", url, data=data, headers=self.headers, params=params, auth=self.auth,)
+        return await self.request("POST", url, data=data, params=params, idempotent=idempotent)
 
 
 
-    def delete(self, url, data=None, params=None):
+    async def delete(self, url, data=None, params=None):
         """
         Wrapper function to delete data to the API.
         """
-        #pdb.set_trace()
-        return requests.request("DELETE", url, data=data, headers=self.headers, params=params, auth=self.auth,)
+        return await self.request("DELETE", url, data=data, params=params)
 
 
 
 
-    def get_spaces(self, limit=10000, expand=None, paginate=True):
+    async def get_spaces(self, limit=10000, expand=None, paginate=True):
         """
         Returns a list of spaces, limited in number by {limit}. Expands properties listed comma-separated in {expand}.
         """
-        # define url and send request
-        return self.get(f"{self.baseurl}/wiki/rest/api/space", expand=expand, paginate=paginate)[:limit]
+        return (await self.get(f"{self.baseurl}/wiki/rest/api/space", expand=expand, paginate=paginate))[:limit]
 
 
-    def get_search_users(self, limit=10000, expand=None, paginate=True):
+    async def iter_spaces(self, expand=None):
+        """
+        Async generator that yields all spaces as they are fetched. Expands properties listed comma-separated in {expand}.
+        """
+        async for space in self.iter_results(f"{self.baseurl}/wiki/rest/api/space", expand=expand):
+            yield space
+
+
+    async def get_search_users(self, limit=10000, expand=None, paginate=True):
         """
         Returns a list of all Confluence users (not guests), limited in number by {limit}.
         """
-        return self.get(f"{self.baseurl}/wiki/rest/api/search/user", params={"cql":"type=user"}, expand=expand, paginate=paginate)[:limit]
+        return (await self.get(f"{self.baseurl}/wiki/rest/api/search/user", params={"cql":"type=user"}, expand=expand, paginate=paginate))[:limit]
 
 
-    def get_users(self, limit=999999, expand=None, paginate=True):
+    async def get_users(self, limit=999999, expand=None, paginate=True):
         """
         Returns a list of all Confluence users, limited in number by {limit}.
         """
-        # fetch all search users and groups
-        search_users   = self.get_search_users() # will not return guests, based on the search for entities tagged as users
-        groups         = self.get_groups()
-
-        # get users that are member of the guest group
-        guest_group_id = [group['id'] for group in groups if group['name'].startswith('confluence-guests-')][0]
-        guest_users    = self.get_group_members(guest_group_id, limit=999999)
+        import asyncio
 
-        # get users that are member of the guest group
+        # search users will not include guests, so also fetch the members of the guest and ordinary user groups
+        groups                 = await self.get_groups()
+        guest_group_id         = [group['id'] for group in groups if group['name'].startswith('confluence-guests-')][0]
         ordinary_user_group_id = [group['id'] for group in groups if group['name'].startswith('confluence-users')][0]
-        ordinary_users         = self.get_group_members(ordinary_user_group_id, limit=999999)
+        user_lists = await asyncio.gather(self.get_search_users(),
+                                          self.get_group_members(guest_group_id, limit=999999),
+                                          self.get_group_members(ordinary_user_group_id, limit=999999))
 
-        # merge lists
+        # merge lists, serach users are wrapped in a user key, group membership users are not
         merged_users = {}
-        for possible_users in [search_users, guest_users, ordinary_users]:
+        for possible_users in user_lists:
             for user in possible_users:
-                try:
-                    # serach users are structured like this
-                    merged_users[user['user']['accountId']] = user['user']
-                except:
-                    # group membership users are structured like this
-                    merged_users[user['accountId']] = user
+                user = user.get('user', user)
+                merged_users.setdefault(user['accountId'], user)
 
         # return as a list of users
-        return [user for user in merged_users.values()][:limit]
+        return list(merged_users.values())[:limit]
 
 
-
-    def get_user(self, user_id, expand=None, paginate=True):
+    async def get_user(self, user_id, expand=None, paginate=True):
         """
         Returns info about a user.
         """
-        return self.get(f"{self.baseurl}/wiki/rest/api/user", data={"accountId":user_id}, expand=expand, paginate=paginate)
+        return await self.get(f"{self.baseurl}/wiki/rest/api/user", data={"accountId":user_id}, expand=expand, paginate=paginate)
 
 
-    def get_groups(self, limit=1000, expand=None, paginate=True):
+    async def get_groups(self, limit=1000, expand=None, paginate=True):
         """
         Returns a list of groups, limited in number by {limit}.
         """
-        return self.get(f"{self.baseurl}/wiki/rest/api/group", expand=expand, paginate=paginate)[:limit]
+        return (await self.get(f"{self.baseurl}/wiki/rest/api/group", expand=expand, paginate=paginate))[:limit]
 
 
-    def get_group_members(self, group_id, limit=1000, expand=None, paginate=True):
+    async def iter_groups(self, expand=None):
+        """
+        Async generator that yields all groups as they are fetched.
+        """
+        async for group in self.iter_results(f"{self.baseurl}/wiki/rest/api/group", expand=expand):
+            yield group
+
+
+    async def get_group_members(self, group_id, limit=1000, expand=None, paginate=True):
         """
         Returns a list of groups members of group {group_id}, limited in number by {limit}.
         """
         try:
-            return self.get(f"{self.baseurl}/wiki/rest/api/group/{group_id}/membersByGroupId", expand=expand, paginate=paginate)[:limit]
+            return (await self.get(f"{self.baseurl}/wiki/rest/api/group/{group_id}/membersByGroupId", expand=expand, paginate=paginate))[:limit]
         except TypeError:
             return []
 
 
-    def convert_to_guest_user(self, user_id, guest_group_id, remove_other_groups=False):
+    async def iter_group_members(self, group_id, expand=None):
+        """
+        Async generator that yields the members of group {group_id} as they are fetched.
+        """
+        async for member in self.iter_results(f"{self.baseurl}/wiki/rest/api/group/{group_id}/membersByGroupId", expand=expand):
+            yield member
+
+
+    async def get_all_group_members(self, groups, limit=1000):
+        """
+        Returns a dict with the members of each group in {groups}, keyed on group id. All groups are fetched concurrently.
+        """
+        import asyncio
+
+        members = await asyncio.gather(*[ self.get_group_members(group['id'], limit=limit) for group in groups ])
+        return { group['id']:group_members for group, group_members in zip(groups, members) }
+
+
+    async def convert_to_guest_user(self, user_id, guest_group_id, remove_other_groups=False):
         """
         Coverts a user, identified by {user_id}, to a guest user by adding them to the guest group, identified by {guest_group_id}.
         Will handle removing other groups if need be.
         """
+        import asyncio
 
         # get user's group memberships
-        user_group_memberships = self.get_user_group_memberships(user_id)
+        user_group_memberships = await self.get_user_group_memberships(user_id)
 
         # check if the user already is a guest user
         if guest_group_id in [ group['id'] for group in user_group_memberships ]:
             logging.debug(f'Skipping converting users {user_id} to guest since they already are a guest.')
-
-            # skip in that case
             return
 
-        # check if all other groups should be removed
-        if remove_user_from_group:
-            # remove user from all current groups
-            for group in user_group_memberships:
-                self.remove_user_from_group(user_id, group['id'])
-
+        # remove user from all current groups if asked to
+        if remove_other_groups:
+            await asyncio.gather(*[ self.remove_user_from_group(user_id, group['id']) for group in user_group_memberships ])
 
-        #pdb.set_trace()
         # add user to the guest group
-        return self.add_user_to_group(user_id, guest_group_id)
+        return await self.add_user_to_group(user_id, guest_group_id)
 
 
-    def add_user_to_group(self, user_id, group_id):
+    async def add_user_to_group(self, user_id, group_id):
         """
         Adds a user, identified by {user_id}, to a group, indentified by {group_id}.
         """
-        # define url and payload
         url     = f"{self.baseurl}/wiki/rest/api/group/userByGroupId"
         query   = {
                     'groupId' : group_id
@@ -689,327 +3600,163 @@ class Confluence_cloud_api:
         payload = json.dumps({
                                 'accountId' : user_id,
                              })
-
-#        pdb.set_trace()
-        return self.post(url, params=query, data=payload)
-
+        return await self.post(url, params=query, data=payload, idempotent=True)
 
 
-
-    def remove_user_from_group(self, user_id, group_id):
+    async def remove_user_from_group(self, user_id, group_id):
         """
         Removes a user, identified by {user_id}, from a group, indentified by {group_id}.
         """
-        # define url and payload
         url     = f"{self.baseurl}/wiki/rest/api/group/userByGroupId"
         query   = {
                     'groupId'   : group_id,
                     'accountId' : user_id,
                   }
-
-        #pdb.set_trace()
-        return self.delete(url, params=query)
-
-
+        return await self.delete(url, params=query)
 
 
-    def get_user_group_memberships(self, user_id):
+    async def get_user_group_memberships(self, user_id):
         """
         Fetch a list of all groups a user is member of.
         """
-
-        # define url and payload
-        url     = f"{self.baseurl}/wiki/rest/api/user/memberof"
-        query   = {
-                    'accountId' : user_id
-                  }
-
-        return self.get(url, params=query)
-
-
-
+        return await self.get(f"{self.baseurl}/wiki/rest/api/user/memberof", params={'accountId':user_id})
 
 
-    def add_label_to_space(self, space_key, label, prefix='team'):
+    async def add_label_to_space(self, space_key, label, prefix='team'):
         """
         Adds the label {label} to a space, indentified by {space_key}, using the prefix {prefix}.
         """
-        # define url and payload
         url     = f"{self.baseurl}/wiki/rest/api/space/{space_key}/label"
         payload = json.dumps([{
                                 'prefix' : prefix,
                                 'name'   : label,
                              }])
-        query = {}
-
-#        pdb.set_trace()
-        return self.post(url, params=query, data=payload)
-
-
-
+        return await self.post(url, params={}, data=payload, idempotent=True)
 
 
-    def remove_label_from_space(self, space_key, label, prefix='team'):
+    async def remove_label_from_space(self, space_key, label, prefix='team'):
         """
         Removes the label {label} from a space, indentified by {space_key}.
         """
-        # define url and payload
         url     = f"{self.baseurl}/wiki/rest/api/space/{space_key}/label"
         query = {
                     'prefix' : prefix,
                     'name'   : label,
                 }
-
-#        pdb.set_trace()
-        return self.delete(url, params=query)
-
-
-
-
-
-
-
+        return await self.delete(url, params=query)
 
 
-    def find_possible_guest_users(self, n_spaces_cutoff=-1, ignore_personal_spaces=True, ignore_unlicenced=True, ignore_deleted=True, guest_group_name='confluence-guests-scilifelab', skip_guest_users=True, require_confluence_access=True):
+    async def get_user_properties(self, user_id, limit=1000, expand=None, paginate=True):
         """
-        Find all users that are members of maximum {n_spaces_cutoff} spaces. If negative, all users will be returned.
-        If {ignore_personal_spaces} is True it will not count the personal space (a space with same name as username) towards this number.
-        Will only check if a user is mentioned in a space's permissions, not what permissions they actually have.
-        ignore_unlicenced will filter out users with 'Unlicensed' in their name.
-        ignore_deleted will filter out users with 'Deleted' in their name.
-        guest_group_name is the name of the group that is considered the guest group.
-        skip_guest_users will ignore users who are already members of the guest group.
-        require_confluence_access will filter out users who are not members of the confluence-users group.
-
-        A huge function since there is no way to ask Confluence about what permissions a user has. You have to reconstruct the permissions
-        by asking all spaces which users and groups have permission to it, and which group members each group has.
+        Returns a user's properties
         """
+        return (await self.get(f"{self.baseurl}/wiki/rest/api/user/{user_id}/property", expand=expand, paginate=paginate))[:limit]
 
-        from thefuzz import fuzz
-    #pdb.set_trace()
-
-        # get a list of all spaces
-        logging.info("Fetching all spaces from API.")
-        spaces = self.get_spaces(expand="permissions")
-        
-        # init
-        user_permissions = {}
-        group_permissions = {}
-        
-        ## Get all user-space and group-space  memberships
-        # go through all spaces
-        logging.info("Parsing permissions.")
-        for space in spaces:
-
-            # skip archived spaces
-            if space['status'] == 'archived':
-                continue
-
-            # skip personal spaces
-            if ignore_personal_spaces:
-                if space['type'] == 'personal':
-                    continue
-            
-            logging.debug(f"Space: {space['name']}")
-        
-            # go through all permissions
-            for permission in space['permissions']:
-        
-                # skip empty permissions
-                if 'subjects' not in permission.keys():
-                    continue
-        
-                # if it is a user permission
-                if permission['subjects'].get('user'):
-        
-                    # for all users with permission
-                    for user in permission['subjects']['user']['results']:
-        
-                        # save the user and space info
-                        try:
-                            logging.debug(f"User: {user['accountId']}")
-                            user_permissions[user['accountId']]['spaces'][space['key']] = space
-
-                        except KeyError:
-                            # if it is the first time seeing this user
-                            user_permissions[user['accountId']] = {}
-                            user_permissions[user['accountId']]['spaces'] = {space['key']:space}
-                            user_permissions[user['accountId']]['user'] = user
-        
-                # if it is a group permission
-                elif permission['subjects'].get('group'):
-        
-                    # for all groups with permission
-                    for group in permission['subjects']['group']['results']:
-        
-                        # save the group and space info
-                        try:
-                            logging.debug(f"Group: {group['id']}")
-                            group_permissions[group['id']]['spaces'][space['key']] = space
-                        except KeyError:
-                            # if it is the first time seeing this group
-                            group_permissions[group['id']] = {}
-                            group_permissions[group['id']]['spaces'] = {space['key']:space}
-                            group_permissions[group['id']]['group'] = group
-        
-        logging.debug("Parsing permissions finished.")
-        
-        ## get a complete list of all users
-        logging.info("Fetching all users from API.")
-        users = self.get_users() 
-
-        # add all users to user_permissions dict to make sure all users are present, even those who don't have any stated permissions in spaces
-        for user in users:
-
-            # find missing users
-            if user['accountId'] not in user_permissions:
-
-                # initiate entry
-                logging.debug(f"Missing user: {user}")
-                user_permissions[user['accountId']] = {'spaces':{}, 'user':user}
-
-
-        # get all groups
-        logging.info(f"Fetching groups.")
-        groups = self.get_groups()
-
-        # for each groups, get members
-        for group in groups:
-
-            # fetch group members
-            logging.info(f"Fetching group memebers from {group['name']}")
-            members = self.get_group_members(group_id=group['id'])
-
-            # initiate entry if group is missing in group_permissions
-            if group['id'] not in group_permissions:
-                group_permissions[group['id']] = {'spaces':{}, 'group':group}
-
-            # skip groups with no permissions
-
-            # for each member, add the groups spaces to the users spaces list
-            for member in members:
 
-                # initiate entry if member is missing in member_permissions
-                if member['accountId'] not in user_permissions:
-
-                    # initiate entry
-                    user_permissions[member['accountId']] = {'spaces':{}, 'user':member}
-
-                # add group spaces to user spaces
-                user_permissions[member['accountId']]['spaces'].update(group_permissions[group['id']]['spaces'])
+    async def add_permission_to_space(self, space_key, entity_type, entity_id, target, operation):
+        """
+        Adds the permission to {operation} to content type {target} for entity of type {entity_type} with id {entity_id} in space {space_key}
+        """
+        url     = f"{self.baseurl}/wiki/rest/api/space/{space_key}/permission"
+        payload = json.dumps({
+                                'subject'  : {
+                                                'type'      : entity_type,
+                                                'identifier': entity_id
+                                             },
+                                'operation': {
+                                                'key'   : operation,
+                                                'target': target,
+                                             }
+                            })
+        return await self.post(url, data=payload, idempotent=True)
 
-            # save the guest group members for later
-            if group['name'] == guest_group_name:
-                guest_users = { member['accountId']:member for member in members }
 
-            elif group['name'] == 'confluence-users':
-                ordinary_users = { member['accountId']:member for member in members }
 
 
-        # make a lookup table for space keys to space names for easy access
-        key_to_name = { space['key']:space['name'] for space in spaces}
 
-        # init
-        logging.debug(f"Findinig users with {n_spaces_cutoff} or less spaces.")
-        total_users = 0
-        found_users = 0
+class Sync_facade:
+    """
+    Makes an async API object usable from ordinary synchronous code, like the CLI scripts. The async API runs in an event loop in a background thread.
+    Coroutine methods become ordinary methods and async generators become ordinary generators, so it is a drop in replacement for the sync API class.
+    Use run_many to have many calls in flight at once.
+    """
 
-        # find users with access to only n_spaces_cutoff spaces
-        possible_guests = {}
-        for user_id,user_perm in user_permissions.items():
+    def __init__(self, async_api):
 
-            # filter out unlicensed users
-            if ignore_unlicenced and 'Unlicensed' in user_perm['user']['displayName']:
-                continue
+        import asyncio
 
-            # filter out deleted users
-            if ignore_deleted and 'Deleted' in user_perm['user']['displayName']:
-                continue
+        self.async_api = async_api
 
-            # filter out users who are not members of the confluence-users group
-            if require_confluence_access and user_id not in ordinary_users:
-                continue
+        # run an event loop in a background thread
+        self.loop   = asyncio.new_event_loop()
+        self.thread = threading.Thread(target=self.loop.run_forever, daemon=True)
+        self.thread.start()
 
-            # count user towards total
-            total_users += 1
+        # close the http session and stop the loop when the script finishes
+        atexit.register(self.close)
 
-            # get the name of the space a user has access to
-            user_spaces = {}
-            if len(user_perm['spaces']) > 0:
-                user_spaces = user_perm['spaces'].copy()
 
 
+    def run(self, coroutine):
+        """
+        Runs a coroutine in the background event loop and returns its result.
+        """
+        import asyncio
 
-            # filter out perosnal spaces if asked to
-            if ignore_personal_spaces:
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
 
-                # go through the names of all spaces the user is a member of
-                for user_space_key, user_space in user_perm['spaces'].items():
 
-                    # if it is a personal space and the space name is too similar, delete it
-                    if user_space['type'] == 'personal' and fuzz.ratio(name_processor(user_perm['user']['publicName']), name_processor(user_space['name'])) >= 75:
-                        del user_spaces[user_space_key]
 
+    def run_many(self, method_name, argument_list):
+        """
+        Calls the async method {method_name} once per argument tuple in {argument_list}, all at once, and returns the results in the same order.
+        The concurrency is limited by the async API.
+        """
+        import asyncio
 
-            # check if users who are members of the guest group should be skipped
-            user_class = 'ordinary'
-            if skip_guest_users and user_id in guest_users:
-                continue
-            # check if the user is a guest
-            elif user_id in guest_users:
-                user_class = 'guest'
+        method = getattr(self.async_api, method_name)
 
-            # check if the user is a member in too many spaces to be eligible to be selected
-            if n_spaces_cutoff >= 0 and len(user_spaces) > n_spaces_cutoff: 
-                continue
-            
-            # count number of found users
-            found_users += 1
+        async def gather():
+            return await asyncio.gather(*[ method(*arguments) for arguments in argument_list ])
 
-            # print user entry
-            logging.debug(f"{user_perm['user'].get('displayName', None)}\t{user_class}\t{len(user_spaces)}\t{','.join(user_spaces.keys())}")
+        return self.run(gather())
 
-            # save the user in the keep list
-            possible_guests[user_id] = {'user':user_perm['user'], 'spaces':user_perm['spaces'], 'n_spaces':len(user_spaces), 'class':user_class}
 
 
+    def iterate(self, async_generator):
+        """
+        Generator that yields the items of an async generator running in the background event loop.
+        """
+        while True:
+            try:
+                yield self.run(async_generator.__anext__())
+            except StopAsyncIteration:
+                return
 
-        logging.debug(f"Found {found_users} users out of {total_users} total users that are members of {n_spaces_cutoff} or less spaces.")
-        return possible_guests
 
 
+    def __getattr__(self, name):
 
+        import inspect
 
+        attribute = getattr(self.async_api, name)
 
-    def get_user_properties(self, user_id, limit=1000, expand=None, paginate=True):
-        """
-        Returns a user's properties
-        """
-        return self.get(f"{self.baseurl}/wiki/rest/api/user/{user_id}/property", expand=expand, paginate=paginate)[:limit]
+        # wrap async generators and coroutines to be called synchronously
+        if inspect.isasyncgenfunction(attribute):
+            return lambda *args, **kwargs: self.iterate(attribute(*args, **kwargs))
+        if inspect.iscoroutinefunction(attribute):
+            return lambda *args, **kwargs: self.run(attribute(*args, **kwargs))
+        return attribute
 
 
 
-    def add_permission_to_space(self, space_key, entity_type, entity_id, target, operation):
+    def close(self):
         """
-        Adds the permission to {operation} to content type {target} for entity of type {entity_type} with id {entity_id} in space {space_key}
+        Closes the async API and stops the event loop.
         """
-        # define url and payload
-        url     = f"{self.baseurl}/wiki/rest/api/space/{space_key}/permission"
-        payload = json.dumps({
-                                'subject'  : {
-                                                'type'      : entity_type,
-                                                'identifier': entity_id
-                                             },
-                                'operation': {
-                                                'key'   : operation,
-                                                'target': target,
-                                             }
-                            })
-
-        return self.post(url, data=payload)
-
-
+        if self.loop.is_running():
+            self.run(self.async_api.close())
+            self.loop.call_soon_threadsafe(self.loop.stop)
 
 
 
@@ -1035,6 +3782,8 @@ class Jira_cloud_api:
                             "Accept": "application/json",
                             "Content-Type": "application/json",
                           }
+        self.session    = Api_session(self.auth, self.headers, pool_size=config.get('pool_size', 10), rate_limiter=Rate_limiter(rate=config.get('rate_limit', 20), max_rate=config.get('max_rate_limit', 200)), retry_policy=Retry_policy(config.get('retry_attempts')), stats_file=config.get('request_stats_file'))
+        self.prefetch_workers = config.get('prefetch_workers', 4)
 
 
 
@@ -1045,86 +3794,39 @@ class Jira_cloud_api:
         Wrapper function to make API calls that will keep sending subsequent requests if the answer is paginated.
         """
 
-        #pdb.set_trace()
-        # init
-        url_parameters = []
-
-        # if there is anything to expand
+        # merge the url parameters and expansions into a single query
+        query = dict(params or {})
         if expand:
-            url_parameters.append(f"expand={expand}")
-
-        # if there is a parameter dict
-        if params:
-            for key,val in params.items():
-                url_parameters.append(f"{str(key)}={str(val)}")
-
-        # check if a parameter separator (?) should be inserted in the url
-        if url_parameters:
-            url_parameters = f"?{'&'.join(url_parameters)}"
-            request_url = f"{url}{url_parameters}"
-        else:
-            request_url = url
+            query['expand'] = expand
 
-
-        # define url and send request
-        logging.debug(f"Fetching URL: {request_url}")
-        
         # fetch results
-        response = requests.request( "GET", request_url, headers=self.headers, auth=self.auth ).json()
-
-        # check if confluence limited the number of hits, seems to do that if you ask for expansions, setting it to 50
-        #pdb.set_trace()
-        if response['results'] and paginate:
-
-            logging.debug(f"Possible API pagination detected, continuing sending more requests.")
-
-            # save inital response
-            results = response['results']
-
-            # loop until all hits are collected
-            i = 1
-            while response['results']:
+        response = self.session.get_json(url, params=query)
+        results  = page_results(response)
 
-                # check if ? if already in the url
-                last_url_part = request_url.split('/')[-1]
-                if '?' in last_url_part:
-                    # add a & if there already is an url argument there
-                    argument_glue = '&'
-                else:
-                    # add it if it's not there already
-                    argument_glue = '?'
-
-
-                logging.debug(f"Fetching URL: {request_url}{argument_glue}start={ len(results) + 1 }")
-                # ask for a new batch of results
-                response = requests.request("GET",
-                                            f"{request_url}{argument_glue}start={ len(results) + 1 }", 
-                                            headers=self.headers,
-                                            auth=self.auth,
-                                            ).json()
+        # if it is not a listing, return whole response object
+        if results is None:
+            return response
 
-                # save the new batch together with the previous ones
-                results += response['results']
+        # got them all in the first request
+        if not results or not paginate:
+            return results
 
-                # increase counteults = response['results']
-                i+=1
-            
-            logging.debug(f"API pagination finished, {i} pages fetched.")
+        # jira paginates plain lists with startAt/maxResults instead of start/limit
+        results = []
+        for page in self.session.iter_pages(url, response, params=query, workers=self.prefetch_workers, start_param='startAt', limit_param='maxResults'):
 
-        else:
-            # got them all in the first request
-            results = response['results']
+            # save the new batch together with the previous ones
+            results += page
 
-        # return
         return results
 
 
-    def post(self, url, data=None, params=None):
+    def post(self, url, data=None, params=None, idempotent=False):
         """
-        Wrapper function to post data to the API.
+        Wrapper function to post data to the API. Set {idempotent} if posting the same data twice does no harm, to let failed posts be retried.
         """
         #pdb.set_trace()
-        return requests.request("POST", url, data=data, headers=self.headers, params=params, auth=self.auth,)
+        return self.session.request("POST", url, data=data, params=params, idempotent=idempotent)
 
 
 
@@ -1133,7 +3835,7 @@ class Jira_cloud_api:
         Wrapper function to delete data to the API.
         """
         #pdb.set_trace()
-        return requests.request("DELETE", url, data=data, headers=self.headers, params=params, auth=self.auth,)
+        return self.session.request("DELETE", url, data=data, params=params)
 
 
 
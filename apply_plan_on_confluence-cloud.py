@@ -0,0 +1,54 @@
+#!/usr/bin/env python
+import sys
+from Confluence_apis import Confluence_cloud_api, read_plan, load_config
+import logging
+
+# configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] %(levelname)s\t[%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+    datefmt="%d/%b/%Y %H:%M:%S",
+    stream=sys.stdout)
+
+
+# user help message
+usage = f"""Usage: python3 {sys.argv[0]} <atlassian config yaml file> <plan file> [<checkpoint file>]
+
+Applies a plan written by a script run with --plan-only. Completed actions are logged to the checkpoint file (default <plan file>.done),
+so an interrupted run picks up where it left off when started again with the same files."""
+
+# get the arguments
+try:
+    logging.debug("Fetching config filename.")
+    atlassian_config_filename = sys.argv[1]
+except IndexError:
+    print(f"{usage}\n\nERROR: Atlassian config file argument missing")
+    sys.exit()
+
+try:
+    logging.debug("Fetching plan filename.")
+    plan_file = sys.argv[2]
+except IndexError:
+    print(f"{usage}\n\nERROR: Plan file argument missing")
+    sys.exit()
+
+try:
+    checkpoint_file = sys.argv[3]
+except IndexError:
+    checkpoint_file = f"{plan_file}.done"
+
+# read the atlassian config file
+logging.debug("Reading config file.")
+config = load_config(atlassian_config_filename)
+
+
+# create confluence api instance
+logging.debug("Creating confluence api object")
+confluence = Confluence_cloud_api(config)
+
+# apply the plan
+actions = read_plan(plan_file)
+logging.info(f"Applying {len(actions)} actions from {plan_file}")
+results = confluence.apply_plan(actions, checkpoint=checkpoint_file)
+
+logging.info(f"Finished")
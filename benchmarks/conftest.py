@@ -0,0 +1,148 @@
+import os
+import sys
+import json
+import time
+import socket
+import tracemalloc
+import subprocess
+import urllib.request
+import pytest
+
+# the scripts and Confluence_apis live in the repo root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+# synthetic tenant sizes, (users, spaces), pick with BENCHMARK_TENANTS=1k,10k,50k
+TENANTS = {
+            '1k'     : (1000, 500),
+            '10k'    : (10000, 5000),
+            '50k'    : (50000, 5000),
+          }
+
+
+
+def free_port():
+    """
+    Returns a port nothing listens on.
+    """
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+
+class Mock_process:
+    """
+    Runs mock_atlassian_server.py in a process of its own, so the CPU time and memory of serving the tenant is not counted as the client's.
+    """
+
+    def __init__(self, n_users, n_spaces, page_limit, latency, throttle_rate):
+
+        self.url     = f"http://127.0.0.1:{free_port()}"
+        self.process = subprocess.Popen([sys.executable, os.path.join(REPO_ROOT, 'mock_atlassian_server.py'),
+                                         '--users', str(n_users), '--spaces', str(n_spaces), '--page-limit', str(page_limit),
+                                         '--latency', str(latency), '--throttle-rate', str(throttle_rate), '--port', self.url.rsplit(':', 1)[1]],
+                                        stdout=subprocess.DEVNULL)
+
+        # wait for the tenant to be generated and the server to answer
+        for _ in range(600):
+            try:
+                self.stats()
+                return
+            except OSError:
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("mock_atlassian_server.py did not start")
+
+
+
+    def stats(self):
+        with urllib.request.urlopen(f"{self.url}/mock/stats") as response:
+            return json.loads(response.read())
+
+
+
+    def reset(self):
+        urllib.request.urlopen(urllib.request.Request(f"{self.url}/mock/reset", method='POST')).close()
+
+
+
+    def stop(self):
+        self.process.terminate()
+        self.process.wait()
+
+
+
+def pytest_generate_tests(metafunc):
+    if 'tenant' in metafunc.fixturenames:
+        sizes = os.environ.get('BENCHMARK_TENANTS', '1k').split(',')
+        metafunc.parametrize('tenant', sizes, indirect=True, scope='session')
+
+
+
+@pytest.fixture(scope='session')
+def tenant(request):
+    """
+    A mock tenant of the size in request.param, served in a process of its own.
+    """
+    n_users, n_spaces = TENANTS[request.param]
+    mock = Mock_process(n_users, n_spaces,
+                        page_limit=int(os.environ.get('BENCHMARK_PAGE_LIMIT', 200)),
+                        latency=float(os.environ.get('BENCHMARK_LATENCY', 0)),
+                        throttle_rate=float(os.environ.get('BENCHMARK_THROTTLE_RATE', 0)))
+    yield mock
+    mock.stop()
+
+
+
+@pytest.fixture
+def config(tenant):
+    """
+    A cloud config pointing to the mock tenant. The rate limiter starts high, it is the code that is measured, not the rate.
+    """
+    return {
+                'url'              : tenant.url,
+                'user'             : 'mock',
+                'api_token'        : 'mock',
+                'rate_limit'       : float(os.environ.get('BENCHMARK_RATE_LIMIT', 1000)),
+                'max_rate_limit'   : 10000,
+           }
+
+
+
+@pytest.fixture
+def measure(benchmark, tenant):
+    """
+    Returns a function that benchmarks calling {target} and records the requests it issued, its CPU time and the peak memory it allocated.
+    """
+
+    def run(target, setup=None, rounds=3):
+
+        stats = {'requests':[], 'cpu_seconds':[]}
+
+        def measured(*args, **kwargs):
+            tenant.reset()
+            cpu    = time.process_time()
+            result = target(*args, **kwargs)
+            stats['cpu_seconds'].append(time.process_time() - cpu)
+            stats['requests'].append(tenant.stats()['requests'])
+            return result
+
+        result = benchmark.pedantic(measured, setup=setup, rounds=rounds, iterations=1)
+
+        # the peak memory allocated by one more, untimed round. tracemalloc slows the code down too much to trace the timed rounds,
+        # and unlike the RSS of the process its peak can be reset, so earlier benchmarks don't leak into this one
+        args, kwargs = setup() if setup else ((), {})
+        tracemalloc.start()
+        try:
+            target(*args, **(kwargs or {}))
+            peak = tracemalloc.get_traced_memory()[1]
+        finally:
+            tracemalloc.stop()
+
+        benchmark.extra_info['requests']     = max(stats['requests'])
+        benchmark.extra_info['cpu_seconds']  = min(stats['cpu_seconds'])
+        benchmark.extra_info['peak_mb']      = peak / 2**20
+        return result
+
+    return run
@@ -0,0 +1,81 @@
+import random
+from Confluence_apis import Confluence_cloud_api, Permission_index, Transfer_planner
+
+
+
+def test_find_possible_guest_users(measure, config):
+    """
+    The whole guest eligibility analysis, fetching included, with a fresh api object each round so nothing is reused.
+    """
+    guests = measure(lambda: Confluence_cloud_api(config).find_possible_guest_users(n_spaces_cutoff=1, guest_group_name='confluence-guests-mock'))
+    assert guests is not None
+
+
+
+def test_guest_cutoffs_on_built_matrix(measure, config):
+    """
+    Repeated cutoff queries once the access matrix is built, i.e. the analysis alone. Should not issue any requests.
+    """
+    confluence = Confluence_cloud_api(config)
+    confluence.find_possible_guest_users(n_spaces_cutoff=1, guest_group_name='confluence-guests-mock')
+
+    measure(lambda: [ confluence.find_possible_guest_users(n_spaces_cutoff=cutoff, guest_group_name='confluence-guests-mock') for cutoff in range(6) ])
+
+
+
+def test_transfer_planning(measure, config):
+    """
+    Planning permission transfers between 100 random user pairs, as transfer_user_permissions-cloud.py does after fetching the tenant.
+    """
+
+    # fetch the tenant once
+    confluence = Confluence_cloud_api(config)
+    spaces     = confluence.get_spaces(expand="permissions")
+    users      = confluence.get_users()
+    groups     = confluence.get_groups()
+    rng        = random.Random(0)
+    pairs      = [ tuple(pair['accountId'] for pair in rng.sample(users, 2)) for _ in range(100) ]
+
+    def plan():
+        index = Permission_index()
+        index.add_spaces(spaces)
+        index.add_users(users)
+        for group in groups:
+            index.add_subject('group', group)
+        planner = Transfer_planner(index)
+        return [ planner.plan(old_id, new_id) for old_id, new_id in pairs ]
+
+    plans = measure(plan)
+    assert len(plans) == len(pairs)
+
+
+
+def test_personal_spaces_are_not_counted(config):
+    """
+    Not a benchmark. Ignoring personal spaces leaves all of them out of the matrix.
+    """
+    confluence = Confluence_cloud_api(config)
+    matrix     = confluence.get_access_matrix(ignore_personal_spaces=True)
+    personal   = { space['key'] for space in confluence.get_spaces() if space['type'] == 'personal' }
+    assert personal
+
+    for user_id in matrix.user_ids:
+        assert not personal & set(matrix.spaces_of(user_id))
+
+
+
+def test_own_personal_spaces_are_not_counted(config):
+    """
+    Not a benchmark. The personal spaces of the mock tenant are only granted to their owner, so each must be reached by the owner but left
+    out of their space count, which only happens if Personal_space_matcher matched the space to them.
+    """
+    confluence = Confluence_cloud_api(config)
+    matrix     = confluence.get_access_matrix(ignore_personal_spaces=False, ignore_own_personal_space=True)
+    personal   = [ space for space in confluence.get_spaces(expand="permissions") if space['type'] == 'personal' and space['status'] != 'archived' ]
+    assert personal
+
+    for space in personal:
+        owners = { user['accountId'] for permission in space['permissions'] for user in permission.get('subjects', {}).get('user', {}).get('results', []) }
+        for owner in owners:
+            assert space['key'] in matrix.spaces_of(owner)
+            assert space['key'] not in matrix.spaces_of(owner, counted_only=True)
@@ -0,0 +1,32 @@
+from Confluence_apis import Confluence_cloud_api, fetch_concurrently
+
+
+
+def test_get_spaces_with_permissions(measure, config):
+    """
+    Full space listing with permissions, the first step of every tenant analysis.
+    """
+    spaces = measure(lambda: Confluence_cloud_api(config).get_spaces(expand="permissions"))
+    assert spaces
+
+
+
+def test_get_users(measure, config):
+    """
+    All users, from the user search and the guest and confluence-users groups.
+    """
+    users = measure(lambda: Confluence_cloud_api(config).get_users())
+    assert users
+
+
+
+def test_get_group_members(measure, config):
+    """
+    The members of every group, fetched concurrently.
+    """
+    def fetch_all():
+        confluence = Confluence_cloud_api(config)
+        return dict(fetch_concurrently(lambda group_id: confluence.get_group_members(group_id), [ group['id'] for group in confluence.get_groups() ], workers=confluence.fetch_workers))
+
+    members = measure(fetch_all)
+    assert members
@@ -1,12 +1,7 @@
 #!/usr/bin/env python
 import sys
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import yaml
 import pdb
-from pprint import pprint
-from Confluence_apis import Confluence_cloud_api
+from Confluence_apis import Confluence_cloud_api, Permission_index, pop_snapshot_args, pop_plan_args, write_plan, load_config
 import logging
 
 # configure logging
@@ -18,7 +13,11 @@ logging.basicConfig(
 
 
 # user help message
-usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> [<groups to convert, comma separated>]"
+usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> [<groups to convert, comma separated>] [--snapshot <name> [--max-age <age, e.g. 12h>] [--refresh]] [--plan-only <plan file>]"
+
+# take out the snapshot options before reading the positional arguments
+snapshot_name, max_age, refresh = pop_snapshot_args(sys.argv)
+plan_file = pop_plan_args(sys.argv)
 
 # get the arguments
 try:
@@ -36,73 +35,27 @@ except IndexError:
 
 # read the atlassian config file
 logging.debug("Reading config file.")
-with open(atlassian_config_filename, 'r') as file:
-    try:
-        config = yaml.safe_load(file)
-    except yaml.YAMLError as exc:
-        print(exc)
+config = load_config(atlassian_config_filename)
 
 
 # create confluence api instance
 logging.debug("Creating confluence api object")
 confluence = Confluence_cloud_api(config)
 
+# reuse a stored inventory if asked to
+if snapshot_name:
+    confluence.use_snapshot(snapshot_name, max_age, refresh=refresh)
+
 # request a list of all spaces
 logging.info("Fetching spaces.")
 #spaces = confluence.get_spaces(expand="permissions", paginate=False)
 spaces = confluence.get_spaces(expand="permissions")
 #spaces = []
 
-# init
-user_permissions = {}
-group_permissions = {}
-
-## Get all user-space and group-space  memberships
-# go through all spaces
+## Get all user-space and group-space memberships
 logging.info("Parsing permissions.")
-for space in spaces:
-    #continue
-    logging.debug(f"Space: {space['name']}")
-
-    # go through all permissions
-    for permission in space['permissions']:
-
-        # skip empty permissions
-        if 'subjects' not in permission.keys():
-            continue
-
-        # if it is a user permission
-        if permission['subjects'].get('user'):
-
-            # for all users with permission
-            for user in permission['subjects']['user']['results']:
-                
-                # save the user and space info
-                try:
-                    logging.debug(f"User: {user['accountId']}")
-                    user_permissions[user['accountId']]['spaces'][space['key']] = space
-                except KeyError:
-                    # if it is the first time seeing this user
-                    user_permissions[user['accountId']] = {}
-                    user_permissions[user['accountId']]['spaces'] = {space['key']:space}
-                    user_permissions[user['accountId']]['user'] = user
-
-        # if it is a user permission
-        elif permission['subjects'].get('group'):
-
-            # for all groups with permission
-            for group in permission['subjects']['group']['results']:
-                
-                # save the user and space info
-                try:
-                    logging.debug(f"Group: {group['id']}")
-                    group_permissions[group['id']]['spaces'][space['key']] = space
-                except KeyError:
-                    # if it is the first time seeing this group
-                    group_permissions[group['id']] = {}
-                    group_permissions[group['id']]['spaces'] = {space['key']:space}
-                    group_permissions[group['id']]['group'] = group
-
+index = Permission_index()
+index.add_spaces(spaces)
 logging.debug("Parsing permissions finished.")
 
 
@@ -113,14 +66,8 @@ users = confluence.get_users()
 
 #pdb.set_trace()
 
-# add all users to user_permissions dict
-for user in users:
-
-    # find missing users
-    if user['user']['accountId'] not in user_permissions:
-
-        # initiate entry
-        user_permissions[user['user']['accountId']] = {'spaces':{}, 'user':user['user']}
+# add all users to the index
+index.add_users(users)
 
 
 # get all groups
@@ -132,25 +79,7 @@ for group in groups:
 
     # fetch group members
     logging.info(f"Fetching group memebers from {group['name']}")
-    members = confluence.get_group_members(group_id=group['id'])
-
-    # initiate entry if group is missing in group_permissions
-    if group['id'] not in group_permissions:
-        group_permissions[group['id']] = {'spaces':{}, 'group':group}
-
-    # skip groups with no permissions
-
-    # for each member, add the groups spaces to the users spaces list
-    for member in members:
-
-        # initiate entry if member is missing in member_permissions
-        if member['accountId'] not in user_permissions:
-
-            # initiate entry
-            user_permissions[member['accountId']] = {'spaces':{}, 'user':member}
-
-        # add group spaces to user spaces
-        user_permissions[member['accountId']]['spaces'].update(group_permissions[group['id']]['spaces'])
+    index.add_group_members(group, confluence.get_group_members(group_id=group['id']))
         
 
 
@@ -165,14 +94,14 @@ if guest_group_id == "":
     pdb.set_trace()
 
 
-# make a lookup table for space keys to space names for easy access
-key_to_name = { space['key']:space['name'] for space in spaces}
-
 logging.info("Findinig users with only 1 space.")
 c=0
+plan = []
 # find users with access to only 1 space
-for user_id,up in user_permissions.items():
-    if len(user_permissions[user_id]['spaces']) <= 1:
+user_ids = index.user_ids()
+for user_id in user_ids:
+    user_spaces = index.spaces_of(user_id)
+    if len(user_spaces) <= 1:
 
         # count number of 1 space users
         c += 1
@@ -196,17 +125,26 @@ for user_id,up in user_permissions.items():
 
         # get the name of the space a user has access to
         guest_space_name = "no space at all"
-        if len(user_permissions[user_id]['spaces']) > 0:
-            guest_space_name = key_to_name[list(user_permissions[user_id]['spaces'].keys())[0]]
+        if len(user_spaces) > 0:
+            guest_space_name = index.space(next(iter(user_spaces)))['name']
 
-        logging.info(f"Converting {user_permissions[user_id]['user']['displayName']} to guest user with access to {guest_space_name}")
+        logging.info(f"Converting {index.subject(user_id)['displayName']} to guest user with access to {guest_space_name}")
+
+        # only plan the conversion if asked to
+        if plan_file:
+            plan.append({'op':'convert_to_guest_user', 'user_id':user_id, 'guest_group_id':guest_group_id})
+            continue
 
         # convert user to guest user
         #confluence.convert_to_guest_user(user_id, guest_group_id)
 
 
 
-logging.info(f"Finished converting {c} users to guest users, out of {len(user_permissions)} total users.")
+# save the plan
+if plan_file:
+    write_plan(plan_file, plan)
+
+logging.info(f"Finished converting {c} users to guest users, out of {len(user_ids)} total users.")
 
 
 
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+import sys
+import os
+import runpy
+
+# subcommands and the scripts they run, the scripts import their dependencies themselves so only the chosen one is loaded
+commands = {
+                'list-guests'           : ('list_all_guest_users_on_confluence-cloud.py',             "List the members of the guest group"),
+                'list-personal-spaces'  : ('list_personal_spaces_on_confluence-cloud.py',             "List the personal spaces and their owners"),
+                'list-server-users'     : ('list_all_users_on_confluence-server.py',                  "List server users missing in the cloud"),
+                'find-guests'           : ('find_possible_guest_users_on_confluence-cloud.py',        "Find users with access to few spaces"),
+                'convert-guests'        : ('change_users_to_single_space_guests_on_confluence-cloud.py', "Change single space users to guests"),
+                'remove-guest-users'    : ('remove_confluence-users_from_guests.py',                  "Remove guests from confluence-users"),
+                'remove-inactive'       : ('remove_inactive_users_on_confluence-cloud.py',            "Remove listed users from their groups"),
+                'transfer-permissions'  : ('transfer_user_permissions-cloud.py',                      "Copy space permissions between users or groups"),
+                'apply-plan'            : ('apply_plan_on_confluence-cloud.py',                       "Apply a plan file written with --plan-only"),
+                'refresh-snapshot'      : ('refresh_snapshot_on_confluence-cloud.py',                 "Merge recent changes into a snapshot"),
+                'add-label'             : ('add_label_to_spaces_on_confluence-cloud.py',              "Add a label to spaces"),
+                'remove-label'          : ('remove_label_from_spaces_on_confluence-cloud.py',         "Remove a label from spaces"),
+                'prefix-spaces'         : ('prefix_spaces_on_confluence-server.py',                   "Prefix the names of server spaces"),
+                'disable-access'        : ('selenium_disable_user_access_on_confluence-cloud.py',     "Disable product access in the admin ui"),
+                'redirect-code'         : ('generate_javascript_redirect_code.py',                    "Generate javascript redirecting old links"),
+                'mock-server'           : ('mock_atlassian_server.py',                                "Serve a generated tenant locally"),
+           }
+
+# user help message
+usage = f"Usage: python3 {sys.argv[0]} <command> [<arguments of the command>]\n\nCommands:\n" + "\n".join( f"  {command:<24}{description}" for command, (script, description) in commands.items() ) + "\n\nRun a command without arguments to see its own usage."
+
+# get the command
+try:
+    command = sys.argv[1]
+except IndexError:
+    print(usage)
+    sys.exit()
+
+if command not in commands:
+    print(f"{usage}\n\nERROR: Unknown command {command}")
+    sys.exit(1)
+
+# run the script as if it was started on its own, with the rest of the arguments
+repo_dir = os.path.dirname(os.path.abspath(__file__))
+script   = os.path.join(repo_dir, commands[command][0])
+sys.path.insert(0, repo_dir)
+sys.argv = [script] + sys.argv[2:]
+runpy.run_path(script, run_name='__main__')
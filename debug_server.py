@@ -1,13 +1,8 @@
 
 #!/usr/bin/env python
 import sys
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import yaml
 import pdb
-from pprint import pprint
-from Confluence_apis import Confluence_server_api
+from Confluence_apis import Confluence_server_api, load_config
 import logging
 
 # configure logging
@@ -30,11 +25,7 @@ except IndexError:
 
 
 # read the atlassian config file
-with open(atlassian_config_filename, 'r') as file:
-    try:
-        config = yaml.safe_load(file)
-    except yaml.YAMLError as exc:
-        print(exc)
+config = load_config(atlassian_config_filename)
 
 
 # create confluence api instance
@@ -1,14 +1,7 @@
 #!/usr/bin/env python
 import sys
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import yaml
-import pdb
-from pprint import pprint
-from Confluence_apis import Confluence_cloud_api
+from Confluence_apis import Confluence_cloud_api, pop_snapshot_args, load_config
 import logging
-from pprint import pprint
 
 # configure logging
 logging.basicConfig(
@@ -18,14 +11,11 @@ logging.basicConfig(
     stream=sys.stdout)
 
 
-def name_processor(name):                                                       
-
-    return name.lower().replace('.','').replace(' ','').replace('_','')
-
-
-
 # user help message
-usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> [<max number of space memberships>]"
+usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> [<max number of space memberships>] [--snapshot <name> [--max-age <age, e.g. 12h>] [--refresh]]"
+
+# take out the snapshot options before reading the positional arguments
+snapshot_name, max_age, refresh = pop_snapshot_args(sys.argv)
 
 # get the arguments
 try:
@@ -43,17 +33,17 @@ except IndexError:
 
 # read the atlassian config file
 logging.debug("Reading config file.")
-with open(atlassian_config_filename, 'r') as file:
-    try:
-        config = yaml.safe_load(file)
-    except yaml.YAMLError as exc:
-        print(exc)
+config = load_config(atlassian_config_filename)
 
 
 # create confluence api instance
 logging.debug("Creating confluence api object")
 confluence = Confluence_cloud_api(config)
 
+# reuse a stored inventory if asked to
+if snapshot_name:
+    confluence.use_snapshot(snapshot_name, max_age, refresh=refresh)
+
 # get list of possible guest users
 possible_guest_user = confluence.find_possible_guest_users(n_spaces_cutoff = space_membership_cutoff, ignore_personal_spaces = True)
 
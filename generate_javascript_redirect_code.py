@@ -1,5 +1,4 @@
 import sys
-import pdb
 
 # define usage message
 usage = f"Usage: python3 {sys.argv[0]} <input file name>"
@@ -1,12 +1,6 @@
 #!/usr/bin/env python
 import sys
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import yaml
-import pdb
-from pprint import pprint
-from Confluence_apis import Confluence_cloud_api
+from Confluence_apis import Confluence_cloud_api, load_config
 import logging
 
 # configure logging
@@ -31,11 +25,7 @@ except IndexError:
 
 # read the atlassian config file
 logging.debug("Reading config file.")
-with open(atlassian_config_filename, 'r') as file:
-    try:
-        config = yaml.safe_load(file)
-    except yaml.YAMLError as exc:
-        print(exc)
+config = load_config(atlassian_config_filename)
 
 
 # create confluence api instance
@@ -49,8 +39,8 @@ groups = confluence.get_groups()
 guest_group_id = [ group['id'] for group in groups if group['name'].startswith('confluence-guests-') ][0]
 users_group_id = [ group['id'] for group in groups if group['name'] == 'confluence-users' ][0]
 
-# get the guest group members
-users = confluence.get_group_members(guest_group_id)
+# stream the guest group members, printing starts with the first page
+users = confluence.iter_group_members(guest_group_id)
 
 # for each member, make sure they are not a member of the confluence-users group as well
 for i,user in enumerate(users):
@@ -1,12 +1,14 @@
 #!/usr/bin/env python
 import sys
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import yaml
-import pdb
-from pprint import pprint
-from Confluence_apis import Confluence_server_api
+from Confluence_apis import Confluence_server_api, load_config
+import logging
+
+# configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] %(levelname)s\t[%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+    datefmt="%d/%b/%Y %H:%M:%S",
+    stream=sys.stdout)
 
 # user help message
 usage = f"Usage: python3 {sys.argv[0]} <atlassian server config yaml file> <atlassian cloud user file> <group filter list, comma separated>\n\nGroup filter list is a list of groups who's memebers will be excluded from the printed list, i.e. users you don't want to process.\n\nThe atlassian cloud user file is a csv file where the 3rd field is the users email (as the exported user list from arlassian web ui)."
@@ -34,11 +36,7 @@ except IndexError:
 
 
 # read the atlassian server config file
-with open(atlassian_server_config_filename, 'r') as file:
-    try:
-        server_config = yaml.safe_load(file)
-    except yaml.YAMLError as exc:
-        print(exc)
+server_config = load_config(atlassian_server_config_filename)
 
 # read the atlassian cloud user file
 cloud_users = set()
@@ -59,7 +57,7 @@ server_usernames = set( user['username'] for user in server_users )
 if group_filter:
     for group in group_filter.split(','):
 
-        # get members of the filter group
+        # get members of the filter group, already fetched by get_users so it costs no requests
         group_members = server.get_group_members(group)
 
         # remove these users from the set of usernames
@@ -71,12 +69,10 @@ if group_filter:
 
 # fetch server email for users
 server_emails = set()
-for i,username in enumerate(server_usernames):
-
-    print(f"{i}/{len(server_usernames)}")
+server_user_infos = server.get_user_infos(server_usernames)
+for username, user in server_user_infos.items():
 
-    # get user info
-    user = server.get_user_info(username)
+    # get user email
     user_email = user['email'].lower()
 
     # keep the user if the email does not exists in the cloud
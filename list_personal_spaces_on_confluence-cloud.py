@@ -1,16 +1,9 @@
 #!/usr/bin/env python
 import sys
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import yaml
-import pdb
-from pprint import pprint
 import Confluence_apis
-from Confluence_apis import name_processor
+from Confluence_apis import Personal_space_matcher, load_config
 import time
 import logging
-from thefuzz import fuzz
 
 # configure logging
 logging.basicConfig(
@@ -22,7 +15,10 @@ logging.basicConfig(
 
 
 # user help message
-usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file>"
+usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> [--snapshot <name> [--max-age <age, e.g. 12h>] [--refresh]]"
+
+# take out the snapshot options before reading the positional arguments
+snapshot_name, max_age, refresh = Confluence_apis.pop_snapshot_args(sys.argv)
 
 # get the arguments
 try:
@@ -34,24 +30,25 @@ except IndexError:
 
 
 # read the atlassian config file
-with open(atlassian_config_filename, 'r') as file:
-    try:
-        config = yaml.safe_load(file)
-    except yaml.YAMLError as exc:
-        print(exc)
+config = load_config(atlassian_config_filename)
 
 
 # create confluence api instance
 confluence = Confluence_apis.Confluence_cloud_api(config)
 
+# reuse a stored inventory if asked to
+if snapshot_name:
+    confluence.use_snapshot(snapshot_name, max_age, refresh=refresh)
+
 # request a list of all spaces
 spaces = confluence.get_spaces()
 users = confluence.get_users()
-normalized_usernames = [ name_processor(user['user']['displayName']) for user in users ]
+matcher = Personal_space_matcher(users, name_key='displayName')
+user_names = { user['accountId']:user['displayName'] for user in users }
 
 #pdb.set_trace()
 
-# rename all spaces in list
+# go through all personal spaces
 c = 0
 for i,space in enumerate(spaces):
 
@@ -59,11 +56,9 @@ for i,space in enumerate(spaces):
     if space['type'] != 'personal':
         continue
 
-    # check if space name could be a personal space
-    for username in normalized_usernames:
-        ratio = fuzz.ratio(username, space['name'])
-        if ratio >= 75:
-            print(f"{username}\t{space['name']}")
+    # print the users the space could belong to
+    for user_id in matcher.owners(space):
+        print(f"{user_names[user_id]}\t{space['name']}")
 
     
     c += 1
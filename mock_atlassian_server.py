@@ -0,0 +1,626 @@
+#!/usr/bin/env python
+import sys
+import json
+import random
+import re
+import threading
+import time
+import logging
+import argparse
+from collections import Counter
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlsplit, parse_qs, urlencode, unquote
+
+
+
+# the space permissions handed out, read-space is always given first
+OPERATIONS = [
+                ('read', 'space'),
+                ('create', 'page'),
+                ('create', 'blogpost'),
+                ('create', 'comment'),
+                ('create', 'attachment'),
+                ('delete', 'page'),
+                ('export', 'space'),
+                ('administer', 'space'),
+             ]
+
+FIRST_NAMES = ['Anna', 'Erik', 'Åsa', 'Lars', 'Maria', 'Johan', 'Karin', 'Per', 'Sofia', 'Björn', 'Elin', 'Nils', 'Ingrid', 'Olof', 'Sara', 'Jörgen']
+LAST_NAMES  = ['Andersson', 'Johansson', 'Karlsson', 'Nilsson', 'Eriksson', 'Larsson', 'Olsson', 'Persson', 'Svensson', 'Gustafsson', 'Lindqvist', 'Öberg']
+
+
+
+
+class Synthetic_tenant:
+    """
+    Randomly generated, but repeatable for the same {seed}, Confluence tenant to serve from Mock_atlassian_server.
+    Has {n_users} users, of which a {guest_fraction} are guests and a {disabled_fraction} are disabled, {n_groups} groups besides
+    confluence-users and the guest group, and {n_spaces} spaces, of which a {personal_fraction} are personal spaces.
+    Each space grants permissions to about {users_per_space} users and {groups_per_space} groups, and each user is a member of
+    about {groups_per_user} groups.
+    """
+
+    def __init__(self, n_users=1000, n_spaces=500, n_groups=50, guest_fraction=0.05, disabled_fraction=0.03, personal_fraction=0.2,
+                 users_per_space=5, groups_per_space=2, groups_per_user=3, seed=0):
+
+        rng = random.Random(seed)
+
+        # users
+        self.users = []
+        for n in range(n_users):
+            name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+            self.users.append({
+                                'accountId'  : f"{n:06d}:{rng.getrandbits(64):016x}",
+                                'username'   : f"user{n}",
+                                'displayName': name,
+                                'email'      : f"user{n}@example.com",
+                                'guest'      : rng.random() < guest_fraction,
+                                'disabled'   : rng.random() < disabled_fraction,
+                              })
+
+        # groups, with the members as sets of user numbers
+        self.groups = [ {'id':f"group-{n:06d}", 'name':f"group-{n}"} for n in range(n_groups) ]
+        self.groups.append({'id':'group-confluence-users', 'name':'confluence-users'})
+        self.groups.append({'id':'group-confluence-guests', 'name':'confluence-guests-mock'})
+        self.members = { group['id']:set() for group in self.groups }
+        for n, user in enumerate(self.users):
+            if user['guest']:
+                self.members['group-confluence-guests'].add(n)
+                continue
+            self.members['group-confluence-users'].add(n)
+            for group in rng.sample(self.groups[:n_groups], min(groups_per_user, n_groups)):
+                self.members[group['id']].add(n)
+
+        # spaces, with the permissions as sets of (subject type, user or group number, operation, target) tuples
+        self.spaces = []
+        self.grants = {}
+        self.labels = {}
+        owners = rng.sample(range(n_users), n_users)
+        for n in range(n_spaces):
+
+            # personal spaces belong to a user and are named after them, each user has at most one
+            if owners and rng.random() < personal_fraction:
+                owner = owners.pop()
+                space = {'id':n + 1, 'key':f"~{self.users[owner]['username']}", 'name':self.users[owner]['displayName'], 'type':'personal'}
+                subjects = [('user', owner)]
+            else:
+                space = {'id':n + 1, 'key':f"SPACE{n}", 'name':f"Space {n}", 'type':'global'}
+                subjects  = [ ('user', user) for user in rng.sample(range(n_users), min(users_per_space, n_users)) ]
+                subjects += [ ('group', group) for group in rng.sample(range(len(self.groups)), min(groups_per_space, len(self.groups))) ]
+            space['status'] = 'archived' if rng.random() < 0.02 else 'current'
+
+            # read-space plus some other permissions for each subject
+            grants = set()
+            for subject_type, subject in subjects:
+                for operation, target in OPERATIONS[:rng.randint(1, len(OPERATIONS))]:
+                    grants.add((subject_type, subject, operation, target))
+
+            self.spaces.append(space)
+            self.grants[space['key']] = grants
+            self.labels[space['key']] = set()
+
+        # lookups
+        self.space_by_key   = { space['key']:space for space in self.spaces }
+        self.user_by_id     = { user['accountId']:n for n, user in enumerate(self.users) }
+        self.user_by_name   = { user['username']:n for n, user in enumerate(self.users) }
+        self.group_by_id    = { group['id']:n for n, group in enumerate(self.groups) }
+        self.group_by_name  = { group['name']:n for n, group in enumerate(self.groups) }
+
+
+
+
+
+    def cloud_user(self, n):
+        """
+        Returns user number {n} as the cloud API shows it.
+        """
+        user = self.users[n]
+        return {'type':'known', 'accountId':user['accountId'], 'accountType':'atlassian', 'email':user['email'], 'publicName':user['displayName'], 'displayName':user['displayName']}
+
+
+
+
+
+    def server_user(self, n):
+        """
+        Returns user number {n} as the server API shows it.
+        """
+        user = self.users[n]
+        return {'type':'known', 'username':user['username'], 'userKey':f"key{n}", 'displayName':user['displayName']}
+
+
+
+
+
+    def group(self, n):
+        """
+        Returns group number {n} as the API shows it.
+        """
+        return {'type':'group', **self.groups[n]}
+
+
+
+
+
+    def space(self, space_key, server=False, expand=''):
+        """
+        Returns space {space_key} as the API shows it, with its permissions if {expand} asks for them.
+        """
+        space = dict(self.space_by_key[space_key])
+        if 'permissions' in expand:
+            user = self.server_user if server else self.cloud_user
+            space['permissions'] = []
+            for n, (subject_type, subject, operation, target) in enumerate(sorted(self.grants[space_key])):
+                entity = user(subject) if subject_type == 'user' else self.group(subject)
+                space['permissions'].append({
+                                                'id'        : n,
+                                                'subjects'  : {subject_type:{'results':[entity], 'size':1}},
+                                                'operation' : {'operation':operation, 'targetType':target},
+                                                'anonymousAccess' : False,
+                                                'unlicensedAccess': False,
+                                            })
+        return space
+
+
+
+
+class Mock_atlassian_server:
+    """
+    Local stand-in for the Confluence Cloud, Confluence Server and Jira Cloud REST APIs used by the scripts, serving a Synthetic_tenant.
+    Listings are paged like the real APIs, at most {page_limit} results per page whatever limit is asked for. Every request is delayed
+    {latency} seconds, and a {throttle_rate} fraction of them are answered with 429 and a Retry-After of {retry_after} seconds.
+    Counts the requests served per endpoint, also available from GET /mock/stats and zeroed by POST /mock/reset, so it can be used as a
+    fixture for repeatable performance tests:
+
+        with Mock_atlassian_server(Synthetic_tenant(n_users=10000)) as server:
+            confluence = Confluence_cloud_api({'url':server.url, 'user':'mock', 'api_token':'mock'})
+            confluence.get_users()
+            print(server.n_requests)
+    """
+
+    def __init__(self, tenant=None, host='127.0.0.1', port=0, page_limit=25, latency=0.0, throttle_rate=0.0, retry_after=1, seed=0):
+
+        self.tenant        = tenant or Synthetic_tenant()
+        self.page_limit    = page_limit
+        self.latency       = latency
+        self.throttle_rate = throttle_rate
+        self.retry_after   = retry_after
+        self.random        = random.Random(seed)
+        self.lock          = threading.Lock()
+
+        # counters
+        self.n_requests = 0
+        self.n_throttled = 0
+        self.endpoints  = Counter()
+
+        # the http server, answering on a port of its own if {port} is 0
+        self.httpd = ThreadingHTTPServer((host, port), Mock_request_handler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.url    = f"http://{host}:{self.httpd.server_address[1]}"
+        self.thread = None
+
+        # (method, path pattern, handler) for each endpoint, tried in order
+        self.routes = [
+            ('GET',    r'/wiki/rest/api/space',                           self.cloud_spaces),
+            ('GET',    r'/wiki/rest/api/space/(?P<key>[^/]+)',            self.cloud_space),
+            ('POST',   r'/wiki/rest/api/space/(?P<key>[^/]+)/permission', self.add_permission),
+            ('POST',   r'/wiki/rest/api/space/(?P<key>[^/]+)/label',      self.add_label),
+            ('DELETE', r'/wiki/rest/api/space/(?P<key>[^/]+)/label',      self.remove_label),
+            ('GET',    r'/wiki/rest/api/group',                           self.cloud_groups),
+            ('GET',    r'/wiki/rest/api/group/(?P<id>[^/]+)/membersByGroupId', self.cloud_group_members),
+            ('POST',   r'/wiki/rest/api/group/userByGroupId',             self.add_group_member),
+            ('DELETE', r'/wiki/rest/api/group/userByGroupId',             self.remove_group_member),
+            ('GET',    r'/wiki/rest/api/search/user',                     self.cloud_search_users),
+            ('GET',    r'/wiki/rest/api/search',                          self.empty_listing),
+            ('GET',    r'/wiki/rest/api/audit',                           self.empty_listing),
+            ('GET',    r'/wiki/rest/api/user',                            self.cloud_user),
+            ('GET',    r'/wiki/rest/api/user/memberof',                   self.cloud_user_groups),
+            ('GET',    r'/wiki/rest/api/user/(?P<id>[^/]+)/property',     self.empty_listing),
+            ('GET',    r'/rest/api/space',                                self.server_spaces),
+            ('GET',    r'/rest/api/space/(?P<key>[^/]+)',                 self.server_space),
+            ('PUT',    r'/rest/api/space/(?P<key>[^/]+)',                 self.update_space),
+            ('GET',    r'/rest/api/space/(?P<key>[^/]+)/property',        self.empty_listing),
+            ('GET',    r'/rest/api/group',                                self.server_groups),
+            ('GET',    r'/rest/api/group/(?P<name>[^/]+)/member',         self.server_group_members),
+            ('GET',    r'/rest/api/search',                               self.server_search),
+            ('GET',    r'/rest/api/user',                                 self.server_user),
+            ('GET',    r'/rest/mobile/1.0/profile/(?P<name>[^/]+)',       self.server_profile),
+            ('GET',    r'/jira/rest/api/3/users/search',                  self.jira_users),
+        ]
+        self.routes = [ (method, re.compile(f"{pattern}$"), handler) for method, pattern, handler in self.routes ]
+
+
+
+
+
+    def start(self):
+        """
+        Starts serving in a background thread. Returns the server.
+        """
+        self.thread = threading.Thread(target=self.httpd.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+
+
+
+
+    def stop(self):
+        """
+        Stops serving and closes the socket.
+        """
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+
+
+
+    def __enter__(self):
+        return self.start()
+
+
+
+    def __exit__(self, *exc_info):
+        self.stop()
+
+
+
+
+
+    def reset_counters(self):
+        """
+        Zeroes the request counters, e.g. between benchmark rounds.
+        """
+        with self.lock:
+            self.n_requests  = 0
+            self.n_throttled = 0
+            self.endpoints.clear()
+
+
+
+
+
+    def handle(self, method, path, query, body):
+        """
+        Answers a request. Returns the status code, the headers and the body to send back.
+        """
+
+        # the request counters, for a mock running in a process of its own
+        if path == '/mock/stats':
+            with self.lock:
+                return 200, {}, {'requests':self.n_requests, 'throttled':self.n_throttled, 'endpoints':dict(self.endpoints)}
+        if path == '/mock/reset':
+            self.reset_counters()
+            return 204, {}, None
+
+        # find the endpoint
+        for route_method, pattern, handler in self.routes:
+            match = pattern.match(path)
+            if match and route_method == method:
+                break
+        else:
+            return 404, {}, {'statusCode':404, 'message':f"No mock endpoint for {method} {path}"}
+
+        # count the request, and throttle some of them
+        with self.lock:
+            self.n_requests += 1
+            self.endpoints[f"{method} {pattern.pattern[:-1]}"] += 1
+            throttled = self.random.random() < self.throttle_rate
+            if throttled:
+                self.n_throttled += 1
+
+        if self.latency:
+            time.sleep(self.latency)
+
+        if throttled:
+            return 429, {'Retry-After':str(self.retry_after)}, {'statusCode':429, 'message':"Rate limit exceeded"}
+
+        with self.lock:
+            return handler(query, body, **{ key:unquote(value) for key, value in match.groupdict().items() })
+
+
+
+
+
+    def page(self, path, query, results, start_param='start', limit_param='limit', total_size=False):
+        """
+        Returns one page of {results} as a paged listing, with a _links.next to the following page if there is one.
+        If {total_size} is True the listing tells the total number of results, like the CQL search does.
+        """
+
+        # cap the page size like the real apis do
+        start = int(query.get(start_param, 0))
+        limit = min(int(query.get(limit_param, self.page_limit)), self.page_limit)
+        page  = results[start:start + limit]
+
+        links = {'base':f"{self.url}/wiki" if path.startswith('/wiki') else self.url, 'self':path}
+        if start + limit < len(results):
+            links['next'] = f"{path.replace('/wiki', '', 1) if path.startswith('/wiki') else path}?{urlencode({**query, start_param:start + limit})}"
+
+        listing = {'results':page, 'start':start, 'limit':limit, 'size':len(page), '_links':links}
+        if total_size:
+            listing['totalSize'] = len(results)
+        return 200, {}, listing
+
+
+
+    def empty_listing(self, query, body, **ids):
+        return 200, {}, {'results':[], 'start':0, 'limit':self.page_limit, 'size':0, '_links':{}}
+
+
+
+    def not_found(self, what):
+        return 404, {}, {'statusCode':404, 'message':f"{what} not found"}
+
+
+
+    ### confluence cloud
+
+    def cloud_spaces(self, query, body):
+        spaces = [ self.tenant.space(space['key'], expand=query.get('expand') or '') for space in self.tenant.spaces ]
+        return self.page('/wiki/rest/api/space', query, spaces)
+
+
+
+    def cloud_space(self, query, body, key):
+        if key not in self.tenant.space_by_key:
+            return self.not_found(f"Space {key}")
+        return 200, {}, self.tenant.space(key, expand=query.get('expand') or '')
+
+
+
+    def add_permission(self, query, body, key):
+        if key not in self.tenant.space_by_key:
+            return self.not_found(f"Space {key}")
+
+        # find the subject
+        subject_type = body['subject']['type']
+        identifier   = body['subject']['identifier']
+        subject      = self.tenant.user_by_id.get(identifier) if subject_type == 'user' else self.tenant.group_by_id.get(identifier)
+        if subject is None:
+            return 400, {}, {'statusCode':400, 'message':f"No {subject_type} with id {identifier}"}
+
+        grant = (subject_type, subject, body['operation']['key'], body['operation']['target'])
+        if grant in self.tenant.grants[key]:
+            return 400, {}, {'statusCode':400, 'message':"Permission already exists."}
+        self.tenant.grants[key].add(grant)
+        return 200, {}, {'subject':body['subject'], 'operation':body['operation']}
+
+
+
+    def add_label(self, query, body, key):
+        if key not in self.tenant.space_by_key:
+            return self.not_found(f"Space {key}")
+        for label in body:
+            self.tenant.labels[key].add((label.get('prefix', 'global'), label['name']))
+        return 200, {}, {'results':[ {'prefix':prefix, 'name':name} for prefix, name in sorted(self.tenant.labels[key]) ]}
+
+
+
+    def remove_label(self, query, body, key):
+        if key not in self.tenant.space_by_key:
+            return self.not_found(f"Space {key}")
+        self.tenant.labels[key].discard((query.get('prefix', 'global'), query.get('name')))
+        return 204, {}, None
+
+
+
+    def cloud_groups(self, query, body):
+        return self.page('/wiki/rest/api/group', query, [ self.tenant.group(n) for n in range(len(self.tenant.groups)) ])
+
+
+
+    def cloud_group_members(self, query, body, id):
+        if id not in self.tenant.members:
+            return self.not_found(f"Group {id}")
+        members = [ self.tenant.cloud_user(n) for n in sorted(self.tenant.members[id]) ]
+        return self.page(f"/wiki/rest/api/group/{id}/membersByGroupId", query, members)
+
+
+
+    def add_group_member(self, query, body, **ids):
+        group_id = query.get('groupId')
+        user     = self.tenant.user_by_id.get(body.get('accountId'))
+        if group_id not in self.tenant.members or user is None:
+            return self.not_found("Group or user")
+        self.tenant.members[group_id].add(user)
+        return 201, {}, None
+
+
+
+    def remove_group_member(self, query, body, **ids):
+        group_id = query.get('groupId')
+        user     = self.tenant.user_by_id.get(query.get('accountId'))
+        if group_id not in self.tenant.members or user is None:
+            return self.not_found("Group or user")
+        self.tenant.members[group_id].discard(user)
+        return 204, {}, None
+
+
+
+    def cloud_search_users(self, query, body):
+        # like the real search, guests are not included
+        users = [ {'user':self.tenant.cloud_user(n)} for n, user in enumerate(self.tenant.users) if not user['guest'] ]
+        return self.page('/wiki/rest/api/search/user', query, users, total_size=True)
+
+
+
+    def cloud_user(self, query, body):
+        user = self.tenant.user_by_id.get(query.get('accountId') or body.get('accountId'))
+        if user is None:
+            return self.not_found("User")
+        return 200, {}, self.tenant.cloud_user(user)
+
+
+
+    def cloud_user_groups(self, query, body):
+        user = self.tenant.user_by_id.get(query.get('accountId') or body.get('accountId'))
+        if user is None:
+            return self.not_found("User")
+        groups = [ self.tenant.group(self.tenant.group_by_id[group_id]) for group_id, members in self.tenant.members.items() if user in members ]
+        return self.page('/wiki/rest/api/user/memberof', query, groups)
+
+
+
+    ### confluence server
+
+    def server_spaces(self, query, body):
+        spaces = [ self.tenant.space(space['key'], server=True, expand=query.get('expand') or '') for space in self.tenant.spaces ]
+        return self.page('/rest/api/space', query, spaces)
+
+
+
+    def server_space(self, query, body, key):
+        if key not in self.tenant.space_by_key:
+            return self.not_found(f"Space {key}")
+        return 200, {}, self.tenant.space(key, server=True, expand=query.get('expand') or '')
+
+
+
+    def update_space(self, query, body, key):
+        if key not in self.tenant.space_by_key:
+            return self.not_found(f"Space {key}")
+        self.tenant.space_by_key[key]['name'] = body.get('name', self.tenant.space_by_key[key]['name'])
+        return 200, {}, self.tenant.space(key, server=True)
+
+
+
+    def server_groups(self, query, body):
+        return self.page('/rest/api/group', query, [ self.tenant.group(n) for n in range(len(self.tenant.groups)) ])
+
+
+
+    def server_group_members(self, query, body, name):
+        if name not in self.tenant.group_by_name:
+            return self.not_found(f"Group {name}")
+        group_id = self.tenant.groups[self.tenant.group_by_name[name]]['id']
+        members  = [ self.tenant.server_user(n) for n in sorted(self.tenant.members[group_id]) ]
+        return self.page(f"/rest/api/group/{name}/member", query, members)
+
+
+
+    def server_search(self, query, body):
+        # like the real search, disabled users are not included
+        if 'type=user' not in query.get('cql', ''):
+            return self.empty_listing(query, body)
+        users = [ {'user':self.tenant.server_user(n)} for n, user in enumerate(self.tenant.users) if not user['disabled'] ]
+        return self.page('/rest/api/search', query, users, total_size=True)
+
+
+
+    def server_user(self, query, body):
+        user = self.tenant.user_by_name.get(query.get('username'))
+        if user is None:
+            return self.not_found("User")
+        return 200, {}, self.tenant.server_user(user)
+
+
+
+    def server_profile(self, query, body, name):
+        user = self.tenant.user_by_name.get(name)
+        if user is None:
+            return self.not_found("User")
+        return 200, {}, {'username':name, 'fullName':self.tenant.users[user]['displayName'], 'email':self.tenant.users[user]['email']}
+
+
+
+    ### jira cloud
+
+    def jira_users(self, query, body):
+        # jira returns a plain list, paged with startAt/maxResults
+        start = int(query.get('startAt', 0))
+        limit = min(int(query.get('maxResults', self.page_limit)), self.page_limit)
+        users = [ self.tenant.cloud_user(n) for n in range(len(self.tenant.users)) ][start:start + limit]
+        return 200, {}, users
+
+
+
+
+class Mock_request_handler(BaseHTTPRequestHandler):
+    """
+    Hands the requests to the Mock_atlassian_server the http server belongs to.
+    """
+
+    protocol_version = 'HTTP/1.1'
+
+    # headers and body are written separately, don't let them wait for each other's acks on kept-alive connections
+    disable_nagle_algorithm = True
+
+    def answer(self, method):
+
+        # parse the request
+        url   = urlsplit(self.path)
+        query = { key:values[-1] for key, values in parse_qs(url.query).items() }
+        raw   = self.rfile.read(int(self.headers.get('Content-Length') or 0)).decode()
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            # requests sends data dicts form encoded, also on GET
+            body = { key:values[-1] for key, values in parse_qs(raw).items() }
+
+        status, headers, payload = self.server.mock.handle(method, url.path.rstrip('/'), query, body)
+
+        # send the answer
+        data = json.dumps(payload).encode() if payload is not None else b''
+        self.send_response(status)
+        for header, value in headers.items():
+            self.send_header(header, value)
+        if payload is not None:
+            self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+
+    def do_GET(self):
+        self.answer('GET')
+
+    def do_POST(self):
+        self.answer('POST')
+
+    def do_PUT(self):
+        self.answer('PUT')
+
+    def do_DELETE(self):
+        self.answer('DELETE')
+
+    def log_message(self, format, *args):
+        logging.debug(format % args)
+
+
+
+
+
+if __name__ == '__main__':
+
+    # configure logging
+    logging.basicConfig(
+        level=logging.INFO,
+        format="[%(asctime)s] %(levelname)s\t[%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+        datefmt="%d/%b/%Y %H:%M:%S",
+        stream=sys.stdout)
+
+    # get the arguments
+    parser = argparse.ArgumentParser(description="Serves a synthetic Confluence/Jira tenant locally. Point the url in a config file to it.")
+    parser.add_argument('--users',         type=int,   default=1000, help="number of users")
+    parser.add_argument('--spaces',        type=int,   default=500,  help="number of spaces")
+    parser.add_argument('--groups',        type=int,   default=50,   help="number of groups, besides confluence-users and the guest group")
+    parser.add_argument('--seed',          type=int,   default=0,    help="seed of the generated tenant")
+    parser.add_argument('--page-limit',    type=int,   default=25,   help="max results per page")
+    parser.add_argument('--latency',       type=float, default=0.0,  help="seconds added to each request")
+    parser.add_argument('--throttle-rate', type=float, default=0.0,  help="fraction of requests answered with 429")
+    parser.add_argument('--host',          default='127.0.0.1',     help="address to listen on")
+    parser.add_argument('--port',          type=int,   default=8990, help="port to listen on")
+    args = parser.parse_args()
+
+    tenant = Synthetic_tenant(n_users=args.users, n_spaces=args.spaces, n_groups=args.groups, seed=args.seed)
+    server = Mock_atlassian_server(tenant, host=args.host, port=args.port, page_limit=args.page_limit, latency=args.latency, throttle_rate=args.throttle_rate)
+    logging.info(f"Serving {args.users} users, {args.spaces} spaces and {args.groups + 2} groups on {server.url}")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    logging.info(f"Served {server.n_requests} requests, {server.n_throttled} throttled.")
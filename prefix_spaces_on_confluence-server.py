@@ -1,15 +1,20 @@
 #!/usr/bin/env python
 import sys
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import yaml
-import pdb
-from pprint import pprint
-from Confluence_apis import Confluence_server_api
+from Confluence_apis import Confluence_server_api, fetch_concurrently, pop_option, load_config
+import logging
+
+# take out the workers option before reading the positional arguments, renames are made one at a time unless asked otherwise
+workers = int(pop_option(sys.argv, '--workers', 1))
+
+# configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] %(levelname)s\t[%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+    datefmt="%d/%b/%Y %H:%M:%S",
+    stream=sys.stdout)
 
 # user help message
-usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> <prefix to add to space names>"
+usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> <prefix to add to space names> [--workers <n>]\n\nSpaces are renamed one at a time, or <n> at a time with --workers <n>."
 
 # get the arguments
 try:
@@ -26,11 +31,7 @@ except IndexError:
 
 
 # read the atlassian config file
-with open(atlassian_config_filename, 'r') as file:
-    try:
-        config = yaml.safe_load(file)
-    except yaml.YAMLError as exc:
-        print(exc)
+config = load_config(atlassian_config_filename)
 
 
 # create confluence api instance
@@ -42,18 +43,22 @@ spaces = confluence.get_spaces()
 # while testing, only rename the test space
 # spaces = [ space for space in spaces if space['key'] == 'DAH' ]
 
-# rename all spaces in list
-for i,space in enumerate(spaces):
-
-    # skip special spaces
-    space_filter_list = [
-                        ]
+# skip special spaces
+space_filter_list = [
+                    ]
+for space in spaces:
     if space['name'] in space_filter_list:
         print(f"Skipping {space['name']} due to space filter list.")
-        continue
+spaces = [ space for space in spaces if space['name'] not in space_filter_list ]
 
-    print(f"Renaming {i+1}/{len(spaces)}:\t{space['name']} -> {prefix}{space['name']}")
-    response = confluence.update_space_name(space['key'], f"{prefix}{space['name']}")
-    #pdb.set_trace()
+# rename all spaces in list, in order unless more workers are asked for, a failed rename answers with the error's statusCode
+renames = fetch_concurrently(lambda space: confluence.update_space_name(space['key'], f"{prefix}{space['name']}"), spaces,
+                             workers=workers, description="space renames", summary_file=confluence.run_summary_file,
+                             tally=lambda response: (1, int('statusCode' in response)))
+for space, response in renames:
+    if 'statusCode' in response:
+        print(f"Failed to rename {space['name']}: {response.get('message')}")
+    else:
+        print(f"Renamed {space['name']} -> {prefix}{space['name']}")
 
 print("Done")
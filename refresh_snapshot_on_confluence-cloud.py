@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+import sys
+from Confluence_apis import Confluence_cloud_api, load_config
+import logging
+
+# configure logging
+logging.basicConfig(
+    level=logging.INFO,
+    format="[%(asctime)s] %(levelname)s\t[%(name)s.%(funcName)s:%(lineno)d] %(message)s",
+    datefmt="%d/%b/%Y %H:%M:%S",
+    stream=sys.stdout)
+
+
+# user help message
+usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> <snapshot name>\n\nFetches the changes since the snapshot was stored and merges them into it. A snapshot that does not exist yet is fetched in full."
+
+# get the arguments
+try:
+    logging.debug("Fetching config filename.")
+    atlassian_config_filename = sys.argv[1]
+except IndexError:
+    print(f"{usage}\n\nERROR: Atlassian config file argument missing")
+    sys.exit()
+
+try:
+    snapshot_name = sys.argv[2]
+except IndexError:
+    print(f"{usage}\n\nERROR: Snapshot name missing")
+    sys.exit()
+
+# read the atlassian config file
+logging.debug("Reading config file.")
+config = load_config(atlassian_config_filename)
+
+
+# create confluence api instance
+logging.debug("Creating confluence api object")
+confluence = Confluence_cloud_api(config)
+
+# refresh the snapshot, never letting it expire
+confluence.use_snapshot(snapshot_name, max_age=None, refresh=True)
+
+# fetch whatever is not in the snapshot yet
+confluence.get_spaces(expand="permissions")
+confluence.get_users()
+for group in confluence.get_groups():
+    confluence.get_group_members(group['id'])
+
+logging.info(f"Snapshot '{snapshot_name}' is up to date.")
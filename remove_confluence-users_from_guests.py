@@ -1,12 +1,6 @@
 #!/usr/bin/env python
 import sys
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import yaml
-import pdb
-from pprint import pprint
-from Confluence_apis import Confluence_cloud_api
+from Confluence_apis import Confluence_cloud_api, pop_option, pop_plan_args, write_plan, load_config
 import logging
 
 # configure logging
@@ -18,7 +12,11 @@ logging.basicConfig(
 
 
 # user help message
-usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> [<groups to convert, comma separated>]"
+usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> [<groups to convert, comma separated>] [--plan-only <plan file>] [--checkpoint <checkpoint file>]\n\nIf a checkpoint file is given, removed users are logged to it and skipped if the script is run again with the same file."
+
+# take out the plan and checkpoint options before reading the positional arguments
+plan_file       = pop_plan_args(sys.argv)
+checkpoint_file = pop_option(sys.argv, '--checkpoint')
 
 # get the arguments
 try:
@@ -36,11 +34,7 @@ except IndexError:
 
 # read the atlassian config file
 logging.debug("Reading config file.")
-with open(atlassian_config_filename, 'r') as file:
-    try:
-        config = yaml.safe_load(file)
-    except yaml.YAMLError as exc:
-        print(exc)
+config = load_config(atlassian_config_filename)
 
 
 # create confluence api instance
@@ -57,16 +51,13 @@ users_group_id = [ group['id'] for group in groups if group['name'] == 'confluen
 # get the guest group members
 users = confluence.get_group_members(guest_group_id)
 
-# for each member, make sure they are not a member of the confluence-users group as well
-for i,user in enumerate(users):
-
-    print(f"{i}/{len(users)}\t{user['publicName']}")
-
-    confluence.remove_user_from_group(user['accountId'], users_group_id)
-
-
-logging.info(f"Finished")
-
+# only plan the changes if asked to
+if plan_file:
+    write_plan(plan_file, [ {'op':'remove_user_from_group', 'user_id':user['accountId'], 'group_id':users_group_id} for user in users ])
+    sys.exit()
 
+# make sure no member is a member of the confluence-users group as well
+summary = confluence.mutate_groups([ (user['accountId'], users_group_id, 'remove') for user in users ], checkpoint=checkpoint_file)
 
 
+logging.info(f"Finished, removed {summary['done']} users ({summary['per_second']:.1f}/s), {summary['failed']} failed and {summary['skipped']} were already removed.")
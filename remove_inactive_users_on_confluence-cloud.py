@@ -1,14 +1,11 @@
 #!/usr/bin/env python
 import sys
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import yaml
-import pdb
-from pprint import pprint
-from Confluence_apis import Confluence_cloud_api
+from Confluence_apis import Confluence_cloud_api, pop_option, load_config
 import logging
 
+# take out the checkpoint option before reading the positional arguments
+checkpoint_file = pop_option(sys.argv, '--checkpoint')
+
 # configure logging
 logging.basicConfig(
     level=logging.INFO,
@@ -18,7 +15,7 @@ logging.basicConfig(
 
 
 # user help message
-usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> <user id list>"
+usage = f"Usage: python3 {sys.argv[0]} <atlassian config yaml file> <user id list> [--checkpoint <checkpoint file>]\n\nIf a checkpoint file is given, removed users are logged to it and skipped if the script is run again with the same file."
 
 # get the arguments
 try:
@@ -37,11 +34,7 @@ except IndexError:
 
 # read the atlassian config file
 logging.debug("Reading config file.")
-with open(atlassian_config_filename, 'r') as file:
-    try:
-        config = yaml.safe_load(file)
-    except yaml.YAMLError as exc:
-        print(exc)
+config = load_config(atlassian_config_filename)
 
 
 # create confluence api instance
@@ -59,27 +52,8 @@ users_group_id = [ group['id'] for group in groups if group['name'] == 'confluen
 with open(user_id_list_file, 'r') as file:
     user_ids = file.readlines()
 
-for i,user_id in enumerate(user_ids):
-
-    # remove leading and trailing white spaces
-    user_id = user_id.strip()
-
-    # skip empty lines
-    if not user_id:
-        continue
-
-    # remove the user from the group
-    response = confluence.remove_user_from_group(user_id, users_group_id)
-
-    # check the response
-    if response.status_code == 204:
-        logging.info(f"{i+1}/{len(user_ids)}: User {user_id} removed from confluence-users group")
-    else:
-        logging.error(f"Failed to remove user {user_id} from confluence-users group")
-        logging.error(response.text)
-
-logging.info(f"Finished")
-
-
-
+# remove the users from the group, skipping empty lines
+user_ids = [ user_id.strip() for user_id in user_ids if user_id.strip() ]
+summary  = confluence.mutate_groups([ (user_id, users_group_id, 'remove') for user_id in user_ids ], checkpoint=checkpoint_file)
 
+logging.info(f"Finished, removed {summary['done']} of {len(user_ids)} users ({summary['per_second']:.1f}/s), {summary['failed']} failed and {summary['skipped']} were already removed.")
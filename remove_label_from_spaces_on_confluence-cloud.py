@@ -1,12 +1,7 @@
 #!/usr/bin/env python
 import sys
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import yaml
-import pdb
-from pprint import pprint
 import Confluence_apis
+from Confluence_apis import load_config
 import time
 import logging
 
@@ -43,18 +38,14 @@ except IndexError:
 
 
 # read the atlassian config file
-with open(atlassian_config_filename, 'r') as file:
-    try:
-        config = yaml.safe_load(file)
-    except yaml.YAMLError as exc:
-        print(exc)
+config = load_config(atlassian_config_filename)
 
 
 # create confluence api instance
 confluence = Confluence_apis.Confluence_cloud_api(config)
 
-# request a list of all spaces
-spaces = confluence.get_spaces()
+# stream all spaces, label removal starts while later pages are still downloading
+spaces = confluence.iter_spaces()
 
 # while testing, only rename the test space
 #spaces = [ space for space in spaces if space['key'] == 'DAH' ]
@@ -0,0 +1,44 @@
+import os
+import sys
+import pytest
+
+# the scripts, Confluence_apis and the mock live in the repo root
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_ROOT)
+
+from mock_atlassian_server import Mock_atlassian_server, Synthetic_tenant
+
+
+
+@pytest.fixture(scope='session')
+def tenant():
+    """
+    A small generated tenant, shared by all tests. Tests that change it get a mock of their own.
+    """
+    return Synthetic_tenant(n_users=1000, n_spaces=100, seed=1)
+
+
+
+@pytest.fixture
+def mock(tenant):
+    """
+    The tenant served in a background thread, 25 results per page.
+    """
+    with Mock_atlassian_server(tenant, page_limit=25) as server:
+        yield server
+
+
+
+@pytest.fixture
+def config(mock):
+    """
+    A config pointing to the mock, with a rate limiter that doesn't hold the tests back.
+    """
+    return {
+                'url'              : mock.url,
+                'user'             : 'mock',
+                'api_token'        : 'mock',
+                'password'         : 'mock',
+                'rate_limit'       : 1000,
+                'max_rate_limit'   : 10000,
+           }
@@ -0,0 +1,117 @@
+from mock_atlassian_server import Mock_atlassian_server
+from Confluence_apis import Confluence_cloud_api, Rate_limiter, Retry_policy
+
+
+
+def fail_first(mock, monkeypatch, statuses):
+    """
+    Makes {mock} answer its first requests with the status codes in {statuses}, one each, and then as usual.
+    """
+    statuses = list(statuses)
+    handle   = mock.handle
+
+    def failing(method, path, query, body):
+        if statuses and not path.startswith('/mock/'):
+            mock.n_requests += 1
+            status = statuses.pop(0)
+            return status, {'Retry-After':'0'}, {'statusCode':status, 'message':"Failing on purpose"}
+        return handle(method, path, query, body)
+
+    monkeypatch.setattr(mock, 'handle', failing)
+
+
+
+def test_unavailable_post_is_not_resent(mock, config, monkeypatch):
+    """
+    A POST answered with 503 might have been acted on, so it is not sent again.
+    """
+    confluence = Confluence_cloud_api(config)
+    fail_first(mock, monkeypatch, [503])
+    mock.reset_counters()
+
+    response = confluence.session.request("POST", f"{mock.url}/wiki/rest/api/space/SPACE0/label", json=[{'prefix':'global', 'name':'test'}])
+
+    assert response.status_code == 503
+    assert mock.n_requests == 1
+
+
+
+def test_throttled_post_is_resent(mock, config, monkeypatch):
+    """
+    A POST answered with 429 was never acted on, so it is sent again.
+    """
+    confluence = Confluence_cloud_api(config)
+    fail_first(mock, monkeypatch, [429])
+    mock.reset_counters()
+
+    response = confluence.session.request("POST", f"{mock.url}/wiki/rest/api/space/SPACE0/label", json=[{'prefix':'global', 'name':'test'}])
+
+    assert response.status_code == 200
+    assert mock.n_requests == 2
+
+
+
+def test_unavailable_get_is_resent(mock, config, monkeypatch):
+    """
+    A GET is safe to send again after a 503.
+    """
+    confluence = Confluence_cloud_api(config)
+    fail_first(mock, monkeypatch, [503, 503])
+    mock.reset_counters()
+
+    response = confluence.session.request("GET", f"{mock.url}/wiki/rest/api/space")
+
+    assert response.status_code == 200
+    assert mock.n_requests == 3
+
+
+
+def test_retry_policy_budgets_and_backoff():
+    """
+    Each method has its own number of attempts, POSTs are only resent if they never reached the api, and the backoff stays under its cap.
+    """
+    policy = Retry_policy({'GET':3}, base_delay=1, max_delay=4)
+
+    assert policy.should_retry('GET', 0, status_code=502)
+    assert policy.should_retry('GET', 1, status_code=502)
+    assert not policy.should_retry('GET', 2, status_code=502)
+    assert not policy.should_retry('GET', 0, status_code=404)
+
+    assert not policy.should_retry('POST', 0, status_code=502)
+    assert not policy.should_retry('POST', 0)
+    assert policy.should_retry('POST', 0, connect_failed=True)
+    assert policy.should_retry('POST', 0, status_code=502, idempotent=True)
+
+    assert all( 0 <= policy.delay(attempt) <= min(4, 2 ** attempt) for attempt in range(10) for _ in range(20) )
+    assert policy.n_retries == 200
+
+
+
+def test_rate_limiter_backs_off_and_recovers():
+    """
+    A 429 halves the rate and pauses for as long as Retry-After asks, successful requests raise the rate again up to its maximum.
+    """
+    limiter = Rate_limiter(rate=10, max_rate=11)
+
+    assert limiter.update(429, {'Retry-After':'2'}) == 2
+    assert limiter.rate == 5
+    assert 1.5 < limiter.reserve() <= 2
+
+    for _ in range(100):
+        assert limiter.update(200, {}) is None
+    assert limiter.rate == 11
+
+
+
+def test_throttled_requests_are_resent_until_they_go_through(tenant, config):
+    """
+    With a third of the requests throttled, a listing still completes and every throttled request was sent again.
+    """
+    with Mock_atlassian_server(tenant, page_limit=25, throttle_rate=0.3, retry_after=0, seed=1) as mock:
+        confluence = Confluence_cloud_api(dict(config, url=mock.url))
+        spaces     = confluence.get_spaces()
+
+        assert len(spaces) == len(tenant.spaces)
+        assert mock.n_throttled > 0
+        assert mock.n_requests == mock.n_throttled + len(spaces) // 25
+        assert confluence.session.rate_limiter.n_throttled == mock.n_throttled
@@ -0,0 +1,59 @@
+import json
+from mock_atlassian_server import Mock_atlassian_server, Synthetic_tenant
+from Confluence_apis import Checkpoint, Confluence_cloud_api
+
+
+
+def test_checkpoint_remembers_actions_across_runs(tmp_path):
+    """
+    Actions added to a checkpoint are found again when the file is opened anew, whatever the order of their keys.
+    """
+    path       = str(tmp_path / 'plan.done')
+    checkpoint = Checkpoint(path)
+    checkpoint.add({'op':'remove_user_from_group', 'user_id':'u1', 'group_id':'g1'})
+    checkpoint.add({'op':'remove_user_from_group', 'user_id':'u1', 'group_id':'g1'})
+    checkpoint.close()
+
+    resumed = Checkpoint(path)
+    assert {'group_id':'g1', 'user_id':'u1', 'op':'remove_user_from_group'} in resumed
+    assert {'group_id':'g1', 'user_id':'u2', 'op':'remove_user_from_group'} not in resumed
+    resumed.close()
+
+    with open(path) as log:
+        assert len(log.readlines()) == 1
+
+
+
+def test_interrupted_group_changes_resume_where_they_stopped(tmp_path, config, monkeypatch):
+    """
+    Group changes that failed in the first run are the only ones sent in the second run with the same checkpoint.
+    """
+    with Mock_atlassian_server(Synthetic_tenant(n_users=100, n_spaces=10, seed=3), page_limit=25) as mock:
+        confluence = Confluence_cloud_api(dict(config, url=mock.url))
+        group      = min(confluence.get_groups(), key=lambda group: len(mock.tenant.members[group['id']]))
+        members    = { member['accountId'] for member in confluence.get_group_members(group['id']) }
+        user_ids   = [ user['accountId'] for user in mock.tenant.users if user['accountId'] not in members ][:20]
+        changes    = [ (user_id, group['id'], 'add') for user_id in user_ids ]
+        checkpoint = str(tmp_path / 'changes.done')
+
+        # the first run fails for the last five users
+        handle = mock.handle
+        def failing(method, path, query, body):
+            if method == 'POST' and (body or {}).get('accountId') in user_ids[15:]:
+                return 400, {}, {'statusCode':400, 'message':"Failing on purpose"}
+            return handle(method, path, query, body)
+        monkeypatch.setattr(mock, 'handle', failing)
+
+        summary = confluence.mutate_groups(changes, checkpoint=checkpoint)
+        assert (summary['done'], summary['failed'], summary['skipped']) == (15, 5, 0)
+
+        # the second run only sends the failed ones
+        monkeypatch.setattr(mock, 'handle', handle)
+        mock.reset_counters()
+        summary = confluence.mutate_groups(changes, checkpoint=checkpoint)
+
+        assert (summary['done'], summary['failed'], summary['skipped']) == (5, 0, 15)
+        assert mock.n_requests == 5
+        assert set(user_ids) <= { mock.tenant.users[n]['accountId'] for n in mock.tenant.members[group['id']] }
+        with open(checkpoint) as log:
+            assert len([ json.loads(line) for line in log ]) == 20
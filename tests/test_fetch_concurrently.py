@@ -0,0 +1,38 @@
+import time
+import threading
+import pytest
+from Confluence_apis import fetch_concurrently
+
+
+
+def test_failed_fetch_cancels_the_queued_ones():
+    """
+    When a fetch raises, the error comes out right away and the items still queued are never fetched.
+    """
+    fetched = []
+    lock    = threading.Lock()
+
+    def fetch(n):
+        if n == 0:
+            raise ValueError("failed")
+        time.sleep(0.01)
+        with lock:
+            fetched.append(n)
+        return n
+
+    started = time.time()
+    with pytest.raises(ValueError):
+        for item, result in fetch_concurrently(fetch, range(1000), workers=4):
+            pass
+
+    assert len(fetched) < 100
+    assert time.time() - started < 1
+
+
+
+def test_results_of_all_items_are_yielded():
+    """
+    Without failures every item is fetched once.
+    """
+    results = dict(fetch_concurrently(lambda n: n * 2, range(50), workers=4))
+    assert results == { n:n * 2 for n in range(50) }
@@ -0,0 +1,62 @@
+import math
+from Confluence_apis import Confluence_cloud_api, Confluence_server_api, Jira_cloud_api
+
+
+
+def pages(n_results, page_size=25):
+    """
+    The requests a listing of {n_results} should cost, one per page and one more to find out a full last page was the last.
+    """
+    return n_results // page_size + 1 if n_results % page_size == 0 else math.ceil(n_results / page_size)
+
+
+
+def test_spaces_follow_next_links_without_overshooting(mock, config):
+    """
+    The space listing has _links.next but no total, so its pages are followed one by one, one request per page.
+    """
+    mock.reset_counters()
+    spaces = Confluence_cloud_api(config).get_spaces()
+
+    assert len(spaces) == len(mock.tenant.spaces)
+    assert mock.n_requests == math.ceil(len(spaces) / 25)
+
+
+
+def test_search_with_total_is_prefetched_up_to_the_end(mock, config):
+    """
+    The user search tells the total, so pages are fetched concurrently but never past the last one.
+    """
+    mock.reset_counters()
+    users = Confluence_cloud_api(config).get_search_users()
+
+    assert len(users) == sum(1 for user in mock.tenant.users if not user['guest'])
+    assert mock.n_requests == math.ceil(len(users) / 25)
+
+
+
+def test_plain_list_costs_one_request_per_page(mock, config):
+    """
+    Jira lists users as a plain list without links or total, the only end marker is a short or empty page.
+    """
+    mock.reset_counters()
+    users = Jira_cloud_api(config).get_users()
+
+    assert len(users) == len(mock.tenant.users)
+    assert mock.n_requests == pages(len(users))
+
+
+
+def test_server_users_fetch_each_page_once(mock, config):
+    """
+    Server get_users costs the search pages, the group listing and one listing per group, none of them fetched past the end.
+    """
+    mock.reset_counters()
+    users = Confluence_server_api(config).get_users()
+
+    search_pages = math.ceil(sum(1 for user in mock.tenant.users if not user['disabled']) / 25)
+    group_pages  = math.ceil(len(mock.tenant.groups) / 25)
+    member_pages = sum(max(math.ceil(len(members) / 25), 1) for members in mock.tenant.members.values())
+
+    assert len(users) == len({ user['username'] for user in users }) == len(mock.tenant.users)
+    assert mock.n_requests == search_pages + group_pages + member_pages
@@ -0,0 +1,35 @@
+from Confluence_apis import Access_matrix, Permission_index
+
+
+
+def space(key, users=(), groups=()):
+    """
+    A space as fetched with expand=permissions, with read-space granted to server {users} and {groups}.
+    """
+    subjects = {
+                    'user'  : {'results':[ {'username':user, 'displayName':user.title()} for user in users ]},
+                    'group' : {'results':[ {'name':group} for group in groups ]},
+               }
+    return {'id':hash(key), 'key':key, 'name':key, 'type':'global', 'status':'current', 'permissions':[ {'operation':{'operation':'read', 'targetType':'space'}, 'subjects':subjects} ]}
+
+
+
+def test_user_and_group_with_the_same_name_stay_apart():
+    """
+    On Confluence Server a user and a group can share a name, which must not merge them into one subject.
+    """
+    index = Permission_index(user_id_key='username', group_id_key='name')
+    index.add_spaces([ space('A', users=['team']), space('B', groups=['team']) ])
+    index.add_group_members({'name':'team'}, [ {'username':'alice'} ])
+
+    assert sorted(index.user_ids()) == ['alice', 'team']
+    assert index.subject_type('team') == 'user'
+    assert index.spaces_of('team') == {'A'}
+    assert index.spaces_of('team', subject_type='group') == {'B'}
+    assert index.spaces_of('alice') == {'B'}
+    assert index.members_of('team') == {'alice'}
+    assert index.subjects_of('B') == {'team'}
+
+    matrix = Access_matrix(index)
+    assert matrix.spaces_of('team') == ['A']
+    assert matrix.spaces_of('alice') == ['B']
@@ -0,0 +1,82 @@
+import time
+from mock_atlassian_server import Mock_atlassian_server, Synthetic_tenant
+from Confluence_apis import Confluence_cloud_api, Snapshot_store
+
+
+
+def test_stale_listings_are_fetched_again(tmp_path):
+    """
+    A listing older than the max age is fetched again and stored, a fresh one is read from disk.
+    """
+    store   = Snapshot_store('test', directory=str(tmp_path), max_age=60)
+    fetches = []
+    fetch   = lambda: fetches.append(1) or ['fetched']
+
+    store.save('spaces.None', ['stored'], fetched=time.time() - 120)
+    assert store.load('spaces.None') is None
+    assert store.cached('spaces.None', fetch) == ['fetched']
+
+    assert store.cached('spaces.None', fetch) == ['fetched']
+    assert len(fetches) == 1
+    assert Snapshot_store('test', directory=str(tmp_path), max_age=None).load('spaces.None') == ['fetched']
+
+
+
+def test_refresh_without_changes_only_asks_what_changed(tmp_path, config, mock):
+    """
+    Refreshing an unchanged snapshot costs the change queries and the group list, and makes the snapshot fresh again, so the listings
+    are then read from disk without any requests.
+    """
+    config     = dict(config, snapshot_dir=str(tmp_path))
+    confluence = Confluence_cloud_api(config)
+    confluence.use_snapshot('test', max_age=60)
+    confluence.get_spaces(expand='permissions')
+    groups = confluence.get_groups()
+    users  = confluence.get_users()
+
+    # age the snapshot past its max age
+    for key in ('spaces.permissions', 'groups.None', 'users'):
+        confluence.snapshot.save(key, confluence.snapshot.read(key)['data'], fetched=time.time() - 120)
+
+    mock.reset_counters()
+    confluence.use_snapshot('test', max_age=60, refresh=True)
+    assert confluence.snapshot.read('users')['fetched'] > time.time() - 60
+    assert { endpoint for endpoint, count in mock.endpoints.items() if count } == {'GET /wiki/rest/api/search', 'GET /wiki/rest/api/audit', 'GET /wiki/rest/api/group'}
+
+    mock.reset_counters()
+    stored = Confluence_cloud_api(config)
+    stored.use_snapshot('test', max_age=60)
+    assert len(stored.get_spaces(expand='permissions')) == len(mock.tenant.spaces)
+    assert stored.get_groups() == groups
+    assert len(stored.get_users()) == len(users)
+    assert mock.n_requests == 0
+
+
+
+def test_refresh_drops_users_who_left_a_group_and_were_deleted(tmp_path, config):
+    """
+    Refreshing relists the members of a changed group, so a guest removed from the guest group and then deleted is gone from both the
+    group members and the users of the snapshot.
+    """
+    with Mock_atlassian_server(Synthetic_tenant(n_users=200, n_spaces=20, seed=2), page_limit=25) as mock:
+        config     = dict(config, url=mock.url, snapshot_dir=str(tmp_path))
+        confluence = Confluence_cloud_api(config)
+        confluence.use_snapshot('test')
+        confluence.get_spaces(expand='permissions')
+        guest_group = [ group for group in confluence.get_groups() if group['name'].startswith('confluence-guests-') ][0]
+        guest       = confluence.get_group_members(guest_group['id'])[0]
+        assert guest['accountId'] in { user['accountId'] for user in confluence.get_users() }
+
+        # remove the guest from the group and delete it
+        confluence.remove_user_from_group(guest['accountId'], guest_group['id'])
+        del mock.tenant.user_by_id[guest['accountId']]
+
+        # the audit log would name the group
+        confluence.get_changes_since = lambda since: {'space_keys':set(), 'space_names':set(), 'group_names':{guest_group['name']}, 'user_ids':set()}
+        refreshed = confluence.refresh_snapshot()
+
+        assert refreshed['groups'] == 1
+        stored = Confluence_cloud_api(config)
+        stored.use_snapshot('test')
+        assert guest['accountId'] not in { member['accountId'] for member in stored.get_group_members(guest_group['id']) }
+        assert guest['accountId'] not in { user['accountId'] for user in stored.get_users() }
@@ -1,14 +1,8 @@
 #!/usr/bin/env python
 import sys
-import requests
-from requests.auth import HTTPBasicAuth
-import json
-import yaml
-import pdb
-from pprint import pprint
-from Confluence_apis import Confluence_cloud_api
+from Confluence_apis import Confluence_cloud_api, Permission_index, Transfer_planner, pop_snapshot_args, pop_plan_args, write_plan, load_config
 import logging
-from collections import defaultdict
+from itertools import groupby
 
 # configure logging
 logging.basicConfig(
@@ -19,7 +13,7 @@ logging.basicConfig(
 
 
 # user help message
-usage = f"""Usage% python3 {sys.argv[0]} <atlassian config yaml file> <old user_or_group1>%<new user_or_group1> [<old user_or_group2>%<old user_or_group2> ... <old user_or_group_N>%<old user_or_groupN>]
+usage = f"""Usage% python3 {sys.argv[0]} <atlassian config yaml file> <old user_or_group1>%<new user_or_group1> [<old user_or_group2>%<old user_or_group2> ... <old user_or_group_N>%<old user_or_groupN>] [--snapshot <name> [--max-age <age, e.g. 12h>] [--refresh]] [--plan-only <plan file>]
 ex.
 python3 {sys.argv[0]} config.ini old_username%new_username old.user@email.com%new.user@email.com old-user-id-1111-46d1-8e68-edc48151b41a%new-user-id-1111-46d1-8e68-edc48151b41a
 or
@@ -27,8 +21,13 @@ python3 {sys.argv[0]} config.ini old_groupname%new_groupname old-group-id-1111-4
 
 Note:
 It should work to transfer user permissions to groups and vice versa.
+With --plan-only the permissions are written to the plan file instead of being applied, see apply_plan_on_confluence-cloud.py.
 """
 
+# take out the snapshot options before reading the positional arguments
+snapshot_name, max_age, refresh = pop_snapshot_args(sys.argv)
+plan_file = pop_plan_args(sys.argv)
+
 # get the arguments
 try:
     logging.debug("Fetching config filename.")
@@ -55,91 +54,45 @@ for pair in transfer_pairs:
 
 # read the atlassian config file
 logging.debug("Reading config file.")
-with open(atlassian_config_filename, 'r') as file:
-    try:
-        config = yaml.safe_load(file)
-    except yaml.YAMLError as exc:
-        print(exc)
+config = load_config(atlassian_config_filename)
 
 
 # create confluence api instance
 logging.debug("Creating confluence api object")
 confluence = Confluence_cloud_api(config)
 
+# reuse a stored inventory if asked to
+if snapshot_name:
+    confluence.use_snapshot(snapshot_name, max_age, refresh=refresh)
+
 # request a list of all spaces
 logging.info("Fetching spaces.")
 #spaces = confluence.get_spaces(expand="permissions", paginate=False)
 spaces = confluence.get_spaces(expand="permissions")
 #spaces = []
 
-# init
-user_permissions = {}
-group_permissions = {}
-
-# define a nested dict
-nested_dict    = lambda: defaultdict(nested_dict)
-permission_map = nested_dict()
-
-
-
 ## Get all user-space and group-space memberships
-# go through all spaces
 logging.info("Parsing permissions.")
-for space in spaces:
-    #continue
-    logging.debug(f"Space: {space['name']}")
-
-    # go through all permissions
-    for permission in space['permissions']:
-
-        # skip empty permissions
-        if 'subjects' not in permission.keys():
-            #pdb.set_trace()
-            continue
-
-        # for each subject with this permission
-        for subject_type, subject in permission['subjects'].items():
-
-            # skip metadata
-            if subject_type == '_expandable':
-                continue
-
-            # for each entity of this subject_type
-            for entity in subject['results']:
-
-                # set the name of the id key depending on type
-                id_key = 'accountId' if subject_type == 'user' else 'id'
-
-                # init
-                if entity[id_key] not in permission_map:
-                    permission_map[entity[id_key]] = {'type':subject_type, 'spaces':{}}
-                if space['id'] not in permission_map[entity[id_key]]['spaces']:
-                    permission_map[entity[id_key]]['spaces'][space['id']] = []
-
-                # save the permission
-                permission_map[entity[id_key]]['spaces'][space['id']].append(permission['operation'])
+index = Permission_index()
+index.add_spaces(spaces)
 
 
 # fetch all users and groups
 users          = confluence.get_users()
 groups         = confluence.get_groups()
 
-# add missing users to the permission map
-for user in users:
-    # check if the user id is new
-    if user['accountId'] not in permission_map:
-        permission_map[user['accountId']] = {'type':'user', 'spaces':{}}
-
-
-# add missing groups to the permission map
+# add missing users and groups to the index
+index.add_users(users)
 for group in groups:
-    # check if the group id is new
-    if group['id'] not in permission_map:
-        permission_map[group['id']] = {'type':'group', 'spaces':{}}
+    index.add_subject('group', group)
+
+# index the names of all users and groups
+planner = Transfer_planner(index)
 
 
 
 # process each pair
+plan = []
 for pair in transfer_pairs:
 
     # split the pair
@@ -148,144 +101,33 @@ for pair in transfer_pairs:
 
 #    pdb.set_trace()
 
-    # check if old entity is id or name
-    if old_entity in permission_map:
-        old_id = old_entity
-
-    # if not, check if it is a user or group
-    else:
-
-        # init
-        matches = []
-
-        # find matching users
-        matches += [ user['accountId'] for user in users if user['displayName'] == old_entity ]
-
-        # find matching group
-        matches += [ group['id'] for group in groups if group['name'] == old_entity ]
-
-        if len(matches) > 1:
-            logging.error(f"Fatal: multiple matching entities for name '{old_entity}'")
-            sys.exit()
-        elif len(matches) == 0:
-            logging.error(f"Fatal: no matching entities for name '{old_entity}'")
-            sys.exit()
-
-        # there is only one match, get the id
-        old_id = matches[0]
-
-
-
-    # check if new entity is id or name
-    if new_entity in permission_map:
-        new_id = new_entity
-
-    # if not, check if it is a user or group
-    else:
-
-        # init
-        matches = []
-
-        # find matching users
-        matches += [ user['accountId'] for user in users if user['displayName'] == new_entity ]
-
-        # find matching group
-        matches += [ group['id'] for group in groups if group['name'] == new_entity ]
-
-        if len(matches) > 1:
-            logging.error(f"Fatal: multiple matching entities for name '{new_entity}'")
-            sys.exit()
-        elif len(matches) == 0:
-            logging.error(f"Fatal: no matching entities for name '{new_entity}'")
-            sys.exit()
-
-        # there is only one match, get the id
-        new_id = matches[0]
-
-    
-    # for each permission in the old, make so in the new
-    old_permissions = permission_map[old_id]
-    new_permissions = permission_map[new_id]
+    # get the permissions the new entity is missing, read-space first in each space as it is needed to set any other permission
+    try:
+        grants = planner.plan(old_entity, new_entity)
+    except ValueError as e:
+        logging.error(f"Fatal: {e}")
+        sys.exit()
 
-    
-    # apply the old permissions to the new entity
-    for space_id, permissions in old_permissions['spaces'].items():
+    for space_key, space_grants in groupby(grants, key=lambda grant: grant['space_key']):
 
         # get space info
-        space      = [ space for space in spaces if space['id'] == space_id][0]
-        space_key  = space['key']
-        space_name = space['name']
+        space_name = index.space(space_key)['name']
 
-#        if space_key != '~tsadmin':
-#            continue
-#        else:
-#            pdb.set_trace()
-
-        # create human read#ablm permission string
-        permission_str = ", ".join(['read-space'] + [ f"{p['operation']}-{p['targetType']}" for p in permissions ]) 
+        # create human readable permission string
+        permission_str = ", ".join([ f"{grant['operation']}-{grant['target']}" for grant in space_grants ])
         logging.info(f"Adding following permissions to {new_entity} on space '{space_name}': {permission_str}")
 
-        # check if the new entity has read access to the space, as this is needed to set any other permission
-        space_read_permission = {'operation': 'read', 'targetType': 'space'}
-        if space_read_permission not in new_permissions['spaces'].get(space_id, []):
-            # add space read permission
-            confluence.add_permission_to_space(space_key, new_permissions['type'], new_id, 'space', 'read')
-
-
-        for permission in permissions:
-
-            # check if the new entity already have the old permission
-            if permission in new_permissions['spaces'].get(space_id, []):
-                continue
-
-
-
-            # add the permission to the new entity
-            logging.debug(f"Setting {permission} for {new_entity} on space {space_key}")
-            confluence.add_permission_to_space(space_key, new_permissions['type'], new_id, permission['targetType'], permission['operation'])
-    
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    # only plan the changes if asked to
+    if plan_file:
+        plan += [ {'op':'add_permission_to_space', **grant} for grant in grants ]
+        continue
 
+    # apply the old permissions to the new entity, spaces in parallel
+    results = confluence.add_permissions(grants)
+    failed  = [ result for result in results if not result['ok'] ]
+    if failed:
+        logging.error(f"{len(failed)} permissions could not be transferred from {old_entity} to {new_entity}.")
 
+# save the plan
+if plan_file:
+    write_plan(plan_file, plan)